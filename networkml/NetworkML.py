@@ -1,11 +1,22 @@
 import argparse
+import concurrent.futures
+import contextlib
+import functools
 import logging
 import os
+import time
 
 from networkml import __version__
 from networkml.algorithms.host_footprint import HostFootprint
 from networkml.featurizers.csv_to_features import CSVToFeatures
+from networkml.helpers.gzipio import CODECS
 from networkml.helpers.results_output import ResultsOutput
+from networkml.helpers.scheduler import auto_threads
+from networkml.helpers.scheduler import largest_first
+from networkml.helpers.scheduler import stage_threads_arg
+from networkml.helpers.scheduler import StagePipeline
+from networkml.helpers.scheduler import threads_arg
+from networkml.parsers.captures import capture_name
 from networkml.parsers.pcap_to_csv import PCAPToCSV
 
 
@@ -18,10 +29,24 @@ class NetworkML:
 
         # TODO: migrate stage-specific flags here.
         self.stage_args = {
-            'parser': {},
+            'parser': {
+                'cache_dir': {'help': 'directory to cache parser outputs in, keyed by PCAP content'},
+                'cache_size': {'help': 'MB the parser cache can use before the least recently used outputs are removed'},
+                'shard_size': {'help': 'split PCAPs bigger than this many MB into shards parsed in parallel, native packet engine only'},
+                'exact_quantiles': {'help': 'make host level quantiles exact rather than sketched, with memory per distinct value', 'action': 'store_true'},
+                'flow_timeout': {'help': 'seconds before an idle flow is closed, 0 for never, native flow engine only'},
+                'max_flows': {'help': 'most live flows before the least recently seen is closed, 0 for no limit, native flow engine only'},
+                'codec': {'help': 'compression of csv files between stages', 'choices': CODECS},
+                'compress_level': {'help': 'compression level, higher is smaller and slower'},
+                'compress_threads': {'help': 'threads per worker to compress csv files in blocks with'},
+            },
             'featurizer': {
                 'srcmacid': {'help': 'attempt to detect canonical source MAC and featurize only that MAC', 'action': 'store_true'},
                 'no-srcmacid': {'help': 'featurize all MACs', 'action': 'store_true'},
+                'chunk_rows': {'help': 'featurize each file this many rows at a time, in bounded memory'},
+                'sketch': {'help': 'approximate quantiles and unique IP counts with sketches, so memory per host is bounded', 'action': 'store_true'},
+                'quantile_error': {'help': 'relative error of sketched quantiles'},
+                'distinct_error': {'help': 'standard error of sketched unique IP counts'},
             },
             'algorithm': {
                 'trained_model': {'help': 'specify a path to load or save trained model'},
@@ -44,12 +69,18 @@ class NetworkML:
         self.final_stage = parsed_args.final_stage
         self.groups = parsed_args.groups
         self.gzip_opt = parsed_args.gzip
+        self.format_opt = parsed_args.format
         self.level = parsed_args.level
+        self.in_memory = parsed_args.in_memory
         self.operation = parsed_args.operation
         self.output = parsed_args.output
         self.threads = parsed_args.threads
         self.list = parsed_args.list
         self.log_level = parsed_args.verbose
+        self.watch = parsed_args.watch
+        self.watch_interval = parsed_args.watch_interval
+        self.pipeline = parsed_args.pipeline
+        self.stage_threads = parsed_args.stage_threads
         for args in self.stage_args.values():
             for arg in args:
                 val = getattr(parsed_args, arg, None)
@@ -60,17 +91,21 @@ class NetworkML:
 
     def parse_args(self, raw_args=None):
         parser = argparse.ArgumentParser(description='networkml %s' % __version__)
-        parser.add_argument('path', help='path to a single pcap file, or a directory of pcaps to parse', default='/pcaps')
+        parser.add_argument('path', nargs='?', help='path to a single pcap file, or a directory of pcaps to parse', default='/pcaps')
         parser.add_argument('--algorithm', '-a', choices=[
                             'host_footprint'], default='host_footprint', help='choose which algorithm to use (default=host_footprint)')
-        parser.add_argument('--engine', '-e', choices=['pyshark', 'tshark', 'host'],
+        parser.add_argument('--engine', '-e', choices=['pyshark', 'tshark', 'tshark_fields', 'native', 'host'],
                             default='tshark', help='engine to use to process the PCAP file (default=tshark)')
         parser.add_argument('--first_stage', '-f', choices=['parser', 'featurizer', 'algorithm'], default='parser',
                             help='choose which stage to start at, `path` arg is relative to stage (default=parser)')
         parser.add_argument('--final_stage', choices=['parser', 'featurizer', 'algorithm'],
                             default='algorithm', help='choose which stage to finish at (default=algorithm)')
+        parser.add_argument('--format', '-F', choices=['csv', 'npz'], default='csv',
+                            help='format between stages, gzipped csv or typed columnar npz (default=csv)')
         parser.add_argument('--groups', '-g', default='host',
                             help='groups of comma separated features to use (default=host)')
+        parser.add_argument('--in_memory', action='store_true',
+                            help='pass DataFrames between stages instead of writing and reading files, when running with one thread')
         parser.add_argument('--gzip', '-z', choices=['input', 'output', 'both'], default='both',
                             help='use gzip between stages, useful when not using all 3 stages (default=both)')
         parser.add_argument('--level', '-l', choices=['packet', 'flow', 'host'],
@@ -79,10 +114,18 @@ class NetworkML:
                             help='choose which operation task to perform, train or predict (default=predict)')
         parser.add_argument('--output', '-o', default=None,
                             help='directory to write out any results files to')
-        parser.add_argument('--threads', '-t', default=1, type=int,
-                            help='number of async threads to use (default=1)')
+        parser.add_argument('--pipeline', action='store_true',
+                            help='run each pcap through all the stages on its own, sharing the --threads workers between stages, with results in a directory per pcap under --output as each finishes')
+        parser.add_argument('--stage_threads', default=None, type=stage_threads_arg,
+                            help='most workers each stage can use at once with --pipeline, as comma separated stage:threads, e.g. parser:3,algorithm:1 (default=None, no limits)')
+        parser.add_argument('--threads', '-t', default=1, type=threads_arg,
+                            help='number of async threads to use, or auto for as many as CPUs and memory allow (default=1)')
         parser.add_argument('--verbose', '-v', choices=[
                             'DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='logging level (default=INFO)')
+        parser.add_argument('--watch', default=None,
+                            help='keep running, and run each pcap that lands in this directory through the stages, with results in a directory per pcap under --output (default=None, run path once)')
+        parser.add_argument('--watch_interval', default=5, type=float,
+                            help='seconds between checks of the --watch directory (default=5)')
         for stage, args in self.stage_args.items():
             for arg, arg_parms in args.items():
                 arg_help = '%s (%s)' % (arg_parms['help'], stage)
@@ -106,24 +149,43 @@ class NetworkML:
                     raw_args.append(str(val))
         return raw_args
 
-    def run_parser_stage(self, in_path):
+    def run_parser_stage(self, in_path, in_memory=False):
         raw_args = self.add_opt_args(self.stage_args['parser'])
-        raw_args.extend(['-e', self.engine, '-l', self.level,
+        if self.level == 'host':
+            # host level parser output is already features, combined as the featurizer would.
+            # the parser aggregates hosts a packet at a time already, and only needs srcmacid
+            # and the error its quantiles are sketched to.
+            raw_args.extend(self.add_opt_args(
+                {arg: arg_parms for arg, arg_parms in self.stage_args['featurizer'].items()
+                 if arg.endswith('srcmacid') or arg == 'quantile_error'}))
+            raw_args.append('-c')
+        raw_args.extend(['-e', self.engine, '-l', self.level, '-F', self.format_opt,
             '-o', self.output, '-t', str(self.threads), '-v', self.log_level, in_path])
-        instance = PCAPToCSV(raw_args=raw_args)
-        return instance.main()
+        instance = PCAPToCSV(raw_args=raw_args, in_memory=in_memory)
+        result = instance.main()
+        if result is None:
+            raise ValueError(f'no output from {in_path}')
+        return result
 
-    def run_featurizer_stage(self, in_path):
+    def run_featurizer_stage(self, in_path, in_memory=False):
+        in_frames = None
+        if not isinstance(in_path, str):
+            in_frames = in_path
+            in_path = self.in_path
         raw_args = self.add_opt_args(self.stage_args['featurizer'])
-        raw_args.extend(['-c', '-g', self.groups, '-z', self.gzip_opt,
+        raw_args.extend(['-c', '-g', self.groups, '-z', self.gzip_opt, '-F', self.format_opt,
             '-o', self.output, '-t', str(self.threads), '-v', self.log_level, in_path])
-        instance = CSVToFeatures(raw_args=raw_args)
+        instance = CSVToFeatures(raw_args=raw_args, in_frames=in_frames, in_memory=in_memory)
         return instance.main()
 
-    def run_algorithm_stage(self, in_path):
+    def run_algorithm_stage(self, in_path, in_memory=False):
+        in_frame = None
+        if not isinstance(in_path, str):
+            in_frame = in_path
+            in_path = self.in_path
         raw_args = self.add_opt_args(self.stage_args['algorithm'])
-        raw_args.extend(['-O', self.operation, '-v', self.log_level, in_path])
-        instance = HostFootprint(raw_args=raw_args)
+        raw_args.extend(['-O', self.operation, '-F', self.format_opt, '-v', self.log_level, in_path])
+        instance = HostFootprint(raw_args=raw_args, in_frame=in_frame)
         return instance.main()
 
     def output_results(self, result_json_str, run_complete):
@@ -133,18 +195,21 @@ class NetworkML:
             if self.final_stage == 'algorithm' and self.operation == 'predict':
                 if self.output and os.path.isdir(self.output):
                     uid = os.getenv('id', 'None')
-                    file_path = os.getenv('file_path', self.in_path)
+                    file_path = self.in_path
+                    if not self.watch and not self.pipeline:
+                        file_path = os.getenv('file_path', self.in_path)
                     results_outputter = ResultsOutput(self.logger, uid, file_path)
                     result_json_file_name = os.path.join(self.output, 'predict.json')
                     results_outputter.output_from_result_json(result_json_str, result_json_file_name)
 
-    def run_stages(self):
-        stages = ('parser', 'featurizer', 'algorithm')
-        stage_runners = {
+    def stage_runners(self):
+        return {
             'parser': self.run_parser_stage,
             'featurizer': self.run_featurizer_stage,
             'algorithm': self.run_algorithm_stage}
 
+    def stage_schedule(self):
+        stages = ('parser', 'featurizer', 'algorithm')
         try:
             first_stage_index = stages.index(self.first_stage)
             final_stage_index = stages.index(self.final_stage)
@@ -157,19 +222,173 @@ class NetworkML:
             return
 
         run_schedule = stages[first_stage_index:(final_stage_index+1)]
+        if self.level == 'host' and 'parser' in run_schedule:
+            # the parser aggregates hosts itself, so there's nothing to featurize.
+            run_schedule = tuple(stage for stage in run_schedule if stage != 'featurizer')
+        return run_schedule
+
+    def run_stages(self):
+        stage_runners = self.stage_runners()
+        run_schedule = self.stage_schedule()
+        if not run_schedule:
+            return
         result = self.in_path
         self.logger.info(f'running stages: {run_schedule}')
+        in_memory = self.in_memory
+        if in_memory and self.threads != 1:
+            self.logger.info('Passing files between stages, as --in_memory needs --threads 1')
+            in_memory = False
 
         run_complete = False
         try:
-            for stage in run_schedule:
+            for i, stage in enumerate(run_schedule):
                 runner = stage_runners[stage]
-                result = runner(result)
+                # only the final stage's output has to be a file, for whatever runs next.
+                result = runner(result, in_memory=in_memory and i < len(run_schedule) - 1)
             run_complete = True
         except Exception as err:
-            self.logger.error(f'Could not run stage: {err}')
+            self.logger.error(f'Could not run {stage} stage: {err}')
 
         self.output_results(result, run_complete)
 
+    def watch_captures(self, seen, done):
+        """
+        Captures in the watch directory that haven't been run yet, and whose size and mtime
+        haven't changed since the last call, so they are completely written.
+        """
+        ready = []
+        for root, _, files in os.walk(self.watch):
+            for pathfile in sorted(files):
+                if not PCAPToCSV.ispcap(pathfile):
+                    continue
+                path = os.path.join(root, pathfile)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                version = (stat.st_size, stat.st_mtime_ns)
+                if seen.get(path, None) == version and done.get(path, None) != version:
+                    ready.append(path)
+                    done[path] = version
+                seen[path] = version
+        return ready
+
+    @contextlib.contextmanager
+    def capture_context(self, capture, root):
+        in_path = self.in_path
+        output = self.output
+        self.in_path = capture
+        # each capture gets its own directory for its stage outputs and predict.json.
+        self.output = os.path.join(
+            output or root, os.path.splitext(capture_name(os.path.basename(capture)))[0])
+        os.makedirs(self.output, exist_ok=True)
+        try:
+            yield
+        finally:
+            self.in_path = in_path
+            self.output = output
+
+    def run_capture(self, capture):
+        with self.capture_context(capture, self.watch):
+            self.run_stages()
+
+    def worker_options(self):
+        options = {
+            'in_path': self.in_path,
+            'engine': self.engine,
+            'level': self.level,
+            'format_opt': self.format_opt,
+            'groups': self.groups,
+            'gzip_opt': self.gzip_opt,
+            'operation': self.operation,
+            'output': self.output,
+            'threads': self.threads,
+            'log_level': self.log_level,
+            'stage_args': self.stage_args,
+        }
+        for args in self.stage_args.values():
+            for arg in args:
+                val = getattr(self, arg, None)
+                if val is not None:
+                    options[arg] = val
+        return options
+
+    def run_pipeline_stage(self, stage, root, capture, in_path):
+        threads = self.threads
+        # the pool is shared between stages, so each stage of a capture runs on one worker.
+        self.threads = 1
+        try:
+            with self.capture_context(capture, root):
+                return self.stage_runners()[stage](in_path)
+        finally:
+            self.threads = threads
+
+    def pipeline_inputs(self):
+        if not os.path.isdir(self.in_path):
+            return [self.in_path]
+        is_input = PCAPToCSV.ispcap if self.first_stage == 'parser' else CSVToFeatures.iscsv
+        in_paths = [os.path.join(root, pathfile)
+                    for root, _, files in os.walk(self.in_path) for pathfile in sorted(files) if is_input(pathfile)]
+        # biggest first, so a big capture started last doesn't finish long after the rest.
+        return [in_paths[i] for i in largest_first(in_paths)]
+
+    def run_pipeline(self):
+        run_schedule = self.stage_schedule()
+        if not run_schedule:
+            return
+        in_paths = self.pipeline_inputs()
+        root = self.in_path if os.path.isdir(self.in_path) else os.path.dirname(self.in_path)
+        threads = self.threads
+        if threads == 'auto':
+            threads = auto_threads(tasks=len(in_paths))
+        self.logger.info(f'Pipelining stages {run_schedule} for {len(in_paths)} input(s) on {threads} workers')
+        stages = [(stage, functools.partial(pipeline_stage_worker, self.worker_options(), stage, root)) for stage in run_schedule]
+        with contextlib.ExitStack() as stack:
+            executor = None
+            if threads > 1:
+                executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=threads))
+            pipeline = StagePipeline(stages, executor, threads, self.stage_threads)
+            finished = 0
+            for in_path, result, err in pipeline.run(in_paths):
+                if err is not None:
+                    self.logger.error(f'Could not run the {err.stage} stage for {in_path}: {err.err}')
+                    continue
+                # results are written out as each capture finishes, not after all of them.
+                with self.capture_context(in_path, root):
+                    self.output_results(result, True)
+                finished += 1
+                self.logger.info(f'Finished {in_path}. {finished}/{len(in_paths)} done.')
+        pipeline.stats.report(self.logger, threads)
+
+    def watch_dir(self):
+        # everything is imported, and the models are loaded on the first capture, just once.
+        self.logger.info(f'Watching {self.watch} for pcaps every {self.watch_interval}s')
+        seen = {}
+        done = {}
+        while True:
+            for capture in self.watch_captures(seen, done):
+                self.logger.info(f'Running {capture}')
+                self.run_capture(capture)
+            time.sleep(self.watch_interval)
+
     def main(self):
-        self.run_stages()
+        if self.watch:
+            self.watch_dir()
+        elif self.pipeline:
+            self.run_pipeline()
+        else:
+            self.run_stages()
+
+
+def worker_instance(options):
+    # a new instance in the worker, so the pool doesn't have to pickle the calling one.
+    instance = NetworkML.__new__(NetworkML)
+    instance.logger = logging.getLogger(__name__)
+    for option, val in options.items():
+        setattr(instance, option, val)
+    return instance
+
+
+def pipeline_stage_worker(options, stage, root, capture, in_path):
+    return worker_instance(options).run_pipeline_stage(stage, root, capture, in_path)
+
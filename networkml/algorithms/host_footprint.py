@@ -22,6 +22,8 @@ from sklearn.neural_network import MLPClassifier
 from sklearn.preprocessing import LabelBinarizer
 
 import networkml
+from networkml.helpers.gzipio import text_reader
+from networkml.helpers.npzio import read_npz
 
 
 class HostFootprint():
@@ -35,11 +37,18 @@ class HostFootprint():
     the origin or source.
     """
 
-    def __init__(self, raw_args=None):
+    # loaded models by loader and path, kept for the life of the process (see --watch).
+    MODEL_CACHE = {}
+
+    def __init__(self, raw_args=None, in_frame=None):
         self.logger = logging.getLogger(__name__)
         self.raw_args = raw_args
+        # features for path, when the previous stage ran in memory in this process.
+        self.in_frame = in_frame
+        self.path = None
         self.list = None
         self.model_path = None
+        self.format = 'csv'
 
     @staticmethod
     def regularize_df(df):
@@ -191,6 +200,19 @@ class HostFootprint():
     def deserialize_scaler(path):
         return joblib.load(path)
 
+    @classmethod
+    def load_cached(cls, loader, path):
+        """
+        Load path with loader, reusing what was loaded before unless the file has changed.
+        """
+        key = (loader.__name__, path)
+        mtime = os.stat(path).st_mtime_ns
+        cached = cls.MODEL_CACHE.get(key, None)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, loader(path))
+            cls.MODEL_CACHE[key] = cached
+        return cached[1]
+
     @staticmethod
     def parse_args(raw_args=None):
         """
@@ -202,6 +224,9 @@ class HostFootprint():
         parser.add_argument('path', help='path to a single csv file')
         parser.add_argument('--eval_data',
                             help='path to eval CSV file, if training')
+        parser.add_argument('--format', '-F', choices=['csv', 'npz'],
+                            default='csv',
+                            help='format of the features file(s), csv or typed columnar npz (default=csv)')
         parser.add_argument('--kfolds', '-k',
                             default=5,
                             help='specify number of folds for k-fold cross validation')
@@ -234,8 +259,16 @@ class HostFootprint():
         parsed_args = parser.parse_args(raw_args)
         return parsed_args
 
+    def read_features(self, path):
+        if self.in_frame is not None and path == self.path:
+            return self.in_frame
+        if self.format == 'npz':
+            return read_npz(path)
+        with text_reader(path) as f_in:
+            return pd.read_csv(f_in)
+
     def _get_test_train_csv(self, path, train_unknown):
-        df, _, _, _ = self.regularize_df(pd.read_csv(path))
+        df, _, _, _ = self.regularize_df(self.read_features(path))
         df = df.fillna(0)
         # Split dataframe into X (the input features or predictors)
         # and y (the target or outcome or dependent variable)
@@ -343,14 +376,14 @@ class HostFootprint():
         dict for a value. see sorted_roles_to_json() for a description of
         the value's structure.
         """
-        scaler = self.deserialize_scaler(self.scaler)
+        scaler = self.load_cached(self.deserialize_scaler, self.scaler)
         # Get label encoder
-        le = self.deserialize_label_encoder(self.le_path)
+        le = self.load_cached(self.deserialize_label_encoder, self.le_path)
         # Load (or deserialize) model from JSON
-        self.model = self.deserialize_model(self.model_path)
+        self.model = self.load_cached(self.deserialize_model, self.model_path)
 
         # Load data from host footprint .csv
-        csv_df = pd.read_csv(self.path)
+        csv_df = self.read_features(self.path)
         df, host_key, tshark_srcips, frame_epoch = self.regularize_df(csv_df)
         # Split dataframe into X (the input features or predictors)
         # and y (the target or outcome or dependent variable)
@@ -408,7 +441,10 @@ class HostFootprint():
             if host_key is not None:
                 host_results.update({'source_mac': host_key[i]})
             if tshark_srcips is not None:
-                source_ip = ast.literal_eval(tshark_srcips[i])
+                source_ip = tshark_srcips[i]
+                # a list, unless it has been through a CSV or npz file.
+                if isinstance(source_ip, str):
+                    source_ip = ast.literal_eval(source_ip)
                 if source_ip:
                     source_ip = source_ip[0]
                 else:
@@ -519,6 +555,7 @@ class HostFootprint():
         self.kfolds = int(parsed_args.kfolds)
         self.train_unknown = parsed_args.train_unknown
         self.list = parsed_args.list
+        self.format = parsed_args.format
         operation = parsed_args.operation
         log_level = parsed_args.verbose
 
@@ -8,35 +8,57 @@ from collections import Counter
 from collections import defaultdict
 
 import numpy as np
+import pandas as pd
 
 import networkml
 from networkml.featurizers.main import Featurizer
-from networkml.helpers.gzipio import gzip_reader
+from networkml.helpers.csv_combiner import CSVCombiner
+from networkml.helpers.csv_row_writer import csv_header
 from networkml.helpers.gzipio import gzip_writer
-from networkml.helpers.pandas_csv_importer import import_csv
+from networkml.helpers.npzio import concat_dfs
+from networkml.helpers.npzio import frame_chunks
+from networkml.helpers.npzio import import_frame
+from networkml.helpers.npzio import import_pcap_chunks
+from networkml.helpers.npzio import import_pcap_df
+from networkml.helpers.npzio import read_npz
+from networkml.helpers.npzio import write_npz
+from networkml.helpers.scheduler import auto_threads
+from networkml.helpers.scheduler import file_size
+from networkml.helpers.scheduler import largest_first
+from networkml.helpers.scheduler import threads_arg
+from networkml.helpers.scheduler import timed_call
+from networkml.helpers.scheduler import WorkerStats
+from networkml.helpers.sketches import DistinctSketch
+from networkml.helpers.sketches import QuantileSketch
+
+# rough peak memory featurizing a file takes, per byte of compressed input.
+FEATURIZER_MEMORY_RATIO = 50
+# rows at a time to sketch with, if --chunk_rows doesn't say.
+SKETCH_CHUNK_ROWS = 100000
 
 
 class CSVToFeatures():
 
-    def __init__(self, raw_args=None):
+    def __init__(self, raw_args=None, in_frames=None, in_memory=False):
         self.logger = logging.getLogger(__name__)
         self.raw_args = raw_args
+        # parser outputs by path, when the parser ran in memory in this process.
+        self.in_frames = in_frames
+        # in memory, outputs are kept here as DataFrames by output path, and not written.
+        self.frames = {} if in_memory else None
 
     @staticmethod
-    def get_reader(in_file, use_gzip):
+    def get_writer(out_file, use_gzip, header=None):
         if use_gzip:
-            return gzip_reader(in_file)
-        return open(in_file, 'r')
-
-    @staticmethod
-    def get_writer(out_file, use_gzip):
-        if use_gzip:
-            return gzip_writer(out_file)
-        return open(out_file, 'w')
+            return gzip_writer(out_file, header=header)
+        f_out = open(out_file, 'w')
+        if header is not None:
+            f_out.write(header)
+        return f_out
 
     @staticmethod
     def iscsv(pathfile):
-        for ext in ('csv', 'gz'):
+        for ext in ('csv', 'gz', 'zst', 'lz4', 'npz'):
             if pathfile.endswith(''.join(('.', ext))):
                 return True
         return False
@@ -44,37 +66,25 @@ class CSVToFeatures():
     @staticmethod
     def write_features_to_csv(header, rows, out_file, gzip_opt):
         use_gzip = gzip_opt in ['output', 'both']
-        with CSVToFeatures.get_writer(out_file, use_gzip) as f_out:
+        with CSVToFeatures.get_writer(out_file, use_gzip, header=csv_header(header)) as f_out:
             writer = csv.DictWriter(f_out, fieldnames=header)
-            writer.writeheader()
             writer.writerows(rows)
 
     @staticmethod
-    def combine_csvs(out_paths, combined_path, gzip_opt):
-        # First determine the field names from the top line of each input file
-        fieldnames = {'filename'}
-        use_gzip = gzip_opt in ['output', 'both']
+    def combined_filename(out_file, gzip_opt):
+        if gzip_opt in ['output', 'both']:
+            return out_file.split('/')[-1].split('.features.gz')[0]
+        return out_file.split('/')[-1].split('.features')[0]
+
+    @staticmethod
+    def combine_npzs(out_paths, combined_path):
+        dfs = []
         for filename in out_paths:
-            with CSVToFeatures.get_reader(filename, use_gzip) as f_in:
-                reader = csv.reader(f_in)
-                fieldnames.update({header for header in next(reader)})
-
-        # Then copy the data
-        with CSVToFeatures.get_writer(combined_path, use_gzip) as f_out:
-            writer = csv.DictWriter(f_out, fieldnames=list(fieldnames))
-            writer.writeheader()
-            for filename in out_paths:
-                with CSVToFeatures.get_reader(filename, use_gzip) as f_in:
-                    reader = csv.DictReader(f_in)
-                    for line in reader:
-                        if use_gzip:
-                            line['filename'] = filename.split(
-                                '/')[-1].split('.features.gz')[0]
-                        else:
-                            line['filename'] = filename.split(
-                                '/')[-1].split('.features')[0]
-                        writer.writerow(line)
-                CSVToFeatures.cleanup_files([filename])
+            df = read_npz(filename)
+            df['filename'] = filename.split('/')[-1].split('.features.npz')[0]
+            dfs.append(df)
+        write_npz(concat_dfs(dfs), combined_path)
+        CSVToFeatures.cleanup_files(out_paths)
 
     @staticmethod
     def cleanup_files(paths):
@@ -88,10 +98,14 @@ class CSVToFeatures():
         parser = argparse.ArgumentParser()
         parser.add_argument(
             'path', help='path to a single gzipped csv file, or a directory of gzipped csvs to parse')
+        parser.add_argument('--chunk_rows', default=0, type=int,
+                            help='featurize each file this many rows at a time, in bounded memory, if all the functions can (default=0, all at once)')
         parser.add_argument('--combined', '-c', action='store_true',
                             help='write out all records from all csvs into a single gzipped csv file')
         parser.add_argument('--features_path', '-p', default=os.path.join(
             netml_path[0], 'featurizers/funcs'), help='path to featurizer functions')
+        parser.add_argument('--format', '-F', choices=['csv', 'npz'], default='csv',
+                            help='write csv or typed columnar npz files, input format is detected (default=csv)')
         parser.add_argument('--functions', '-f', default='',
                             help='comma separated list of <class>:<function> to featurize (default=None)')
         parser.add_argument('--groups', '-g', default='host',
@@ -100,8 +114,14 @@ class CSVToFeatures():
                             default='both', help='gzip the input/output file, both or neither (default=both)')
         parser.add_argument('--output', '-o', default=None,
                             help='path to write out gzipped csv file or directory for gzipped csv files')
-        parser.add_argument('--threads', '-t', default=1, type=int,
-                            help='number of async threads to use (default=1)')
+        parser.add_argument('--sketch', action='store_true',
+                            help='approximate quantiles and unique IP counts with sketches, so memory per host is bounded, featurizing a chunk at a time')
+        parser.add_argument('--quantile_error', default=0.01, type=float,
+                            help='relative error of sketched quantiles (default=0.01)')
+        parser.add_argument('--distinct_error', default=0.03, type=float,
+                            help='standard error of sketched unique IP counts, rounded down to what a power of 2 registers gives (default=0.03)')
+        parser.add_argument('--threads', '-t', default=1, type=threads_arg,
+                            help='number of async threads to use, or auto for as many as CPUs and memory allow (default=1)')
         parser.add_argument('--verbose', '-v', choices=[
                             'DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='logging level (default=INFO)')
         srcmacid_parser = parser.add_mutually_exclusive_group(required=False)
@@ -111,13 +131,38 @@ class CSVToFeatures():
         parsed_args = parser.parse_args(raw_args)
         return parsed_args
 
+    def featurize_chunks(self, featurizer, features, in_file, features_path, parsed_args):
+        chunk_rows = parsed_args.chunk_rows or SKETCH_CHUNK_ROWS
+        if parsed_args.sketch:
+            quantile_error = QuantileSketch(parsed_args.quantile_error).relative_error
+            distinct_error = DistinctSketch(parsed_args.distinct_error).error
+            self.logger.info(
+                f'Sketching quantiles to within {quantile_error:.2%} relative error, and unique IP counts to {distinct_error:.2%} standard error')
+        if self.in_frames is not None:
+            chunks = frame_chunks(import_frame(self.in_frames[in_file]), chunk_rows)
+        else:
+            chunks = import_pcap_chunks(in_file, chunk_rows)
+        self.logger.info(f'Featurizing {in_file} {chunk_rows} rows at a time')
+        rows = featurizer.main_chunks(features, chunks, features_path, parsed_args)
+        if rows is None:
+            self.logger.info(f'Not all of {features} can be featurized a chunk at a time, importing {in_file} whole')
+        return rows
+
     def exec_features(self, features, in_file, out_file, features_path, gzip_opt, parsed_args):
-        in_file_size = os.path.getsize(in_file)
-        self.logger.info(f'Importing {in_file} size {in_file_size}')
-        df = import_csv(in_file)
         featurizer = Featurizer()
-        self.logger.info(f'Featurizing {in_file}')
-        rows = featurizer.main(features, df, features_path, parsed_args)
+        rows = None
+        if getattr(parsed_args, 'chunk_rows', 0) or getattr(parsed_args, 'sketch', False):
+            rows = self.featurize_chunks(featurizer, features, in_file, features_path, parsed_args)
+        if rows is None:
+            if self.in_frames is not None:
+                df = import_frame(self.in_frames[in_file])
+                self.logger.info(f'Importing {in_file} from memory, {len(df)} rows')
+            else:
+                in_file_size = os.path.getsize(in_file)
+                self.logger.info(f'Importing {in_file} size {in_file_size}')
+                df = import_pcap_df(in_file)
+            self.logger.info(f'Featurizing {in_file}')
+            rows = featurizer.main(features, df, features_path, parsed_args)
 
         rowcounts = Counter()
         for row in rows:
@@ -146,23 +191,36 @@ class CSVToFeatures():
 
         if header and rows is not None:
             rows = rows.tolist()
-            CSVToFeatures.write_features_to_csv(
-                header, rows, out_file, gzip_opt)
+            if self.frames is not None:
+                self.frames[out_file] = pd.DataFrame(rows, columns=header)
+            elif parsed_args.format == 'npz':
+                write_npz(pd.DataFrame(rows, columns=header), out_file)
+            else:
+                if getattr(parsed_args, 'combined', False):
+                    # so CSVCombiner can append the file as it is.
+                    filename = CSVToFeatures.combined_filename(out_file, gzip_opt)
+                    header = ['filename'] + header
+                    for row in rows:
+                        row['filename'] = filename
+                CSVToFeatures.write_features_to_csv(
+                    header, rows, out_file, gzip_opt)
         else:
             self.logger.warning(
                 f'No results based on {features} for {in_file}')
 
-    def process_files(self, threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args):
+    def process_files(self, threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args, combiner=None):
         num_files = len(in_paths)
         failed_paths = []
         finished_files = 0
-        # corner case so it works in jupyterlab
-        if threads < 2:
+        # corner case so it works in jupyterlab, and in memory inputs and outputs stay in this process.
+        if threads < 2 or self.in_frames is not None or self.frames is not None:
             for i in range(len(in_paths)):
                 try:
                     finished_files += 1
                     self.exec_features(
                         features, in_paths[i], out_paths[i], features_path, gzip_opt, parsed_args)
+                    if combiner is not None:
+                        combiner.add(out_paths[i])
                     self.logger.info(
                         f'Finished {in_paths[i]}. {finished_files}/{num_files} CSVs done.')
                 except Exception as e:  # pragma: no cover
@@ -170,14 +228,20 @@ class CSVToFeatures():
                         f'{in_paths[i]} generated an exception: {e}')
                     failed_paths.append(out_paths[i])
         else:
+            worker_stats = WorkerStats()
             with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
+                # biggest first, so a big file submitted last doesn't leave one worker busy at the end.
                 future_to_parse = {executor.submit(
-                    self.exec_features, features, in_paths[i], out_paths[i], features_path, gzip_opt, parsed_args): i for i in range(len((in_paths)))}
+                    timed_call, exec_features_worker, features, in_paths[i], out_paths[i], features_path, gzip_opt, parsed_args): i for i in largest_first(in_paths)}
                 for future in concurrent.futures.as_completed(future_to_parse):
                     path = future_to_parse[future]
                     try:
                         finished_files += 1
-                        future.result()
+                        _, pid, start_time, end_time = future.result()
+                        worker_stats.add(pid, start_time, end_time)
+                        if combiner is not None:
+                            # combine each file as it's done, rather than all of them at the end.
+                            combiner.add(out_paths[path])
                     except Exception as e:  # pragma: no cover
                         self.logger.error(
                             f'{in_paths[path]} generated an exception: {e}')
@@ -185,8 +249,29 @@ class CSVToFeatures():
                     else:
                         self.logger.info(
                             f'Finished {in_paths[path]}. {finished_files}/{num_files} CSVs done.')
+            worker_stats.report(self.logger, threads)
         return failed_paths
 
+    def frames_output(self, threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args):
+        """
+        Featurize in memory, returning the DataFrames by output path, or one DataFrame with
+        a filename column as the combined CSV would have if combined.
+        """
+        self.process_files(threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args)
+        frames = {out_file: self.frames[out_file] for out_file in out_paths if out_file in self.frames}
+        self.logger.info(f'Featurized {len(frames)} file(s) in memory')
+        if not parsed_args.combined:
+            return frames
+        dfs = []
+        for out_file, df in frames.items():
+            if parsed_args.format == 'npz':
+                filename = out_file.split('/')[-1].split('.features.npz')[0]
+            else:
+                filename = CSVToFeatures.combined_filename(out_file, gzip_opt)
+            df.insert(0, 'filename', filename)
+            dfs.append(df)
+        return concat_dfs(dfs)
+
     def main(self):
         parsed_args = CSVToFeatures.parse_args(raw_args=self.raw_args)
         in_path = parsed_args.path
@@ -219,8 +304,23 @@ class CSVToFeatures():
             functions.append(tuple(function.split(':')))
         features = {'groups': groups, 'functions': functions}
 
+        out_format = parsed_args.format
+        if out_format == 'npz':
+            out_ext = '.features.npz'
+        elif gzip_opt in ['neither', 'input']:
+            out_ext = '.features'
+        else:
+            out_ext = '.features.gz'
+
         # check if it's a directory or a file
-        if os.path.isdir(in_path):
+        if self.in_frames is not None:
+            for in_file in self.in_frames:
+                in_paths.append(in_file)
+                if out_path:
+                    out_paths.append(os.path.join(out_path, os.path.basename(in_file)) + out_ext)
+                else:
+                    out_paths.append(in_file + out_ext)
+        elif os.path.isdir(in_path):
             if out_path:
                 pathlib.Path(out_path).mkdir(parents=True, exist_ok=True)
             for root, _, files in os.walk(in_path):
@@ -228,24 +328,14 @@ class CSVToFeatures():
                     if CSVToFeatures.iscsv(pathfile):
                         in_paths.append(os.path.join(root, pathfile))
                         if out_path:
-                            if gzip_opt in ['neither', 'input']:
-                                out_paths.append(os.path.join(
-                                    out_path, pathfile) + '.features')
-                            else:
-                                out_paths.append(os.path.join(
-                                    out_path, pathfile) + '.features.gz')
+                            out_paths.append(os.path.join(
+                                out_path, pathfile) + out_ext)
                         else:
-                            if gzip_opt in ['neither', 'input']:
-                                out_paths.append(os.path.join(
-                                    root, pathfile) + '.features')
-                            else:
-                                out_paths.append(os.path.join(
-                                    root, pathfile) + '.features.gz')
+                            out_paths.append(os.path.join(
+                                root, pathfile) + out_ext)
         else:
             in_paths.append(in_path)
-            default_out_path = in_path + '.features.gz'
-            if gzip_opt in ['neither', 'input']:
-                default_out_path = in_path + '.features'
+            default_out_path = in_path + out_ext
             if out_path:
                 if os.path.isdir(out_path):
                     out_paths.append(os.path.join(out_path, os.path.basename(default_out_path)))
@@ -254,21 +344,41 @@ class CSVToFeatures():
             else:
                 out_paths.append(default_out_path)
 
-        failed_paths = self.process_files(
-            threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args)
+        if threads == 'auto':
+            max_size = max((file_size(in_path) for in_path in in_paths), default=0)
+            threads = auto_threads(worker_bytes=max_size * FEATURIZER_MEMORY_RATIO, tasks=len(in_paths))
+            self.logger.info(f'Using {threads} threads')
 
-        for failed_path in failed_paths:  # pragma: no cover
-            if failed_path in out_paths:
-                out_paths.remove(failed_path)
+        if self.frames is not None:
+            return self.frames_output(threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args)
 
+        combiner = None
         if combined and out_paths:
             combined_path = os.path.join(
                 os.path.dirname(out_paths[0]), 'combined.csv.gz')
-            if gzip_opt in ['input', 'neither']:
+            if out_format == 'npz':
+                combined_path = combined_path[:-len('.csv.gz')] + '.npz'
+            elif gzip_opt in ['input', 'neither']:
                 combined_path = combined_path[:-3]
             self.logger.info(
                 f'Combining CSVs into a single file: {combined_path}')
-            CSVToFeatures.combine_csvs(out_paths, combined_path, gzip_opt)
+            if out_format != 'npz':
+                combiner = CSVCombiner(combined_path, codec='gzip' if gzip_opt in ['output', 'both'] else 'none')
+
+        failed_paths = self.process_files(
+            threads, features, features_path, in_paths, out_paths, gzip_opt, parsed_args, combiner)
+
+        for failed_path in failed_paths:  # pragma: no cover
+            if failed_path in out_paths:
+                out_paths.remove(failed_path)
+
+        if combined and out_paths:
+            if combiner is not None:
+                combiner.close()
+                self.logger.info(
+                    f'Combined {combiner.copied} CSVs as they were, and {combiner.remapped} with different headers')
+            else:
+                CSVToFeatures.combine_npzs(out_paths, combined_path)
             return combined_path
         if out_paths:
             self.logger.info(f'GZipped CSV file(s) written out to: {out_paths}')
@@ -278,6 +388,11 @@ class CSVToFeatures():
             return
 
 
+def exec_features_worker(*args):
+    # a new instance in the worker, so the pool doesn't have to pickle the calling one.
+    return CSVToFeatures().exec_features(*args)
+
+
 if __name__ == '__main__':  # pragma: no cover
     features = CSVToFeatures()
     features.main()
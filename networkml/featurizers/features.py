@@ -3,6 +3,28 @@ import ipaddress
 
 import numpy as np
 
+from networkml.helpers.frame_cache import FrameCache
+
+# intermediates of the DataFrame being featurized, shared by all Features.
+FRAME_CACHE = FrameCache()
+
+
+class ChunkState():
+    """
+    Mergeable state of a featurizer function run over a DataFrame a chunk at a time. Each
+    chunk is added in turn (or to a state of its own, the states then merged in chunk
+    order), and finalize returns the rows the function returns for all the chunks at once.
+    """
+
+    def add(self, df):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def finalize(self):
+        raise NotImplementedError
+
 
 class Features():
 
@@ -23,6 +45,20 @@ class Features():
         results = func(*args)
         return results
 
+    @staticmethod
+    def cached(df, name, func, *args):
+        """
+        func(*args), computed once per DataFrame for all Features asking for name of df.
+        """
+        return FRAME_CACHE.get(df, name, func, *args)
+
+    def chunk_state(self, func_name, parsed_args):
+        """
+        A ChunkState to run <func_name> with a chunk at a time, or None if it can only
+        run on the whole DataFrame.
+        """
+        return None
+
     @staticmethod
     def get_columns(fields, rows):
         # Terse but efficient.
@@ -1,13 +1,25 @@
+import functools
 import ipaddress
 
 import netaddr
 import numpy as np
 import pandas as pd
 
+from networkml.featurizers.features import ChunkState
 from networkml.featurizers.features import Features
+from networkml.helpers.grouped_stats import grouped_stats
+from networkml.helpers.grouped_stats import grouped_value_stats
+from networkml.helpers.grouped_stats import group_reduce
+from networkml.helpers.grouped_stats import GroupedAggregates
+from networkml.helpers.grouped_stats import moment_stats
+from networkml.helpers.grouped_stats import STATS
+from networkml.helpers.sketches import DistinctSketch
+from networkml.helpers.sketches import QuantileSketch
 
 
 MAC_BCAST = netaddr.EUI('FF-FF-FF-FF-FF-FF')
+MAC_BCAST_INT = int(MAC_BCAST)
+MAC_GROUP_BIT = 1 << 40
 ETH_TYPE_ARP = 0x806
 ETH_TYPE_IP = 0x800
 ETH_TYPE_IPV6 = 0x86DD
@@ -19,6 +31,55 @@ TCP_UDP_PROTOS = {
     6: 'tcp',
     17: 'udp',
 }
+# a null in a session key column, which no MAC, port or type can be.
+NULL_KEY = np.uint64(2**64 - 1)
+SESSION_KEY_SEED = np.uint64(0x9E3779B97F4A7C15)
+
+
+# the IPv4 networks ipaddress's is_private and is_multicast are true for, in address order.
+# https://www.iana.org/assignments/iana-ipv4-special-registry/iana-ipv4-special-registry.xhtml
+IPV4_PRIVATE_NETWORKS = (
+    '0.0.0.0/8', '10.0.0.0/8', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12', '192.0.0.0/29',
+    '192.0.0.170/31', '192.0.2.0/24', '192.168.0.0/16', '198.18.0.0/15', '198.51.100.0/24',
+    '203.0.113.0/24', '240.0.0.0/4', '255.255.255.255/32')
+IPV4_MULTICAST_NETWORKS = ('224.0.0.0/4',)
+
+
+def _ipv4_ranges(networks):
+    # the first and last packed address of each network.
+    networks = [ipaddress.IPv4Network(network) for network in networks]
+    return (np.array([int(network.network_address) for network in networks], dtype=np.int64),
+            np.array([int(network.broadcast_address) for network in networks], dtype=np.int64))
+
+
+IPV4_PRIVATE_RANGES = _ipv4_ranges(IPV4_PRIVATE_NETWORKS)
+IPV4_MULTICAST_RANGES = _ipv4_ranges(IPV4_MULTICAST_NETWORKS)
+
+
+def _in_ranges(ips, ranges):
+    """
+    Whether each packed IPv4 address in ips is in one of ranges, which don't overlap.
+    """
+    firsts, lasts = ranges
+    index = np.searchsorted(firsts, ips, side='right') - 1
+    return (index >= 0) & (ips <= lasts[np.maximum(index, 0)])
+
+
+def _mix64(vals):
+    # splitmix64's finalizer, on uint64 arrays (which wrap rather than overflow).
+    vals = (vals ^ (vals >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    vals = (vals ^ (vals >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return vals ^ (vals >> np.uint64(31))
+
+
+def _hash64(cols):
+    """
+    Hash each row of equal length uint64 columns to an int64, the same in every process.
+    """
+    hashes = np.full(len(cols[0]), SESSION_KEY_SEED, dtype=np.uint64)
+    for col in cols:
+        hashes = _mix64(hashes ^ col)
+    return hashes.view(np.int64)
 
 
 class HostBase:
@@ -44,6 +105,18 @@ class HostBase:
         [1900, 2375, 2376, 5222, 5349, 5353, 5354, 5349, 5357, 6653])
     DROP_PROTOS = frozenset(
         ['frame', 'data', 'eth', 'ip', 'ipv6'])
+    TCP_FLAGS = {
+        0: 'fin', 1: 'syn', 2: 'rst', 3: 'psh', 4: 'ack', 5: 'urg', 6: 'ece', 7: 'cwr', 8: 'ns'}
+    FLAG_DECODE_MAPS = (
+        ('ip.dsfield', {
+            0: 'ecn0', 1: 'ecn1', 2: 'dscp0', 3: 'dscp1', 4: 'dscp2', 5: 'dscp3', 6: 'dscp4', 7: 'dscp5'}),
+        ('ip.flags', TCP_FLAGS),
+        ('tcp.flags', TCP_FLAGS))
+    # the functions of _calc_cols' columns, of each direction's rows, and of all the rows.
+    SUFFIX_FUNCS = ('_tshark_flags', '_tshark_ports')
+    GROUP_FUNCS = (
+        '_tshark_ipversions', '_tshark_non_ip', '_tshark_both_private_ip', '_tshark_ipv4_multicast',
+        '_tshark_wk_ip_protocol', '_tshark_vlan_id', '_tshark_frame_epoch', '_tshark_ratio_ports')
 
     def _mac(self, mac):
         return netaddr.EUI(int(mac), dialect=netaddr.mac_unix_expanded)
@@ -54,6 +127,38 @@ class HostBase:
             return False
         return True
 
+    @staticmethod
+    def _unicast_macs(macs):
+        """
+        _is_unicast for an array of packed MACs at once.
+        """
+        macs = np.asarray(macs, dtype=np.uint64)
+        return (macs != MAC_BCAST_INT) & ((macs & MAC_GROUP_BIT) == 0)
+
+    @staticmethod
+    def _mac_partitions(df):
+        """
+        Partition df's rows by MAC in one pass, each row in both its eth.src and eth.dst
+        partitions (once, if they're the same). Returns a function giving the positions of a
+        MAC's rows, in df order, as a boolean mask of eth.src or eth.dst would select them.
+        """
+        rows = len(df)
+        codes, macs = pd.factorize(np.concatenate((df['eth.src'].to_numpy(), df['eth.dst'].to_numpy())))
+        positions = np.tile(np.arange(rows), 2)
+        keep = (codes != -1) & np.concatenate((np.ones(rows, dtype=bool), codes[rows:] != codes[:rows]))
+        codes = codes[keep]
+        positions = positions[keep]
+        order = np.lexsort((positions, codes))
+        positions = positions[order]
+        offsets = np.searchsorted(codes[order], np.arange(len(macs) + 1))
+        mac_codes = {mac: code for code, mac in enumerate(macs)}
+
+        def mac_positions(mac):
+            code = mac_codes[mac]
+            return positions[offsets[code]:offsets[code + 1]]
+
+        return mac_positions
+
     def _numericintset(self, nums):
         if nums is not None:
             return frozenset(int(x) for x in nums if x is not None and pd.notna(x))
@@ -79,12 +184,7 @@ class HostBase:
     def _get_dst_ip(self, row):
         return self._get_ip(row, ('dst', 'dst_host'))
 
-    def _get_flags(self, mac_df, col_name, decode_map, suffix=None, field_name=None):
-        try:
-            col = mac_df[col_name]
-            unique_flags = self._numericintset(col.unique())
-        except KeyError:
-            unique_flags = [0]
+    def _decode_flags(self, unique_flags, col_name, decode_map, suffix=None, field_name=None):
         decoded_flags = set()
         for bit, decoded_flag in decode_map.items():
             bitval = 2**bit
@@ -101,17 +201,18 @@ class HostBase:
             field_name, decoded_flag): int(decoded_flag in decoded_flags)
             for decoded_flag in decode_map.values()}
 
+    def _get_flags(self, mac_df, col_name, decode_map, suffix=None, field_name=None):
+        try:
+            col = mac_df[col_name]
+            unique_flags = self._numericintset(col.unique())
+        except KeyError:
+            unique_flags = [0]
+        return self._decode_flags(unique_flags, col_name, decode_map, suffix=suffix, field_name=field_name)
+
     def _tshark_flags(self, suffix, mac_df):
         mac_row_flags = {}
-        for func in (
-            lambda x, y: self._get_flags(x, 'ip.dsfield', {
-                                         0: 'ecn0', 1: 'ecn1', 2: 'dscp0', 3: 'dscp1', 4: 'dscp2', 5: 'dscp3', 6: 'dscp4', 7: 'dscp5'}, suffix=y),
-            lambda x, y: self._get_flags(x, 'ip.flags', {
-                                         0: 'fin', 1: 'syn', 2: 'rst', 3: 'psh', 4: 'ack', 5: 'urg', 6: 'ece', 7: 'cwr', 8: 'ns'}, suffix=y),
-            lambda x, y: self._get_flags(x, 'tcp.flags', {
-                                         0: 'fin', 1: 'syn', 2: 'rst', 3: 'psh', 4: 'ack', 5: 'urg', 6: 'ece', 7: 'cwr', 8: 'ns'}, suffix=y),
-        ):
-            mac_row_flags.update(func(mac_df, suffix))
+        for col_name, decode_map in self.FLAG_DECODE_MAPS:
+            mac_row_flags.update(self._get_flags(mac_df, col_name, decode_map, suffix=suffix))
         return mac_row_flags
 
     def _lowest_ip_proto_port(self, mac_df, ip_proto):
@@ -122,29 +223,35 @@ class HostBase:
                 return self._numericintset(np.minimum(src, dst).unique())   # pylint: disable=no-member
         return frozenset()
 
-    def _tshark_ports(self, suffix, mac_df):
-        mac_row_ports = {}
+    def _port_flags(self, ip_proto, lowest_ports, suffix):
 
         def port_priv(port):
             return port < 1024
 
+        mac_row_ports = {}
+        for field_name, ports, wk_ports in (
+            ('priv', {port for port in lowest_ports if port_priv(
+                port)}, self.WK_PRIV_TCPUDP_PORTS),
+            ('nonpriv', {port for port in lowest_ports if not port_priv(
+                port)}, self.WK_NONPRIV_TCPUDP_PORTS),
+        ):
+            port_flags = {port: int(port in ports) for port in wk_ports}
+            port_flags.update(
+                {'other': int(bool(lowest_ports) and not ports.issubset(wk_ports))})
+            mac_row_ports.update({
+                'tshark_%s_%s_port_%s_%s' % (ip_proto, field_name, port, suffix): present for port, present in port_flags.items()})
+        return mac_row_ports
+
+    def _tshark_ports(self, suffix, mac_df):
+        mac_row_ports = {}
         for ip_proto_num, ip_proto in TCP_UDP_PROTOS.items():
             proto_df = mac_df[mac_df['ip.proto']==ip_proto_num]
             lowest_ports = self._lowest_ip_proto_port(proto_df, ip_proto)
-            for field_name, ports, wk_ports in (
-                ('priv', {port for port in lowest_ports if port_priv(
-                    port)}, self.WK_PRIV_TCPUDP_PORTS),
-                ('nonpriv', {port for port in lowest_ports if not port_priv(
-                    port)}, self.WK_NONPRIV_TCPUDP_PORTS),
-            ):
-                port_flags = {port: int(port in ports) for port in wk_ports}
-                port_flags.update(
-                    {'other': int(bool(lowest_ports) and not ports.issubset(wk_ports))})
-                mac_row_ports.update({
-                    'tshark_%s_%s_port_%s_%s' % (ip_proto, field_name, port, suffix): present for port, present in port_flags.items()})
+            mac_row_ports.update(self._port_flags(ip_proto, lowest_ports, suffix))
         return mac_row_ports
 
-    def _tshark_ratio_ports(self, mac_df):
+    def _port_ratios(self, ip_proto, src_counts, dst_counts):
+        # src_counts/dst_counts map each port to how many packets used it as src/dst port.
         mac_row_ports = {}
 
         def calc_ratio(src_count, dst_count):
@@ -156,63 +263,57 @@ class HostBase:
                     packet_ratio = 1
             return packet_ratio
 
+        for field_name, wk_ports, in_range in (
+            ('priv', self.WK_PRIV_TCPUDP_PORTS, lambda port: port <= 1023),
+            ('nonpriv', self.WK_NONPRIV_TCPUDP_PORTS, lambda port: port > 1023)):
+            for port in wk_ports:
+                src_count = src_counts.get(port, None)
+                dst_count = dst_counts.get(port, None)
+                mac_row_ports.update({
+                    'tshark_%s_%s_packet_ratio_io_port_%s' % (ip_proto, field_name, port): calc_ratio(src_count, dst_count)})
+            src_count = sum(count for port, count in src_counts.items() if in_range(port) and port not in wk_ports)
+            dst_count = sum(count for port, count in dst_counts.items() if in_range(port) and port not in wk_ports)
+            mac_row_ports.update({
+                'tshark_%s_%s_packet_ratio_io_port_%s' % (ip_proto, field_name, 'other'): calc_ratio(src_count, dst_count)})
+        return mac_row_ports
 
+    def _tshark_ratio_ports(self, mac_df):
+        mac_row_ports = {}
         for ip_proto_num, ip_proto in TCP_UDP_PROTOS.items():
             proto_df = mac_df[mac_df['ip.proto']==ip_proto_num]
-            src = pd.DataFrame(columns=['%s.srcport' % ip_proto])
-            dst = pd.DataFrame(columns=['%s.dstport' % ip_proto])
+            src_counts = {}
+            dst_counts = {}
             if not proto_df.empty:
                 try:
-                    src = proto_df['%s.srcport' % ip_proto]
-                    dst = proto_df['%s.dstport' % ip_proto]
+                    src_counts = proto_df['%s.srcport' % ip_proto].value_counts().to_dict()
+                    dst_counts = proto_df['%s.dstport' % ip_proto].value_counts().to_dict()
                 except KeyError:
                     pass
-            for field_name, wk_ports, port_src, port_dst in (
-                ('priv', self.WK_PRIV_TCPUDP_PORTS,
-                 src[src <= 1023], dst[dst <= 1023]),
-                ('nonpriv', self.WK_NONPRIV_TCPUDP_PORTS,
-                 src[src > 1023], dst[dst > 1023])):
-                src_values = port_src[src.isin(wk_ports)]
-                dst_values = port_dst[dst.isin(wk_ports)]
-                src_counts = {}
-                if not src_values.empty:
-                    src_counts = src_values.value_counts()
-                dst_counts = {}
-                if not dst_values.empty:
-                    dst_counts = dst_values.value_counts()
-                for port in wk_ports:
-                    src_count = src_counts.get(port, None)
-                    dst_count = dst_counts.get(port, None)
-                    mac_row_ports.update({
-                        'tshark_%s_%s_packet_ratio_io_port_%s' % (ip_proto, field_name, port): calc_ratio(src_count, dst_count)})
-                src_values = port_src[~port_src.isin(wk_ports)]
-                src_count = 0
-                if not src_values.empty:
-                    src_count = src_values.value_counts().sum()
-                dst_values = port_dst[~port_dst.isin(wk_ports)]
-                dst_count = 0
-                if not dst_values.empty:
-                    dst_count = dst_values.value_counts().sum()
-                mac_row_ports.update({
-                    'tshark_%s_%s_packet_ratio_io_port_%s' % (ip_proto, field_name, 'other'): calc_ratio(src_count, dst_count)})
+            mac_row_ports.update(self._port_ratios(ip_proto, src_counts, dst_counts))
         return mac_row_ports
 
+    def _ipversion_flags(self, ip_versions):
+        return {'tshark_ipv%u' % v: int(v in ip_versions) for v in (4, 6)}
+
     def _tshark_ipversions(self, mac_df):
         try:
             ip_versions = self._numericintset(mac_df['ip.version'].unique())
         except AttributeError:
             ip_versions = frozenset()
-        return {'tshark_ipv%u' % v: int(v in ip_versions) for v in (4, 6)}
+        return self._ipversion_flags(ip_versions)
+
+    def _non_ip_flags(self, eth_types):
+        return {
+            'tshark_ipx': int(ETH_TYPE_IPX in eth_types),
+            'tshark_nonip': int(bool(eth_types - ETH_IP_TYPES)),
+        }
 
     def _tshark_non_ip(self, mac_df):
         try:
             eth_types = self._numericintset(mac_df['eth.type'].unique())
         except AttributeError:
             eth_types = frozenset()
-        return {
-            'tshark_ipx': int(ETH_TYPE_IPX in eth_types),
-            'tshark_nonip': int(bool(eth_types - ETH_IP_TYPES)),
-        }
+        return self._non_ip_flags(eth_types)
 
     def _tshark_both_private_ip(self, mac_df):
         try:
@@ -245,9 +346,11 @@ class HostBase:
             'tshark_frame_epoch': float(mac_df['frame.time_epoch'].max())
         }
 
-    def _tshark_unique_ips(self, mac, mac_df):
-        srcips = mac_df[mac_df['eth.src'] == mac]['_srcip']
-        dstips = mac_df[mac_df['eth.src'] == mac]['_dstip']
+    def _tshark_unique_ips(self, mac, mac_df, out_df=None):
+        if out_df is None:
+            out_df = mac_df[mac_df['eth.src'] == mac]
+        srcips = out_df['_srcip']
+        dstips = out_df['_dstip']
         return {
             'tshark_srcips': list(set(srcips.unique().tolist()) - {'None'}),
             'tshark_unique_srcips': srcips.nunique(),
@@ -256,37 +359,27 @@ class HostBase:
 
     def _calc_cols(self, mac, mac_df):
         mac_row = {}
-        for suffix, suffix_func in (
-            ('out', lambda x: mac_df[mac_df['eth.src'] == x]),
-            ('in', lambda x: mac_df[mac_df['eth.src'] != x])):
-            try:
-                suffix_df = suffix_func(mac)
-            except KeyError:
-                continue
+        suffix_dfs = {}
+        try:
+            # the same eth.src comparison for both directions, and the unique IPs.
+            is_out = (mac_df['eth.src'] == mac).to_numpy(dtype=bool)
+            suffix_dfs = {'out': mac_df[is_out], 'in': mac_df[~is_out]}
+        except KeyError:
+            pass
+        for suffix, suffix_df in suffix_dfs.items():
             for col_name, field_name in self.CALC_COL_NAMES:
-                col = suffix_df[col_name]
                 for calc_name, calc_func in self.CALC_COL_FUNCS:
                     calc_col = 'tshark_%s_%s_%s' % (
                         calc_name, field_name, suffix)
-                    val = calc_func(col)
+                    val = calc_func(suffix_df[col_name])
                     if pd.isnull(val):
                         val = 0
                     mac_row.update({calc_col: val})
-            for func in (
-                    self._tshark_flags,
-                    self._tshark_ports):
-                mac_row.update(func(suffix, suffix_df))
-        for func in (
-                self._tshark_ipversions,
-                self._tshark_non_ip,
-                self._tshark_both_private_ip,
-                self._tshark_ipv4_multicast,
-                self._tshark_wk_ip_protocol,
-                self._tshark_vlan_id,
-                self._tshark_frame_epoch,
-                self._tshark_ratio_ports):
-            mac_row.update(func(mac_df))
-        mac_row.update(self._tshark_unique_ips(mac, mac_df))
+            for func_name in self.SUFFIX_FUNCS:
+                mac_row.update(getattr(self, func_name)(suffix, suffix_df))
+        for func_name in self.GROUP_FUNCS:
+            mac_row.update(getattr(self, func_name)(mac_df))
+        mac_row.update(self._tshark_unique_ips(mac, mac_df, suffix_dfs.get('out', None)))
         return mac_row
 
     def _calc_mac_row(self, mac, mac_df):
@@ -294,6 +387,251 @@ class HostBase:
         mac_row.update(self._calc_cols(mac, mac_df))
         return mac_row
 
+    def _grouped_rows(self, macs, grouped):
+        """
+        The _calc_mac_row of each group, whose MAC is in macs, from grouped's columns of all
+        the groups (by function name and suffix), in _calc_cols' column order.
+        """
+        cols = []
+        for suffix in ('out', 'in'):
+            for func_name in ('calc',) + self.SUFFIX_FUNCS:
+                cols.extend(grouped[(func_name, suffix)].items())
+        for func_name in self.GROUP_FUNCS + ('_tshark_unique_ips',):
+            cols.extend(grouped[(func_name, None)].items())
+        host_keys = {mac: str(self._mac(mac)) for mac in set(macs)}
+        col_names = ['host_key'] + [col_name for col_name, _ in cols]
+        return [dict(zip(col_names, row)) for row in zip(
+            [host_keys[mac] for mac in macs], *[col_vals for _, col_vals in cols])]
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _port_table(cls):
+        """
+        The port columns of _port_flags and _port_ratios in order, as (field name, port),
+        and the index of each port's column, the well known port's own or other.
+        """
+        port_cols = []
+        port_table = np.zeros(2**16, dtype=np.int64)
+        for field_name, wk_ports, first_port, last_port in (
+                ('priv', cls.WK_PRIV_TCPUDP_PORTS, 0, 1023),
+                ('nonpriv', cls.WK_NONPRIV_TCPUDP_PORTS, 1024, 2**16 - 1)):
+            port_table[first_port:last_port + 1] = len(port_cols) + len(wk_ports)
+            for port in wk_ports:
+                port_table[port] = len(port_cols)
+                port_cols.append((field_name, port))
+            port_cols.append((field_name, 'other'))
+        return (port_cols, port_table)
+
+    @staticmethod
+    def _group_bits(values, groups, n_groups, bits):
+        """
+        Whether any of each group's values has each of bits set, as a groups by bits matrix.
+        """
+        group_bits = np.zeros((n_groups, len(bits)), dtype=np.int64)
+        for i, bit in enumerate(bits):
+            group_bits[groups[(values >> bit) & 1 == 1], i] = 1
+        return group_bits
+
+    @staticmethod
+    def _port_ratio_list(src_counts, dst_counts, other):
+        # as _port_ratios' calc_ratio, where a well known port's zero counts are None.
+        if other:
+            is_ratio = dst_counts > 0
+            not_ratios = (src_counts > 0).astype(np.int64)
+        else:
+            is_ratio = (src_counts > 0) & (dst_counts > 0)
+            not_ratios = np.zeros(len(src_counts), dtype=np.int64)
+        ratios = src_counts / np.maximum(dst_counts, 1)
+        return [ratio if ratio_ok else not_ratio for ratio, ratio_ok, not_ratio in zip(
+            ratios.tolist(), is_ratio.tolist(), not_ratios.tolist())]
+
+    def _flag_bits(self, df, all_positions, groups, n_groups):
+        """
+        Whether any of each group's rows has each bit of FLAG_DECODE_MAPS' columns, and of
+        _protos_int, set: a groups by bits matrix for each column.
+        """
+        flag_bits = {}
+        for col_name, decode_map in self.FLAG_DECODE_MAPS + (('_protos_int', WK_IP_PROTOS_INDEX),):
+            if col_name in df.columns:
+                values = df[col_name].iloc[all_positions].to_numpy(dtype=np.int64, na_value=0)
+            else:
+                values = np.zeros(len(all_positions), dtype=np.int64)
+            flag_bits[col_name] = self._group_bits(values, groups, n_groups, list(decode_map))
+        return flag_bits
+
+    def _grouped_flags(self, flag_bits):
+        # the flag columns of _flag_bits' out and in groups, in turn.
+        grouped = {('_tshark_flags', 'out'): {}, ('_tshark_flags', 'in'): {}}
+        for col_name, decode_map in self.FLAG_DECODE_MAPS:
+            group_bits = flag_bits[col_name]
+            field_name = col_name.replace('.', '_')
+            for direction, suffix in enumerate(('out', 'in')):
+                for i, decoded_flag in enumerate(decode_map.values()):
+                    grouped[('_tshark_flags', suffix)]['tshark_%s_%s_%s' % (
+                        field_name, decoded_flag, suffix)] = group_bits[direction::2, i].tolist()
+        group_bits = flag_bits['_protos_int']
+        group_bits = group_bits[0::2] | group_bits[1::2]
+        grouped[('_tshark_wk_ip_protocol', None)] = {
+            'tshark_wk_ip_protocol_%s' % ip_proto: group_bits[:, i].tolist()
+            for i, ip_proto in enumerate(WK_IP_PROTOS_INDEX.values())}
+        return grouped
+
+    @staticmethod
+    def _position_ints(df, col_name, all_positions):
+        # col_name's values at all_positions as int64s, -1 for nulls or if there's no such column.
+        if col_name not in df.columns:
+            return np.full(len(all_positions), -1, dtype=np.int64)
+        return df[col_name].iloc[all_positions].to_numpy(dtype=np.int64, na_value=-1)
+
+    def _port_counts(self, df, all_positions, groups, n_groups):
+        """
+        For each of TCP_UDP_PROTOS, whether each group's rows have a lowest port in each of
+        _port_table's columns, and how many rows of each pair of out and in groups have a
+        source and destination port in each.
+        """
+        port_cols, port_table = self._port_table()
+        pairs = groups // 2
+        n_pairs = n_groups // 2
+        port_counts = {}
+        ip_protos = self._position_ints(df, 'ip.proto', all_positions)
+        for ip_proto_num, ip_proto in TCP_UDP_PROTOS.items():
+            proto_rows = ip_protos == ip_proto_num
+            src_ports, dst_ports = [
+                self._position_ints(df, '%s.%s' % (ip_proto, col), all_positions) for col in ('srcport', 'dstport')]
+            lowest_rows = proto_rows & (src_ports != -1) & (dst_ports != -1)
+            lowest_ports = np.zeros((n_groups, len(port_cols)), dtype=np.int64)
+            lowest_ports[groups[lowest_rows], port_table[np.minimum(src_ports, dst_ports)[lowest_rows]]] = 1
+            src_counts, dst_counts = [
+                np.bincount(pairs[proto_rows & (ports != -1)] * len(port_cols) + port_table[ports[proto_rows & (ports != -1)]],
+                            minlength=n_pairs * len(port_cols)).reshape(n_pairs, len(port_cols))
+                for ports in (src_ports, dst_ports)]
+            port_counts[ip_proto] = (lowest_ports, src_counts, dst_counts)
+        return port_counts
+
+    def _grouped_ports(self, port_counts):
+        # the port and port ratio columns of _port_counts' out and in groups, in turn.
+        port_cols, _ = self._port_table()
+        grouped = {('_tshark_ports', 'out'): {}, ('_tshark_ports', 'in'): {}, ('_tshark_ratio_ports', None): {}}
+        for ip_proto, (lowest_ports, src_counts, dst_counts) in port_counts.items():
+            for direction, suffix in enumerate(('out', 'in')):
+                for i, (field_name, port) in enumerate(port_cols):
+                    grouped[('_tshark_ports', suffix)]['tshark_%s_%s_port_%s_%s' % (
+                        ip_proto, field_name, port, suffix)] = lowest_ports[direction::2, i].tolist()
+            for i, (field_name, port) in enumerate(port_cols):
+                grouped[('_tshark_ratio_ports', None)]['tshark_%s_%s_packet_ratio_io_port_%s' % (
+                    ip_proto, field_name, port)] = self._port_ratio_list(src_counts[:, i], dst_counts[:, i], port == 'other')
+        return grouped
+
+    def _grouped_calc(self, calc_stats):
+        # the calc columns of out and in groups in turn, from the grouped_stats of each column.
+        grouped = {('calc', 'out'): {}, ('calc', 'in'): {}}
+        for col_name, field_name in self.CALC_COL_NAMES:
+            stats = calc_stats.get(col_name, None)
+            if stats is None:
+                continue
+            for calc_name, _ in self.CALC_COL_FUNCS:
+                if calc_name in stats:
+                    for direction, suffix in enumerate(('out', 'in')):
+                        calc_col = 'tshark_%s_%s_%s' % (calc_name, field_name, suffix)
+                        grouped[('calc', suffix)][calc_col] = stats[calc_name][direction::2]
+        return grouped
+
+    def _any_rows(self, df, all_positions):
+        """
+        Whether each of the rows at all_positions has each flag of GROUP_FUNCS, by flag name.
+        A group has a flag if any of its rows do.
+        """
+        ip_versions = self._position_ints(df, 'ip.version', all_positions)
+        eth_types = self._position_ints(df, 'eth.type', all_positions)
+        return {
+            'ipv4': ip_versions == 4,
+            'ipv6': ip_versions == 6,
+            'ipx': eth_types == ETH_TYPE_IPX,
+            'nonip': (eth_types != -1) & ~np.isin(eth_types, list(ETH_IP_TYPES)),
+            'both_private_ip': self._position_ints(df, '_both_private_ip', all_positions) == 1,
+            'ipv4_multicast': self._position_ints(df, '_ipv4_multicast', all_positions) == 1,
+            'tagged_vlan': self._position_ints(df, 'vlan.id', all_positions) != -1,
+        }
+
+    @staticmethod
+    def _grouped_any(flags, frame_epochs):
+        # the columns of GROUP_FUNCS' flags, from each group's flags by name, and _tshark_frame_epoch.
+        return {
+            ('_tshark_ipversions', None): {'tshark_ipv4': flags['ipv4'], 'tshark_ipv6': flags['ipv6']},
+            ('_tshark_non_ip', None): {'tshark_ipx': flags['ipx'], 'tshark_nonip': flags['nonip']},
+            ('_tshark_both_private_ip', None): {'tshark_both_private_ip': flags['both_private_ip']},
+            ('_tshark_ipv4_multicast', None): {'tshark_ipv4_multicast': flags['ipv4_multicast']},
+            ('_tshark_vlan_id', None): {'tshark_tagged_vlan': flags['tagged_vlan']},
+            ('_tshark_frame_epoch', None): {'tshark_frame_epoch': frame_epochs},
+        }
+
+    @staticmethod
+    def _grouped_unique_ips(df, all_positions, pairs, is_in, n_pairs):
+        """
+        _tshark_unique_ips of the out rows of each pair of groups: the distinct _srcip values
+        in order of first appearance, as unique() has them, and the number of distinct
+        _srcip and _dstip values.
+        """
+        out_pairs = pairs[~is_in]
+        firsts = {}
+        for col_name in ('_srcip', '_dstip'):
+            codes, uniques = pd.factorize(df[col_name].to_numpy()[all_positions][~is_in])
+            _, first_rows = np.unique(out_pairs * len(uniques) + codes, return_index=True)
+            first_rows.sort()
+            firsts[col_name] = (out_pairs[first_rows], uniques[codes[first_rows]])
+        src_pairs, srcips = firsts['_srcip']
+        src_counts = np.bincount(src_pairs, minlength=n_pairs)
+        srcips = srcips[np.argsort(src_pairs, kind='stable')].tolist()
+        starts = (np.cumsum(src_counts) - src_counts).tolist()
+        return {
+            'tshark_srcips': [
+                list(set(srcips[start:start + count]) - {'None'}) for start, count in zip(starts, src_counts.tolist())],
+            'tshark_unique_srcips': src_counts.tolist(),
+            'tshark_unique_dstips': np.bincount(firsts['_dstip'][0], minlength=n_pairs).tolist(),
+        }
+
+    @staticmethod
+    def _row_groups(df, macs, positions, key_codes):
+        """
+        Number the groups of each MAC's rows at positions by key_codes, in order: the
+        positions of all the rows, the number of each row's group, whether the row is in to
+        the MAC, and the mac index * (max key code + 1) + key code of each group.
+        """
+        eth_srcs = df['eth.src'].to_numpy()
+        all_positions = np.concatenate(positions)
+        mac_ids = np.repeat(np.arange(len(macs)), [len(mac_positions) for mac_positions in positions])
+        pair_ids, pairs = np.unique(mac_ids * (int(key_codes.max()) + 1) + key_codes[all_positions], return_inverse=True)
+        is_in = np.concatenate([eth_srcs[mac_positions] != mac for mac, mac_positions in zip(macs, positions)])
+        return (all_positions, pairs, is_in, pair_ids)
+
+    def _grouped_calc_vals(self, df, macs, positions, key_codes):
+        """
+        All the columns of every group of rows _tshark_all makes (each MAC's rows at
+        positions, grouped by key_codes and split by direction), in one pass over all the
+        groups rather than pandas calls per group. Returns the index in macs of each group's
+        MAC, and the columns of all the groups, by function name and suffix.
+        """
+        all_positions, pairs, is_in, pair_ids = self._row_groups(df, macs, positions, key_codes)
+        groups = pairs * 2 + is_in
+        n_pairs = int(pairs.max()) + 1
+        n_groups = n_pairs * 2
+        calc_stats = {
+            col_name: grouped_stats(df[col_name].iloc[all_positions], groups, n_groups)
+            for col_name, _ in self.CALC_COL_NAMES if col_name in df.columns}
+        grouped = self._grouped_calc(calc_stats)
+        grouped.update(self._grouped_flags(self._flag_bits(df, all_positions, groups, n_groups)))
+        grouped.update(self._grouped_ports(self._port_counts(df, all_positions, groups, n_groups)))
+        flags = {name: (np.bincount(pairs[rows], minlength=n_pairs) > 0).astype(np.int64).tolist()
+                 for name, rows in self._any_rows(df, all_positions).items()}
+        epochs = df['frame.time_epoch'].iloc[all_positions].to_numpy(dtype=np.float64, na_value=np.nan)
+        frame_epochs = np.full(n_pairs, np.nan)
+        epoch_pairs, pair_epochs = group_reduce(np.fmax, epochs, pairs)
+        frame_epochs[epoch_pairs] = pair_epochs
+        grouped.update(self._grouped_any(flags, frame_epochs.tolist()))
+        grouped[('_tshark_unique_ips', None)] = self._grouped_unique_ips(df, all_positions, pairs, is_in, n_pairs)
+        mac_indexes = (pair_ids // (int(key_codes.max()) + 1)).tolist()
+        return (mac_indexes, grouped)
+
     def _host_key(self, row):
         raise NotImplementedError
 
@@ -323,44 +661,391 @@ class HostBase:
         ) if not pd.isnull(y) and not x.startswith('_'))
         return self._encode_df_proto_flags(short_row_keys, row['frame.protocols'])
 
+    def _get_ips(self, df, cols):
+        """
+        _get_ip for every row of df, as the factorized IPs: the code of each row's IP (-1 for
+        None) and the distinct ipaddress objects, with None appended so code -1 indexes it.
+        """
+        ipv = df['ip.version']
+        has_version = ipv.notna().to_numpy(dtype=bool)
+        is_ipv4 = (ipv == 4).fillna(False).to_numpy(dtype=bool)
+        ips = pd.Series(None, index=df.index, dtype=object)
+        for prefix, prefix_rows in (('ip', is_ipv4), ('ipv6', has_version & ~is_ipv4)):
+            # the first non-null column wins, so fill from the last.
+            for col in reversed(cols):
+                vals = df['.'.join((prefix, col))]
+                col_rows = prefix_rows & vals.notna().to_numpy(dtype=bool)
+                ips[col_rows] = vals[col_rows]
+        codes, uniques = pd.factorize(ips.to_numpy())
+        return (codes, [ipaddress.ip_address(int(ip)) for ip in uniques] + [None])
+
+    @staticmethod
+    def _ip_flags(ips):
+        """
+        is_private, and is_multicast for IPv4, of distinct ipaddress objects. IPv4 addresses
+        are checked as packed ints against the IANA ranges, and IPv6 ones by ipaddress.
+        """
+        is_ipv4 = np.array([ip is not None and ip.version == 4 for ip in ips], dtype=bool)
+        ipv4_ints = np.array([int(ip) if ipv4 else 0 for ip, ipv4 in zip(ips, is_ipv4)], dtype=np.int64)
+        is_private = is_ipv4 & _in_ranges(ipv4_ints, IPV4_PRIVATE_RANGES)
+        is_multicast = is_ipv4 & _in_ranges(ipv4_ints, IPV4_MULTICAST_RANGES)
+        for i, ip in enumerate(ips):
+            if ip is not None and ip.version == 6:
+                is_private[i] = ip.is_private
+        return (is_private, is_multicast)
+
+    def _df_ip_cols(self, src_ips, dst_ips):
+        """
+        The _srcip, _dstip, _both_private_ip and _ipv4_multicast columns from _get_ips results.
+        """
+        ip_cols = []
+        ip_flags = []
+        for codes, ips in (src_ips, dst_ips):
+            ip_cols.append(np.array([str(ip) for ip in ips], dtype=object)[codes])
+            ip_flags.append([flags[codes] for flags in self._ip_flags(ips)])
+        both_ips = (src_ips[0] != -1) & (dst_ips[0] != -1)
+        both_private_ip = (both_ips & ip_flags[0][0] & ip_flags[1][0]).astype(np.int64)
+        ipv4_multicast = (both_ips & ip_flags[1][1]).astype(np.int64)
+        return (ip_cols[0], ip_cols[1], both_private_ip, ipv4_multicast)
+
+    def _df_protos_ints(self, df):
+        """
+        _df_proto_flags for every row of df: the bits of WK_IP_PROTOS with a non-null column
+        in the row, or in its frame.protocols, encoded once per distinct frame.protocols.
+        """
+        codes, frame_protocols = pd.factorize(df['frame.protocols'].to_numpy())
+        protos_masks = np.array([self._encode_df_proto_flags(frozenset(), protocols)
+                                 for protocols in frame_protocols] + [0], dtype=np.int64)
+        protos_ints = protos_masks[codes]
+        for index, proto in enumerate(WK_IP_PROTOS):
+            proto_cols = [col for col in df.columns if col.split('.')[0] == proto and not col.startswith('_')]
+            if proto_cols:
+                protos_ints |= df[proto_cols].notna().any(axis=1).to_numpy(dtype=np.int64) << index
+        return protos_ints
+
+    def _df_host_keys(self, df, src_ips, dst_ips):
+        raise NotImplementedError
+
+    def _df_intermediates(self, df):
+        """
+        Add the _host_key, IP and protocol columns _tshark_all groups rows by to df, a
+        column at a time rather than _host_key a row at a time, with the same results. All
+        but _host_key are the same for Host and SessionHost, so are computed once per df.
+        """
+        src_ips = self.cached(df, 'host_src_ips', self._get_ips, df, ('src', 'src_host'))
+        dst_ips = self.cached(df, 'host_dst_ips', self._get_ips, df, ('dst', 'dst_host'))
+        protos_ints = self.cached(df, 'host_protos_ints', self._df_protos_ints, df)
+        df['_host_key'] = self._df_host_keys(df, src_ips, dst_ips)
+        df['_srcip'], df['_dstip'], df['_both_private_ip'], df['_ipv4_multicast'] = self.cached(
+            df, 'host_ip_cols', self._df_ip_cols, src_ips, dst_ips)
+        df['_protos_int'] = protos_ints
+
+    def _chunk_state(self, parsed_args):
+        # only the stats grouped_value_stats has can be made a chunk at a time.
+        if {calc_name for calc_name, _ in self.CALC_COL_FUNCS} - set(STATS):
+            return None
+        if getattr(parsed_args, 'sketch', False):
+            return HostChunkState(
+                self, parsed_args.srcmacid, QuantileSketch(parsed_args.quantile_error),
+                DistinctSketch(parsed_args.distinct_error))
+        return HostChunkState(self, parsed_args.srcmacid)
+
     def _tshark_all(self, df, srcmacid):
         print('calculating intermediates', end='', flush=True)
-        df['_host_key'], df['_srcip'], df['_dstip'], df['_both_private_ip'], df['_ipv4_multicast'], df['_protos_int'] = zip(
-            *df.apply(self._host_key, axis=1))
+        self._df_intermediates(df)
         eth_srcs = frozenset(df['eth.src'].unique())
         eth_dsts = frozenset(df['eth.dst'].unique())
+        all_macs = list(eth_srcs.union(eth_dsts))
         all_unicast_macs = frozenset(
-            mac for mac in eth_srcs.union(eth_dsts) if self._is_unicast(mac))
+            mac for mac, unicast in zip(all_macs, self._unicast_macs(all_macs)) if unicast)
         host_keys = df['_host_key'].unique()
         host_keys_count = len(host_keys)
         print('.%u MACs, %u sessions' %
               (len(all_unicast_macs), host_keys_count), end='', flush=True)
         if srcmacid:
-            minsrcipmac = df.groupby(['eth.src'])[
-                '_srcip'].nunique().idxmin(axis=0)
+            minsrcipmac = self.cached(df, 'host_min_srcip_mac', lambda: df.groupby(['eth.src'])[
+                '_srcip'].nunique().idxmin(axis=0))
             assert minsrcipmac in all_unicast_macs
             print('.MAC %s has minimum number of source IPs, selected as canonical source' %
                   self._mac(minsrcipmac), end='', flush=True)
             all_unicast_macs = {minsrcipmac}
-        mac_rows = []
-        for i, mac in enumerate(all_unicast_macs, start=1):
-            mac_df = df[(df['eth.src'] == mac) | (df['eth.dst'] == mac)]
-            # If just one MAC, don't need groupby on host key.
-            if len(all_unicast_macs) == 1:
-                mac_rows.append(self._calc_mac_row(mac, mac_df))
-            else:
-                s = 0
-                for _, key_df in mac_df.groupby('_host_key'):
-                    s += 1
-                    if s % 100 == 0:
-                        print('.MAC %u/%u %.1f%%' % (i, len(all_unicast_macs),
-                                                     s / len(host_keys) * 100), end='', flush=True)
-                    mac_rows.append(self._calc_mac_row(mac, key_df))
-            print('.MAC %u/%u 100%%.' %
-                  (i, len(all_unicast_macs)), end='', flush=True)
+        # each MAC's rows are sliced from one partitioning of df, not masked from all of it.
+        mac_positions = self.cached(df, 'host_mac_partitions', self._mac_partitions, df)
+        macs = list(all_unicast_macs)
+        positions = [mac_positions(mac) for mac in macs]
+        if not macs:
+            return []
+        # If just one MAC, don't need groupby on host key.
+        if len(macs) == 1:
+            key_codes = np.zeros(len(df), dtype=np.int64)
+        else:
+            key_codes, _ = pd.factorize(df['_host_key'].to_numpy(), sort=True)
+        mac_indexes, grouped = self._grouped_calc_vals(df, macs, positions, key_codes)
+        # groups are numbered by MAC and then sorted key, as groupby would have them.
+        mac_rows = self._grouped_rows([macs[mac_index] for mac_index in mac_indexes], grouped)
+        print('.%u groups of %u MACs 100%%.' % (len(mac_rows), len(macs)), end='', flush=True)
         return mac_rows
 
 
+class HostChunkState(ChunkState):
+    """
+    _tshark_all's state a chunk at a time: aggregates of the rows of each MAC and host key
+    (and of each eth.src's source IPs, for srcmacid), from which finalize makes the rows
+    _tshark_all makes from all the rows at once. Counts, flags and order statistics are
+    exact; float totals, averages and variances are to within rounding.
+
+    With sketches, the calc columns' values are counted in quantiles' buckets, so medians
+    and quartiles are to within its relative error, and a group's IPs, once it has more
+    than SKETCH_EXACT_IPS, in distincts' registers, so its unique IP counts are estimates.
+    tshark_srcips has the first SKETCH_SRCIPS source IPs. The source IPs of each eth.src,
+    which srcmacid picks a MAC by, are still exact. A group's state is then bounded however
+    many rows or distinct values it has, and most groups, with few IPs, need no registers.
+    """
+
+    SKETCH_SRCIPS = 16
+    # about as many IPs as take the memory of a group's registers.
+    SKETCH_EXACT_IPS = 64
+
+    def __init__(self, host, srcmacid, quantiles=None, distincts=None):
+        self.host = host
+        self.srcmacid = srcmacid
+        self.quantiles = quantiles
+        self.distincts = distincts
+        # the registers of each group key with too many IPs to count exactly, by IP table.
+        self.registers = {'srcips': {}, 'dstips': {}}
+        self.groups = GroupedAggregates()
+        self.src_macs = GroupedAggregates()
+        # MACs in order of first appearance, to make _tshark_all's sets of them.
+        self.eth_srcs = {}
+        self.eth_dsts = {}
+        # the dtype of each calc column's values, and if it's a nullable integer.
+        self.dtypes = {}
+
+    def add(self, df):
+        chunk = HostChunkState(self.host, self.srcmacid, self.quantiles, self.distincts)
+        chunk._add_chunk(df)
+        return self.merge(chunk)
+
+    def _add_chunk(self, df):
+        host = self.host
+        if df.empty:
+            return
+        host._df_intermediates(df)
+        for macs, col in ((self.eth_srcs, 'eth.src'), (self.eth_dsts, 'eth.dst')):
+            macs.update(dict.fromkeys(int(mac) for mac in df[col].dropna().unique()))
+        if self.srcmacid:
+            codes, src_macs = pd.factorize(df['eth.src'].to_numpy())
+            self.src_macs.index([int(mac) for mac in src_macs])
+            # exactly, even with sketches, so they don't change which MAC is featurized.
+            self.src_macs.add_values('srcips', codes[codes != -1], df['_srcip'].to_numpy()[codes != -1])
+        all_macs = list(self.eth_srcs.keys() | self.eth_dsts.keys())
+        macs = [mac for mac, unicast in zip(all_macs, host._unicast_macs(all_macs)) if unicast]
+        if not macs:
+            return
+        mac_positions = host.cached(df, 'host_mac_partitions', host._mac_partitions, df)
+        positions = [mac_positions(mac) for mac in macs]
+        key_codes, keys = pd.factorize(df['_host_key'].to_numpy(), sort=True)
+        all_positions, pairs, is_in, pair_ids = host._row_groups(df, macs, positions, key_codes)
+        n_keys = int(key_codes.max()) + 1
+        self.groups.index([(macs[pair_id // n_keys], int(keys[pair_id % n_keys])) for pair_id in pair_ids])
+        self._add_groups(df, all_positions, pairs, is_in)
+
+    def _add_groups(self, df, all_positions, pairs, is_in):
+        host = self.host
+        n_pairs = len(self.groups)
+        n_groups = n_pairs * 2
+        groups = pairs * 2 + is_in
+        indexes = np.arange(n_pairs)
+        for col_name, _ in host.CALC_COL_NAMES:
+            values = df[col_name].iloc[all_positions]
+            masked = pd.api.types.is_extension_array_dtype(values.dtype)
+            if masked:
+                data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+            else:
+                data = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            self.dtypes[col_name] = (data.dtype, masked)
+            nulls = values.isna().to_numpy()
+            table_data = data
+            if self.quantiles is not None:
+                table_data = self.quantiles.buckets(data)
+                self._add_moments(col_name, data[~nulls], groups[~nulls], n_pairs)
+            for direction, suffix in enumerate(('out', 'in')):
+                rows = (is_in == direction) & ~nulls
+                self.groups.add_values('calc:%s:%s' % (col_name, suffix), pairs[rows], table_data[rows])
+            self.groups.add('nulls:%s' % col_name, np.add, indexes,
+                            np.bincount(groups[nulls], minlength=n_groups).reshape(n_pairs, 2))
+        for col_name, group_bits in host._flag_bits(df, all_positions, groups, n_groups).items():
+            self.groups.add('flags:%s' % col_name, np.bitwise_or, indexes, group_bits.reshape(n_pairs, 2, -1))
+        for ip_proto, (lowest_ports, src_counts, dst_counts) in host._port_counts(
+                df, all_positions, groups, n_groups).items():
+            self.groups.add('lowest:%s' % ip_proto, np.bitwise_or, indexes, lowest_ports.reshape(n_pairs, 2, -1))
+            self.groups.add('src:%s' % ip_proto, np.add, indexes, src_counts)
+            self.groups.add('dst:%s' % ip_proto, np.add, indexes, dst_counts)
+        for name, rows in host._any_rows(df, all_positions).items():
+            self.groups.add('any:%s' % name, np.bitwise_or, indexes,
+                            (np.bincount(pairs[rows], minlength=n_pairs) > 0).astype(np.int64))
+        epochs = df['frame.time_epoch'].iloc[all_positions].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.groups.add('frame_epoch', np.fmax, *group_reduce(np.fmax, epochs, pairs), empty=np.nan)
+        for name, col_name in (('srcips', '_srcip'), ('dstips', '_dstip')):
+            self._add_ips(self.groups, name, pairs[~is_in], df[col_name].to_numpy()[all_positions][~is_in])
+
+    def _add_moments(self, col_name, data, groups, n_pairs):
+        # the exact stats of sketched values: their total, sum of squares, min and max.
+        floats = data.astype(np.float64)
+        for name, ufunc, moments, empty in (
+                ('total', np.add, data.astype(np.sum(data[:0]).dtype), 0),
+                ('squares', np.add, floats ** 2, 0),
+                ('min', np.fmin, floats, np.nan),
+                ('max', np.fmax, floats, np.nan)):
+            moment_groups, reduced = group_reduce(ufunc, moments, groups)
+            group_moments = np.full(n_pairs * 2, empty, dtype=reduced.dtype)
+            group_moments[moment_groups] = reduced
+            self.groups.add('%s:%s' % (name, col_name), ufunc, np.arange(n_pairs), group_moments.reshape(n_pairs, 2), empty)
+
+    def _add_ips(self, aggregates, name, groups, ips):
+        aggregates.add_values(name, groups, ips)
+        if self.distincts is not None and name == 'srcips':
+            aggregates.add_values('srcips_listed', groups, ips, limit=self.SKETCH_SRCIPS)
+
+    @staticmethod
+    def _add_registers(registers, key, key_registers):
+        if key in registers:
+            np.maximum(registers[key], key_registers, out=registers[key])
+        else:
+            registers[key] = key_registers.copy()
+
+    def _sketch_ips(self, name):
+        # move the IPs of groups with registers, or too many IPs, from the table to registers.
+        registers = self.registers[name]
+        groups, values, _ = self.groups.table(name)
+        sketched = np.bincount(groups, minlength=len(self.groups)) > self.SKETCH_EXACT_IPS
+        sketched[[self.groups.key_index[key] for key in registers]] = True
+        rows = sketched[groups]
+        if not rows.any():
+            return
+        indexes = np.unique(groups[rows])
+        group_registers = self.distincts.group_registers(
+            np.searchsorted(indexes, groups[rows]), values[rows], len(indexes))
+        for index, index_registers in zip(indexes, group_registers):
+            self._add_registers(registers, self.groups.keys[index], index_registers)
+        self.groups.drop_values(name, rows)
+
+    def _ip_counts(self, aggregates, name, registers):
+        # the unique IPs of each group of aggregates, estimated for those with registers.
+        groups, values, _ = aggregates.table(name)
+        counts = np.bincount(groups, minlength=len(aggregates))
+        if registers:
+            indexes = np.array(sorted(registers))
+            rows = np.isin(groups, indexes)
+            group_registers = np.maximum(np.stack([registers[index] for index in indexes]), self.distincts.group_registers(
+                np.searchsorted(indexes, groups[rows]), values[rows], len(indexes)))
+            counts[indexes] = np.round(self.distincts.estimates(group_registers))
+        return counts.tolist()
+
+    def merge(self, other):
+        self.eth_srcs.update(other.eth_srcs)
+        self.eth_dsts.update(other.eth_dsts)
+        self.dtypes.update(other.dtypes)
+        self.groups.merge(other.groups)
+        self.src_macs.merge(other.src_macs)
+        if self.distincts is not None:
+            for name, registers in other.registers.items():
+                for key, key_registers in registers.items():
+                    self._add_registers(self.registers[name], key, key_registers)
+                self._sketch_ips(name)
+        return self
+
+    @staticmethod
+    def _group_values(aggregates, name, n_groups):
+        # the distinct values of each group in the table name, in order of first appearance.
+        groups, values, _ = aggregates.table(name)
+        order = np.argsort(groups, kind='stable')
+        splits = np.cumsum(np.bincount(groups, minlength=n_groups))[:-1]
+        return [group_values.tolist() for group_values in np.split(values[order], splits)]
+
+    def _macs(self):
+        # the MACs _tshark_all would make rows for, in the same order.
+        host = self.host
+        all_macs = list(frozenset(self.eth_srcs).union(frozenset(self.eth_dsts)))
+        all_unicast_macs = frozenset(
+            mac for mac, unicast in zip(all_macs, host._unicast_macs(all_macs)) if unicast)
+        if self.srcmacid and len(self.src_macs):
+            srcip_counts = np.bincount(self.src_macs.table('srcips')[0], minlength=len(self.src_macs))
+            # the fewest source IPs, and the lowest MAC of those, as groupby sorts them.
+            minsrcipmac = min(zip(srcip_counts, self.src_macs.keys))[1]
+            assert minsrcipmac in all_unicast_macs
+            all_unicast_macs = {minsrcipmac}
+        return list(all_unicast_macs)
+
+    def _calc_stats(self, aggregates):
+        # the grouped_stats of each calc column, for the out and in groups of aggregates in turn.
+        n_groups = len(aggregates) * 2
+        calc_stats = {}
+        for col_name, _ in self.host.CALC_COL_NAMES:
+            dtype, masked = self.dtypes[col_name]
+            if self.quantiles is not None:
+                table_dtype = np.int64
+            else:
+                table_dtype = dtype
+            tables = [aggregates.table('calc:%s:%s' % (col_name, suffix), table_dtype) for suffix in ('out', 'in')]
+            groups = np.concatenate([table[0] * 2 + direction for direction, table in enumerate(tables)])
+            values = np.concatenate([table[1] for table in tables])
+            counts = np.concatenate([table[2] for table in tables])
+            nulls = aggregates.array('nulls:%s' % col_name).reshape(n_groups)
+            if self.quantiles is None:
+                calc_stats[col_name] = grouped_value_stats(groups, values, counts, n_groups, nulls, masked)
+                continue
+            stats = grouped_value_stats(groups, self.quantiles.values(values), counts, n_groups, nulls, False)
+            calc_stats[col_name] = moment_stats(stats, *[
+                aggregates.array('%s:%s' % (name, col_name)).reshape(n_groups)
+                for name in ('total', 'squares', 'min', 'max')], dtype)
+        return calc_stats
+
+    def finalize(self):
+        host = self.host
+        macs = self._macs()
+        if not macs:
+            return []
+        if len(macs) == 1:
+            # as _tshark_all, all of a single MAC's rows are one group.
+            keys = [(mac, 0) if mac == macs[0] else None for mac, _ in self.groups.keys]
+        else:
+            keys = self.groups.keys
+        mac_order = {mac: i for i, mac in enumerate(macs)}
+        aggregates = GroupedAggregates()
+        aggregates.index(sorted({key for key in keys if key is not None}, key=lambda key: (mac_order[key[0]], key[1])))
+        aggregates.merge(self.groups, keys)
+        key_map = dict(zip(self.groups.keys, keys))
+        n_groups = len(aggregates) * 2
+
+        grouped = host._grouped_calc(self._calc_stats(aggregates))
+        grouped.update(host._grouped_flags({
+            col_name: aggregates.array('flags:%s' % col_name).reshape(n_groups, -1)
+            for col_name in [col_name for col_name, _ in host.FLAG_DECODE_MAPS] + ['_protos_int']}))
+        grouped.update(host._grouped_ports({
+            ip_proto: (aggregates.array('lowest:%s' % ip_proto).reshape(n_groups, -1),
+                       aggregates.array('src:%s' % ip_proto), aggregates.array('dst:%s' % ip_proto))
+            for ip_proto in TCP_UDP_PROTOS.values()}))
+        flags = {name.split(':', 1)[1]: array.tolist() for name, (_, _, array) in aggregates.arrays.items()
+                 if name.startswith('any:')}
+        grouped.update(host._grouped_any(flags, aggregates.array('frame_epoch').tolist()))
+        ip_counts = {}
+        for name in ('srcips', 'dstips'):
+            # each group's registers, under the key of aggregates it was merged into.
+            registers = {}
+            for key, key_registers in self.registers[name].items():
+                if key_map[key] is not None:
+                    self._add_registers(registers, aggregates.key_index[key_map[key]], key_registers)
+            ip_counts[name] = self._ip_counts(aggregates, name, registers)
+        srcips = self._group_values(aggregates, 'srcips' if self.distincts is None else 'srcips_listed', len(aggregates))
+        grouped[('_tshark_unique_ips', None)] = {
+            'tshark_srcips': [list(set(ips) - {'None'}) for ips in srcips],
+            'tshark_unique_srcips': ip_counts['srcips'],
+            'tshark_unique_dstips': ip_counts['dstips'],
+        }
+        return host._grouped_rows([mac for mac, _ in aggregates.keys], grouped)
+
+
 class Host(HostBase, Features):
 
     def _host_key(self, row):
@@ -370,35 +1055,99 @@ class Host(HostBase, Features):
         protos_int = self._df_proto_flags(row)
         return (0, str(ip_src), str(ip_dst), both_private_ip, ipv4_multicast, protos_int)
 
+    def _df_host_keys(self, df, src_ips, dst_ips):
+        return np.zeros(len(df), dtype=np.int64)
+
     def host_tshark_all(self, df, parsed_args):
         return self._tshark_all(df, parsed_args.srcmacid)
 
+    def chunk_state(self, func_name, parsed_args):
+        if func_name == 'host_tshark_all':
+            return self._chunk_state(parsed_args)
+        return None
+
 
 class SessionHost(HostBase, Features):
 
+    @staticmethod
+    def _key_col(df, col):
+        # a column as uint64s, nulls (or no such column) being NULL_KEY.
+        key_col = np.full(len(df), NULL_KEY, dtype=np.uint64)
+        if col in df.columns:
+            vals = df[col]
+            notna = vals.notna().to_numpy(dtype=bool)
+            key_col[notna] = vals[notna].to_numpy(dtype=np.uint64)
+        return key_col
+
+    @staticmethod
+    def _ip_key_cols(ips):
+        """
+        Each row's IP, from _get_ips, as uint64 version (0 for None), high and low bits.
+        """
+        codes, uniques = ips
+        ip_ints = [0 if ip is None else int(ip) for ip in uniques]
+        versions = np.array([0 if ip is None else ip.version for ip in uniques], dtype=np.uint64)
+        highs = np.array([ip_int >> 64 for ip_int in ip_ints], dtype=np.uint64)
+        lows = np.array([ip_int & (2**64 - 1) for ip_int in ip_ints], dtype=np.uint64)
+        return (versions[codes], highs[codes], lows[codes])
+
     def _host_key(self, row):
-        eth_src = row['eth.src']
-        eth_dst = row['eth.dst']
         ip_src = self._get_src_ip(row)
         ip_dst = self._get_dst_ip(row)
         both_private_ip, ipv4_multicast = self._df_ip_flags(ip_src, ip_dst)
         protos_int = self._df_proto_flags(row)
-        if not pd.isnull(ip_src) and not pd.isnull(ip_dst):
-            ip_proto = TCP_UDP_PROTOS.get(row['ip.version'], None)
-            if ip_proto:
-                src_port = row['%s.srcport' % ip_proto]
-                dst_port = row['%s.dstport' % ip_proto]
-                if ip_src > ip_dst:
-                    key = (ip_proto, eth_src, ip_src,
-                           src_port, eth_dst, ip_dst, dst_port)
-                else:
-                    key = (ip_proto, eth_dst, ip_dst,
-                           dst_port, eth_src, ip_src, src_port)
-            else:
-                key = sorted([(eth_src, ip_src), (eth_dst, ip_dst)])
-        else:
-            key = (row['eth.type'],) + tuple(sorted((eth_src, eth_dst)))
-        return (hash('-'.join([str(x) for x in key])), str(ip_src), str(ip_dst), both_private_ip, ipv4_multicast, protos_int)
+        # the key of a one row frame, so there's only _df_host_keys' implementation of it.
+        row_df = pd.DataFrame([row])
+        key = self._df_host_keys(
+            row_df, self._get_ips(row_df, ('src', 'src_host')), self._get_ips(row_df, ('dst', 'dst_host')))[0]
+        return (key, str(ip_src), str(ip_dst), both_private_ip, ipv4_multicast, protos_int)
+
+    def _df_host_keys(self, df, src_ips, dst_ips):
+        """
+        A session key for each row of df, the same for both directions of a session: with
+        ports (see below) by each end's MAC, IP and port; other IP by each end's MAC and IP;
+        and non-IP by eth.type and MACs. Keys are 64 bit hashes of the session, computed a
+        column at a time, so they are the same in every process and run.
+        """
+        eth_srcs = self._key_col(df, 'eth.src')
+        eth_dsts = self._key_col(df, 'eth.dst')
+        src_ip_cols = self._ip_key_cols(src_ips)
+        dst_ip_cols = self._ip_key_cols(dst_ips)
+        src_versions, src_highs, src_lows = src_ip_cols
+        dst_versions, dst_highs, dst_lows = dst_ip_cols
+        has_ips = (src_versions != 0) & (dst_versions != 0)
+        ip_versions = df['ip.version']
+        protos = np.zeros(len(df), dtype=np.uint64)
+        src_ports = np.zeros(len(df), dtype=np.uint64)
+        dst_ports = np.zeros(len(df), dtype=np.uint64)
+        # TCP_UDP_PROTOS is keyed by IP protocol number, but session keys have always
+        # looked up ip.version in it, so IPv6 rows take TCP ports and IPv4 rows none. This
+        # deliberately reproduces those sessions; ip.proto would key them by real protocol.
+        for version_as_proto, port_proto in TCP_UDP_PROTOS.items():
+            port_rows = has_ips & (ip_versions == version_as_proto).fillna(False).to_numpy(dtype=bool)
+            protos[port_rows] = version_as_proto
+            src_ports[port_rows] = self._key_col(df, '%s.srcport' % port_proto)[port_rows]
+            dst_ports[port_rows] = self._key_col(df, '%s.dstport' % port_proto)[port_rows]
+        has_ports = protos != 0
+        src_ip_gt = (src_versions > dst_versions) | ((src_versions == dst_versions) & (
+            (src_highs > dst_highs) | ((src_highs == dst_highs) & (src_lows > dst_lows))))
+        # sessions with ports start with the higher IP, others with the lower MAC (and IP).
+        src_first = np.where(
+            has_ports, src_ip_gt,
+            (eth_srcs < eth_dsts) | ((eth_srcs == eth_dsts) & ~(has_ips & src_ip_gt)))
+        kinds = np.where(has_ports, 1, np.where(has_ips, 2, 3)).astype(np.uint64)
+        # non-IP sessions are just their eth.type and MACs.
+        protos[~has_ips] = self._key_col(df, 'eth.type')[~has_ips]
+        src_cols = [eth_srcs] + [np.where(has_ips, col, np.uint64(0)) for col in src_ip_cols] + [src_ports]
+        dst_cols = [eth_dsts] + [np.where(has_ips, col, np.uint64(0)) for col in dst_ip_cols] + [dst_ports]
+        first_cols = [np.where(src_first, src_col, dst_col) for src_col, dst_col in zip(src_cols, dst_cols)]
+        second_cols = [np.where(src_first, dst_col, src_col) for src_col, dst_col in zip(src_cols, dst_cols)]
+        return _hash64([kinds, protos] + first_cols + second_cols)
 
     def sessionhost_tshark_all(self, df, parsed_args):
         return self._tshark_all(df, parsed_args.srcmacid)
+
+    def chunk_state(self, func_name, parsed_args):
+        if func_name == 'sessionhost_tshark_all':
+            return self._chunk_state(parsed_args)
+        return None
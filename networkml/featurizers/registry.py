@@ -0,0 +1,148 @@
+import ast
+import importlib
+import importlib.metadata
+import inspect
+import os
+import sys
+
+from networkml.featurizers.features import Features
+
+# Features classes can also be installed as entry points of this group, named by class.
+ENTRY_POINT_GROUP = 'networkml.featurizers'
+
+
+def _entry_points():
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=ENTRY_POINT_GROUP))
+    return list(entry_points.get(ENTRY_POINT_GROUP, []))  # pragma: no cover
+
+
+def _module_classes(source):
+    """
+    The names of the bases and of the methods of each class defined in source, and the
+    (module, name) each name imported from a module is.
+    """
+    classes = {}
+    imports = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.ClassDef):
+            bases = [base.id if isinstance(base, ast.Name) else getattr(base, 'attr', None) for base in node.bases]
+            methods = {item.name for item in node.body if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))}
+            classes[node.name] = (bases, methods)
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            for alias in node.names:
+                imports[alias.asname or alias.name] = (node.module, alias.name)
+    return (classes, imports)
+
+
+class FeatureRegistry():
+    """
+    The Features classes of the modules in path, and of entry points, and which of them
+    groups and functions select. Modules are indexed by parsing their source rather than
+    importing it, so only modules with a selected class are imported, and then only once;
+    classes are instantiated once too. Entry points are loaded only when functions name
+    them, or when there are groups, as what methods they have isn't known until then.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # (module name, class name, method names or None if unknown without importing).
+        self.index = []
+        # instance of each (module or entry point name, class name).
+        self.instances = {}
+        if not os.path.isdir(path):
+            print('Error: path {} does not exist'.format(path))
+            return
+        for f in sorted(os.listdir(path)):
+            if f[-3:] != '.py':
+                continue
+            with open(os.path.join(path, f)) as f_in:
+                classes, imports = _module_classes(f_in.read())
+            for class_name in classes:
+                is_features, methods = self._resolve(class_name, classes, imports, set())
+                if is_features is not False:
+                    self.index.append((f[:-3], class_name, methods))
+
+    @staticmethod
+    def _imported_class(name, imports):
+        # only classes of modules imported already, so indexing imports nothing.
+        module_name, attr = imports.get(name, (None, None))
+        obj = getattr(sys.modules.get(module_name, None), attr or '', None)
+        if inspect.isclass(obj):
+            return obj
+        return None
+
+    def _resolve(self, class_name, classes, imports, seen):
+        """
+        Whether class_name is a Features class, and its methods, inherited ones included, or
+        None for either if a base is from a module not imported yet.
+        """
+        seen = seen | {class_name}
+        bases, methods = classes[class_name]
+        methods = set(methods)
+        base_features = []
+        for base in bases:
+            base_class = self._imported_class(base, imports)
+            if base in classes and base not in seen:
+                is_features, base_methods = self._resolve(base, classes, imports, seen)
+            elif base_class is not None:
+                is_features, base_methods = (issubclass(base_class, Features), set(dir(base_class)))
+            elif base == 'object':
+                is_features, base_methods = (False, set())
+            else:
+                is_features, base_methods = (None, None)
+            base_features.append(is_features)
+            if methods is not None:
+                methods = None if base_methods is None else methods | base_methods
+        is_features = True if True in base_features else (None if None in base_features else False)
+        return (is_features, methods)
+
+    def _instance(self, key, cls):
+        if key not in self.instances:
+            self.instances[key] = cls()
+            print(f'Importing class: {key[1]}')
+        return self.instances[key]
+
+    def classes(self, functions, groups):
+        """
+        The (instance, class name) of each class with a method of groups, or named by one
+        of the (class name, method) functions, importing only their modules.
+        """
+        function_classes = {function[0] for function in functions}
+
+        def selected(class_name, methods):
+            if class_name in function_classes:
+                return True
+            if not groups:
+                return False
+            return methods is None or any(method.startswith(groups) for method in methods)
+
+        classes = []
+        modules = [mod_name for mod_name, class_name, methods in self.index if selected(class_name, methods)]
+        if modules and self.path not in sys.path:
+            sys.path.append(self.path)
+        for mod_name, class_name, methods in self.index:
+            if mod_name not in modules:
+                continue
+            cls = getattr(importlib.import_module(mod_name), class_name, None)
+            if inspect.isclass(cls) and issubclass(cls, Features) and selected(class_name, set(dir(cls))):
+                classes.append((self._instance((mod_name, class_name), cls), class_name))
+        for entry_point in _entry_points():
+            if groups or entry_point.name in function_classes:
+                cls = entry_point.load()
+                if selected(entry_point.name, set(dir(cls))):
+                    classes.append((self._instance((entry_point.value, entry_point.name), cls), entry_point.name))
+        return classes
+
+
+_REGISTRIES = {}
+
+
+def feature_registry(path):
+    """
+    The FeatureRegistry of path, made once per process.
+    """
+    if path not in _REGISTRIES:
+        _REGISTRIES[path] = FeatureRegistry(path)
+    return _REGISTRIES[path]
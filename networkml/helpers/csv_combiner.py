@@ -0,0 +1,135 @@
+import csv
+import io
+import os
+import shutil
+
+from networkml.helpers.csv_row_writer import csv_header
+from networkml.helpers.gzipio import compress
+from networkml.helpers.gzipio import COMPRESS_BLOCK
+from networkml.helpers.gzipio import first_frame
+from networkml.helpers.gzipio import text_reader
+
+
+class CSVCombiner():
+    """
+    Append CSVs to one combined CSV as they become available, instead of re-reading them
+    all at the end. A file whose header is already the combined header, and is in a gzip
+    member or frame of its own (as CSVRowWriter writes it), has the rest of its bytes
+    copied without decompressing them, so all the files must use the same codec. Other
+    files have their rows remapped onto the combined header. A file bringing new columns
+    starts a new part with the grown header; parts are merged on close, and only parts
+    with an older header are remapped then.
+    """
+
+    def __init__(self, out_file, codec='gzip', level=None, remove=True):
+        self.out_file = out_file
+        self.codec = codec
+        self.level = level
+        self.remove = remove
+        self.header = None
+        self.parts = []
+        self.f_out = None
+        self.copied = 0
+        self.remapped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_header(self, in_file):
+        """
+        Return the header of in_file and the offset its rows start at,
+        or None for the offset if they can't be copied as they are.
+        """
+        if self.codec != 'none':
+            data, offset = first_frame(in_file)
+        else:
+            with open(in_file, 'rb') as f_in:
+                data = f_in.readline()
+            offset = len(data)
+        if data:
+            header = next(csv.reader(io.StringIO(data.decode('utf-8'), newline='')), [])
+            if csv_header(header).encode('utf-8') == data:
+                return (header, offset)
+        with text_reader(in_file) as f_in:
+            return (next(csv.reader(f_in), []), None)
+
+    def _write_text(self, text):
+        self.f_out.write(compress(text.encode('utf-8'), self.codec, self.level))
+
+    def _start_part(self):
+        part_file = self.out_file
+        if self.parts:
+            part_file = '%s.part%u' % (self.out_file, len(self.parts))
+        self.parts.append(part_file)
+        self.f_out = open(part_file, 'wb')
+        self._write_text(csv_header(self.header))
+
+    def _copy(self, in_file, offset):
+        with open(in_file, 'rb') as f_in:
+            f_in.seek(offset)
+            shutil.copyfileobj(f_in, self.f_out)
+
+    def _remap(self, in_file):
+        f_text = io.StringIO(newline='')
+        writer = csv.DictWriter(f_text, fieldnames=self.header)
+        with text_reader(in_file) as f_in:
+            for row in csv.DictReader(f_in):
+                writer.writerow(row)
+                if f_text.tell() >= COMPRESS_BLOCK:
+                    self._write_text(f_text.getvalue())
+                    f_text.seek(0)
+                    f_text.truncate()
+        if f_text.tell():
+            self._write_text(f_text.getvalue())
+
+    def _append(self, in_file, header, offset):
+        if header == self.header and offset is not None:
+            self._copy(in_file, offset)
+            return True
+        self._remap(in_file)
+        return False
+
+    def add(self, in_file):
+        if not os.path.exists(in_file):
+            return
+        header, offset = self._read_header(in_file)
+        if header:
+            if self.header is None or not set(header).issubset(self.header):
+                if self.header is None:
+                    self.header = []
+                self.header.extend(field for field in header if field not in self.header)
+                if self.f_out is not None:
+                    self.f_out.close()
+                self._start_part()
+            if self._append(in_file, header, offset):
+                self.copied += 1
+            else:
+                self.remapped += 1
+        if self.remove:
+            os.remove(in_file)
+
+    def close(self):
+        if self.f_out is not None:
+            self.f_out.close()
+            self.f_out = None
+        elif not self.parts:
+            # nothing was added, but there should still be an output.
+            self.f_out = open(self.out_file, 'wb')
+            self._write_text('')
+            self.f_out.close()
+            self.f_out = None
+        if len(self.parts) > 1:
+            first_part = '%s.part0' % self.out_file
+            os.rename(self.out_file, first_part)
+            part_files = [first_part] + self.parts[1:]
+            self.parts = []
+            self._start_part()
+            for part_file in part_files:
+                self._append(part_file, *self._read_header(part_file))
+                os.remove(part_file)
+            self.f_out.close()
+            self.f_out = None
+        self.parts = []
@@ -0,0 +1,123 @@
+import csv
+import io
+import os
+
+from networkml.helpers.gzipio import text_reader
+from networkml.helpers.gzipio import text_writer
+
+
+def csv_header(fieldnames):
+    # the header line exactly as csv.DictWriter.writeheader() writes it.
+    f_out = io.StringIO(newline='')
+    csv.writer(f_out).writerow(fieldnames)
+    return f_out.getvalue()
+
+
+class CSVRowWriter():
+    """
+    Write dict rows with an open ended set of keys to a compressed CSV in a single pass.
+    The first buffer_rows rows are held in memory to learn the header. If a later row
+    brings a new key, the output so far is kept as a part and a new part is started with
+    the grown header; parts are only re-encoded into one file on close when that happens.
+    Any extra fields are written first, with the same value in every row. The header is
+    a gzip member of its own, so CSVCombiner can append the rows without re-encoding them.
+    The codec, level and compression threads are as for gzipio.text_writer().
+    """
+
+    def __init__(self, out_file, buffer_rows=10000, fieldnames=None, extra=None,
+                 codec='gzip', level=None, threads=0):
+        self.out_file = out_file
+        self.buffer_rows = buffer_rows
+        self.header = []
+        self.header_set = set()
+        self.seen_keys = set()
+        self.rows = []
+        self.parts = []
+        self.f_out = None
+        self.writer = None
+        self.row_count = 0
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.extra = extra or {}
+        self._add_keys(self.extra)
+        if fieldnames:
+            self._add_keys(fieldnames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def good_key(key):
+        return key[0].isalpha() or key[0] == '_'
+
+    def _add_keys(self, keys):
+        for key in keys:
+            self.seen_keys.add(key)
+            if key not in self.header_set and self.good_key(key):
+                self.header_set.add(key)
+                self.header.append(key)
+
+    def _close_part(self):
+        if self.f_out is not None:
+            self.f_out.close()
+            self.f_out = None
+            self.writer = None
+
+    def _flush(self, force=False):
+        if not self.rows and not force:
+            return
+        if self.writer is None:
+            part_file = self.out_file
+            if self.parts:
+                part_file = '%s.part%u' % (self.out_file, len(self.parts))
+            self.parts.append(part_file)
+            self.f_out = self._writer(part_file)
+            self.writer = csv.DictWriter(
+                self.f_out, fieldnames=list(self.header), extrasaction='ignore')
+        if self.extra:
+            for row in self.rows:
+                row.update(self.extra)
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+    def _writer(self, out_file):
+        return text_writer(out_file, self.codec, self.level, self.threads, header=csv_header(self.header))
+
+    def writerow(self, row):
+        if not self.seen_keys.issuperset(row.keys()):
+            header_len = len(self.header)
+            self._add_keys(row.keys())
+            if self.writer is not None and len(self.header) != header_len:
+                self._flush()
+                self._close_part()
+        self.rows.append(row)
+        self.row_count += 1
+        if len(self.rows) >= self.buffer_rows:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _merge_parts(self):
+        first_part = '%s.part0' % self.out_file
+        os.rename(self.out_file, first_part)
+        self.parts[0] = first_part
+        with self._writer(self.out_file) as f_out:
+            writer = csv.DictWriter(f_out, fieldnames=self.header)
+            for part_file in self.parts:
+                with text_reader(part_file) as f_in:
+                    writer.writerows(csv.DictReader(f_in))
+                os.remove(part_file)
+
+    def close(self):
+        # always write a header, even with no rows.
+        self._flush(force=not self.parts)
+        self._close_part()
+        if len(self.parts) > 1:
+            self._merge_parts()
+        self.parts = []
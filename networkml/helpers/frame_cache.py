@@ -0,0 +1,41 @@
+import weakref
+
+
+class FrameCache():
+    """
+    Values derived from DataFrames, such as intermediate columns and partitions of rows,
+    computed once per DataFrame however many featurizers ask for them, and dropped along
+    with the DataFrame. A value's name must say everything it's derived from other than
+    the DataFrame, and the columns it's derived from must not change once it's cached.
+    """
+
+    def __init__(self):
+        # {name: value} for each DataFrame, by id.
+        self.frames = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _values(self, df):
+        frame_id = id(df)
+        values = self.frames.get(frame_id, None)
+        if values is None:
+            values = {}
+            self.frames[frame_id] = values
+            # forget the values before the id can be reused.
+            weakref.finalize(df, self.frames.pop, frame_id, None)
+        return values
+
+    def get(self, df, name, func, *args):
+        """
+        The value name of df, func(*args) if no featurizer has asked for it yet.
+        """
+        values = self._values(df)
+        if name in values:
+            self.hits += 1
+            return values[name]
+        self.misses += 1
+        values[name] = func(*args)
+        return values[name]
+
+    def clear(self, df):
+        self.frames.pop(id(df), None)
@@ -0,0 +1,307 @@
+import numpy as np
+import pandas as pd
+
+STATS = ('max', 'min', 'count', 'total', 'average', 'median', 'variance', '25q', '75q')
+QUANTILES = (('25q', 0.25), ('75q', 0.75))
+# numpy sums fewer than this many values in order, and more pairwise.
+PAIRWISE_MIN = 8
+
+
+def _group_sums(values, starts, sizes):
+    """
+    Sum each group of the grouped values as values[start:start + size].sum() would, to
+    the last bit: the short groups a column at a time, the rest one at a time.
+    """
+    sums = np.zeros(len(sizes), dtype=values.dtype)
+    short = np.flatnonzero((sizes > 0) & (sizes < PAIRWISE_MIN))
+    for i in range(PAIRWISE_MIN - 1):
+        short = short[sizes[short] > i]
+        sums[short] += values[starts[short] + i]
+    for group in np.flatnonzero(sizes >= PAIRWISE_MIN):
+        start = starts[group]
+        sums[group] = values[start:start + sizes[group]].sum()
+    return sums
+
+
+def _stat_list(stats, valid, null=0):
+    # numpy scalars of the stat's own type, as the Series reductions return them.
+    stat_list = list(stats)
+    for group in np.flatnonzero(~valid):
+        stat_list[group] = null
+    return stat_list
+
+
+def _order_stats(stats, sorted_at, counts, group_nulls, dtype, masked):
+    """
+    Add the max, min, median and quartiles of each group to stats, from sorted_at(offsets),
+    each group's offsets'th smallest non null value.
+    """
+    valid = counts > 0
+    last = np.maximum(counts - 1, 0)
+    stats['max'] = _stat_list(sorted_at(last, dtype), valid)
+    stats['min'] = _stat_list(sorted_at(0, dtype), valid)
+    halves = last // 2
+    medians = np.where(counts % 2, sorted_at(halves), (sorted_at(halves) + sorted_at(halves + 1)) / 2)
+    stats['median'] = _stat_list(medians, valid)
+    for stat, quantile in QUANTILES:
+        positions = last * quantile
+        below = np.floor(positions).astype(np.int64)
+        above = np.minimum(below + 1, last)
+        fraction = positions - below
+        lows = sorted_at(below)
+        highs = sorted_at(above)
+        diffs = highs - lows
+        quantiles = np.where(fraction >= 0.5, highs - diffs * (1 - fraction), lows + diffs * fraction)
+        stat_list = _stat_list(quantiles, valid)
+        if masked:
+            # a group with nulls has its quantile cast back to an integer if it is one.
+            for group in np.flatnonzero(valid & group_nulls & (quantiles == np.floor(quantiles))):
+                stat_list[group] = dtype.type(quantiles[group])
+        stats[stat] = stat_list
+
+
+def grouped_stats(values, groups, n_groups):
+    """
+    STATS of values (a Series of floats or nullable integers) for each of n_groups
+    groups, as lists of what Series.max(), .min(), .count(), .sum(), .mean(), .median(),
+    .var(), .quantile(0.25) and .quantile(0.75) return for the group's values, nulls
+    being 0. Returns None for values of any other type.
+    """
+    if pd.api.types.is_float_dtype(values.dtype) and isinstance(values.dtype, np.dtype):
+        data = values.to_numpy()
+        mask = np.isnan(data)
+        masked = False
+    elif pd.api.types.is_integer_dtype(values.dtype) and pd.api.types.is_extension_array_dtype(values.dtype):
+        data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+        mask = values.isna().to_numpy()
+        masked = True
+    else:
+        return None
+    # one stable sort into groups for the sums, which are order sensitive.
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    data = data[order]
+    mask = mask[order]
+    sizes = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(sizes) - sizes
+    counts = np.bincount(groups[~mask], minlength=n_groups)
+    valid = counts > 0
+    filled = np.where(mask, 0, data)
+    stats = {'count': list(counts)}
+
+    totals = _group_sums(filled.astype(np.sum(data[:0]).dtype), starts, sizes)
+    stats['total'] = list(totals)
+    filled = filled.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = totals / counts
+        squares = (np.repeat(averages, sizes) - filled) ** 2
+        squares[mask] = 0
+        variances = _group_sums(squares, starts, sizes) / (counts - 1)
+    stats['average'] = _stat_list(averages, valid)
+    stats['variance'] = _stat_list(variances, counts > 1)
+
+    # one sort of the non null values, for the extremes, median and quantiles.
+    nonnull = data[~mask]
+    nonnull = nonnull[np.lexsort((nonnull, groups[~mask]))]
+    if not len(nonnull):
+        nonnull = np.zeros(1, dtype=data.dtype)
+    nonnull_starts = np.cumsum(counts) - counts
+
+    def sorted_at(offsets, dtype=np.float64):
+        return nonnull[np.minimum(nonnull_starts + offsets, len(nonnull) - 1)].astype(dtype)
+
+    _order_stats(stats, sorted_at, counts, counts < sizes, data.dtype, masked)
+    return stats
+
+
+def grouped_value_stats(groups, values, counts, n_groups, nulls, masked):
+    """
+    grouped_stats from distinct values of each group and how many rows had them, as
+    GroupedAggregates.table() gives them, with nulls the null rows each group had. Order
+    and integer statistics are exact; the float ones may differ in their last bits from
+    those of the rows, being summed in another order.
+    """
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    values = values[order]
+    counts = counts[order]
+    group_counts = np.bincount(groups, weights=counts, minlength=n_groups).astype(np.int64)
+    valid = group_counts > 0
+    stats = {'count': list(group_counts)}
+    if masked:
+        totals = np.zeros(n_groups, dtype=np.sum(values[:0]).dtype)
+        np.add.at(totals, groups, values.astype(totals.dtype) * counts.astype(totals.dtype))
+    else:
+        totals = np.bincount(groups, weights=values * counts, minlength=n_groups)
+    stats['total'] = list(totals)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = totals / group_counts
+        squares = np.bincount(groups, weights=counts * (values - averages[groups]) ** 2, minlength=n_groups)
+        variances = squares / (group_counts - 1)
+    stats['average'] = _stat_list(averages, valid)
+    stats['variance'] = _stat_list(variances, group_counts > 1)
+    ranks = np.cumsum(counts)
+    rank_starts = np.cumsum(group_counts) - group_counts
+    dtype = values.dtype
+    if not len(values):
+        values = np.zeros(1, dtype=dtype)
+
+    def sorted_at(offsets, dtype=np.float64):
+        at = np.searchsorted(ranks, rank_starts + offsets, side='right')
+        return values[np.minimum(at, len(values) - 1)].astype(dtype)
+
+    _order_stats(stats, sorted_at, group_counts, nulls > 0, dtype, masked)
+    return stats
+
+
+def moment_stats(stats, totals, squares, mins, maxes, dtype):
+    """
+    Replace the total, average, variance, min and max in stats, as grouped_value_stats made
+    them from approximate values (sketch buckets', say), with those of each group's total,
+    sum of squares, min and max, keeping the exact counts.
+    """
+    counts = np.array(stats['count'], dtype=np.int64)
+    valid = counts > 0
+    stats['total'] = list(totals)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        averages = totals / counts
+        variances = np.maximum(squares - totals * averages, 0) / (counts - 1)
+    stats['average'] = _stat_list(averages, valid)
+    stats['variance'] = _stat_list(variances, counts > 1)
+    stats['min'] = _stat_list(np.nan_to_num(mins).astype(dtype), valid)
+    stats['max'] = _stat_list(np.nan_to_num(maxes).astype(dtype), valid)
+    return stats
+
+
+def group_reduce(ufunc, values, groups):
+    """
+    ufunc.reduce of the values of each group with any: the groups, and their reductions.
+    """
+    if not len(groups):
+        return (groups, values[:0])
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    starts = np.flatnonzero(np.append(True, groups[1:] != groups[:-1]))
+    return (groups[starts], ufunc.reduceat(values[order], starts))
+
+
+class GroupedAggregates():
+    """
+    Aggregates of rows by group key, which can be merged: arrays with a row per group,
+    each combined with its own ufunc (np.add for counts, np.bitwise_or for flags, np.fmax
+    for latest times...), and tables of the distinct values of each group, with how many
+    rows had them. Rows aggregated a chunk at a time and merged give the same aggregates.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.key_index = {}
+        # name: (ufunc, the value of a group with no rows, array).
+        self.arrays = {}
+        # name: ([group arrays], [value arrays], [count arrays], rows when last compacted).
+        self.tables = {}
+        # name: the most distinct values a group of the table keeps, the first it has.
+        self.limits = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, keys):
+        """
+        The index of each of keys, adding the new ones as groups with no rows.
+        """
+        indexes = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            index = self.key_index.get(key, None)
+            if index is None:
+                index = len(self.keys)
+                self.key_index[key] = index
+                self.keys.append(key)
+            indexes[i] = index
+        for name, (ufunc, empty, array) in self.arrays.items():
+            if len(array) < len(self.keys):
+                grown = np.full((len(self.keys),) + array.shape[1:], empty, dtype=array.dtype)
+                grown[:len(array)] = array
+                self.arrays[name] = (ufunc, empty, grown)
+        return indexes
+
+    def add(self, name, ufunc, indexes, values, empty=0):
+        """
+        Combine values, a row for each of the groups at indexes, into the array name.
+        """
+        values = np.asarray(values)
+        if name not in self.arrays:
+            self.arrays[name] = (ufunc, empty, np.full((len(self.keys),) + values.shape[1:], empty, dtype=values.dtype))
+        ufunc, _, array = self.arrays[name]
+        ufunc.at(array, indexes, values)
+
+    def array(self, name):
+        return self.arrays[name][2]
+
+    def add_values(self, name, indexes, values, counts=None, limit=None):
+        """
+        Add values, of rows of the groups at indexes, to the table name, which keeps only
+        the first limit distinct values of each group if there's a limit.
+        """
+        if limit is not None:
+            self.limits[name] = limit
+        if counts is None:
+            counts = np.ones(len(values), dtype=np.int64)
+        table = self.tables.setdefault(name, ([], [], [], 0))
+        table[0].append(np.asarray(indexes, dtype=np.int64))
+        table[1].append(np.asarray(values))
+        table[2].append(np.asarray(counts, dtype=np.int64))
+        # compact as the table doubles, so repeated values cost memory once per group.
+        if sum(len(groups) for groups in table[0]) > max(2 * table[3], 1 << 16):
+            self.table(name)
+
+    def table(self, name, dtype=object):
+        """
+        The distinct (group, value) pairs of the table name, and how many rows had them.
+        """
+        groups, values, counts, _ = self.tables.get(name, ([], [], [], 0))
+        if not groups:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=dtype), np.zeros(0, dtype=np.int64))
+        groups = np.concatenate(groups)
+        values = np.concatenate(values)
+        counts = np.concatenate(counts)
+        if len(groups):
+            pairs = pd.MultiIndex.from_arrays((groups, values))
+            codes, distinct = pd.factorize(pairs)
+            groups = distinct.get_level_values(0).to_numpy(dtype=np.int64)
+            values = distinct.get_level_values(1).to_numpy(dtype=values.dtype)
+            counts = np.bincount(codes, weights=counts, minlength=len(distinct)).astype(np.int64)
+            limit = self.limits.get(name, None)
+            if limit is not None:
+                order = np.argsort(groups, kind='stable')
+                ranks = np.empty(len(groups), dtype=np.int64)
+                ranks[order] = np.arange(len(groups)) - np.searchsorted(groups[order], groups[order])
+                groups, values, counts = groups[ranks < limit], values[ranks < limit], counts[ranks < limit]
+        self.tables[name] = ([groups], [values], [counts], len(groups))
+        return (groups, values, counts)
+
+    def drop_values(self, name, rows):
+        """
+        Drop rows, a mask of the rows table returns, from the table name.
+        """
+        groups, values, counts = self.table(name)
+        keep = ~rows
+        self.tables[name] = ([groups[keep]], [values[keep]], [counts[keep]], int(keep.sum()))
+
+    def merge(self, other, keys=None):
+        """
+        Merge other's aggregates into these, under keys (by default other's own) for
+        each of other's groups, with None for groups to leave out.
+        """
+        if keys is None:
+            keys = other.keys
+        kept = np.array([key is not None for key in keys], dtype=bool)
+        indexes = np.full(len(keys), -1, dtype=np.int64)
+        indexes[kept] = self.index([key for key in keys if key is not None])
+        for name, (ufunc, empty, array) in other.arrays.items():
+            self.add(name, ufunc, indexes[kept], array[kept], empty)
+        for name in other.tables:
+            groups, values, counts = other.table(name)
+            rows = kept[groups]
+            self.add_values(name, indexes[groups[rows]], values[rows], counts[rows], other.limits.get(name, None))
+        return self
@@ -1,10 +1,229 @@
 import gzip
 import io
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# zstd and lz4 are optional, and only needed to write or read those codecs.
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+GZIP_READ_CHUNK = 1 << 16
+COMPRESS_BLOCK = 1 << 20
+
+CODECS = ('gzip', 'zstd', 'lz4', 'none')
+CODEC_EXTS = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4', 'none': ''}
+# gzip at zlib's own default rather than gzip.open's 9, which is much slower for little gain.
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3, 'lz4': 0, 'none': None}
+CODEC_MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd', b'\x04\x22\x4d\x18': 'lz4'}
+
+
+def _check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f'unknown codec {codec}')
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError('zstd needs the zstandard package')
+    if codec == 'lz4' and lz4 is None:
+        raise ImportError('lz4 needs the lz4 package')
+
+
+def _level(codec, level):
+    if level is None:
+        return DEFAULT_LEVELS[codec]
+    return level
+
+
+def compress(data, codec='gzip', level=None):
+    """
+    Compress data as one self contained gzip member or zstd/lz4 frame. Files made of
+    several of these concatenated are still valid files of the codec.
+    """
+    level = _level(codec, level)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=level)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == 'lz4':
+        return lz4.frame.compress(data, compression_level=level)
+    return bytes(data)
+
+
+def _magic_codec(head):
+    for magic, codec in CODEC_MAGIC.items():
+        if head.startswith(magic):
+            return codec
+    return 'none'
+
+
+def sniff_codec(path):
+    with open(path, 'rb') as f_in:
+        return _magic_codec(f_in.read(4))
+
+
+def _decompressor(codec):
+    if codec == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return lz4.frame.LZ4FrameDecompressor()
+
+
+class BlockCompressor(io.BufferedIOBase):
+    """
+    Binary writer that compresses every block_size bytes as an independent gzip member
+    or zstd/lz4 frame on a pool of threads (the codecs release the GIL), writing them out
+    in order. Compression overlaps with whatever is producing the data, and with more
+    than one thread uses more than one core, at the cost of a slightly bigger file.
+    """
+
+    def __init__(self, f_out, codec='gzip', level=None, threads=1, block_size=COMPRESS_BLOCK):
+        super().__init__()
+        _check_codec(codec)
+        self.f_out = f_out
+        self.codec = codec
+        self.level = level
+        self.block_size = block_size
+        self.block = bytearray()
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # bound the blocks held in memory to a couple per thread.
+        self.max_pending = threads * 2
+        self.pending = deque()
+
+    def writable(self):
+        return True
+
+    def _submit(self, data):
+        self.pending.append(self.executor.submit(compress, data, self.codec, self.level))
+        while len(self.pending) > self.max_pending:
+            self.f_out.write(self.pending.popleft().result())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        self.block.extend(data)
+        while len(self.block) >= self.block_size:
+            self._submit(bytes(self.block[:self.block_size]))
+            del self.block[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.block:
+                self._submit(bytes(self.block))
+                self.block.clear()
+            while self.pending:
+                self.f_out.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            self.f_out.close()
+            super().close()
+
+
+def binary_writer(path, codec='gzip', level=None, threads=0, append=False):
+    """
+    Open path for writing compressed with codec, on threads background threads if any.
+    """
+    _check_codec(codec)
+    mode = 'ab' if append else 'wb'
+    if codec == 'none':
+        return open(path, mode)
+    if threads:
+        return BlockCompressor(open(path, mode), codec, level, threads)
+    level = _level(codec, level)
+    if codec == 'gzip':
+        return gzip.open(path, mode, compresslevel=level)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).stream_writer(open(path, mode), closefd=True)
+    return lz4.frame.open(path, mode, compression_level=level)
+
+
+def binary_reader(path):
+    """
+    Open path for reading, decompressing it with whichever codec it was written with.
+    """
+    codec = sniff_codec(path)
+    _check_codec(codec)
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    if codec == 'lz4':
+        return lz4.frame.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def stream_reader(f_in):
+    """
+    Decompress a binary stream, which needn't be seekable, with whichever codec it was
+    written with.
+    """
+    if not hasattr(f_in, 'peek'):
+        f_in = io.BufferedReader(f_in)
+    codec = _magic_codec(f_in.peek(4)[:4])
+    _check_codec(codec)
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=f_in, mode='rb')
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(f_in, read_across_frames=True, closefd=False)
+    if codec == 'lz4':
+        return lz4.frame.LZ4FrameFile(f_in, mode='rb')
+    return f_in
+
+
+def text_reader(path):
+    return io.TextIOWrapper(binary_reader(path), newline='')  # pytype: disable=wrong-arg-types
+
+
+def text_writer(path, codec='gzip', level=None, threads=0, header=None):
+    append = False
+    if header is not None:
+        # the header gets a gzip member (or frame) of its own, so the rest can be copied without it.
+        with open(path, 'wb') as f_out:
+            f_out.write(compress(header.encode('utf-8'), codec, level))
+        append = True
+    return io.TextIOWrapper(binary_writer(path, codec, level, threads, append), newline='')  # pytype: disable=wrong-arg-types
 
 
 def gzip_reader(gzip_file):
-    return io.TextIOWrapper(gzip.open(gzip_file, 'r'), newline='')  # pytype: disable=wrong-arg-types
+    return text_reader(gzip_file)
+
+
+def gzip_writer(gzip_file, header=None, level=None, threads=0):
+    return text_writer(gzip_file, 'gzip', level, threads, header)
 
 
-def gzip_writer(gzip_file):
-    return io.TextIOWrapper(gzip.open(gzip_file, 'w'), newline='', write_through=True)  # pytype: disable=wrong-arg-types
+def first_frame(path, max_size=1 << 20):
+    """
+    Return the decompressed first gzip member (or zstd/lz4 frame) of path and the offset
+    of the next one, or (None, None) if it's not compressed or the first member decompresses
+    to more than max_size.
+    """
+    codec = sniff_codec(path)
+    if codec == 'none':
+        return (None, None)
+    _check_codec(codec)
+    decompressor = _decompressor(codec)
+    data = b''
+    offset = 0
+    with open(path, 'rb') as f_in:
+        while not decompressor.eof and len(data) <= max_size:
+            chunk = f_in.read(GZIP_READ_CHUNK)
+            if not chunk:
+                break
+            try:
+                data += decompressor.decompress(chunk)
+            except Exception:
+                break
+            offset += len(chunk)
+    if not decompressor.eof:
+        return (None, None)
+    return (data, offset - len(decompressor.unused_data))
@@ -0,0 +1,226 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.pandas_csv_importer import convert_ws_values
+from networkml.helpers.pandas_csv_importer import import_csv
+from networkml.helpers.pandas_csv_importer import import_csv_chunks
+from networkml.helpers.pandas_csv_importer import recast_df
+from networkml.helpers.pandas_csv_importer import WS_FIELDS
+from networkml.helpers.pandas_csv_importer import _ip_array
+from networkml.helpers.pandas_csv_importer import _REQUIRED_WS_FIELDS
+from networkml.helpers.pandas_csv_importer import _WS_IP_FIELDS
+from networkml.helpers.pandas_csv_importer import _WS_FIELDS_NULLABLE_INT
+
+# Typed columnar alternative to gzipped CSV between stages. Each column is stored as one or
+# more arrays in a compressed .npz, described by a JSON header, so no pickling is needed to
+# load it and only the requested columns are decompressed.
+NPZ_META = 'meta'
+UINT64_MASK = (1 << 64) - 1
+
+
+def _column_kind(col):
+    if isinstance(col.dtype, pd.api.extensions.ExtensionDtype):
+        return 'nullable'
+    if col.dtype != np.dtype('O'):
+        return 'numpy'
+    values = col.dropna()
+    if values.map(lambda x: isinstance(x, (int, np.integer)) and not isinstance(x, bool)).all():
+        return 'int'
+    return 'str'
+
+
+def write_npz(df, out_file):
+    meta = {'columns': []}
+    arrays = {}
+    for i, (name, col) in enumerate(df.items()):
+        key = 'c%u' % i
+        kind = _column_kind(col)
+        meta['columns'].append({'name': name, 'key': key, 'kind': kind, 'dtype': str(col.dtype)})
+        mask = col.isna().to_numpy()
+        if kind == 'numpy':
+            arrays[key] = col.to_numpy()
+        elif kind == 'nullable':
+            arrays[key] = col.to_numpy(dtype=col.dtype.numpy_dtype, na_value=0)
+            arrays[key + '_mask'] = mask
+        elif kind == 'int':
+            # IPv6 addresses need more than 64 bits.
+            values = [0 if masked else int(x) for x, masked in zip(col, mask)]
+            arrays[key + '_hi'] = np.array([x >> 64 for x in values], dtype=np.uint64)
+            arrays[key + '_lo'] = np.array([x & UINT64_MASK for x in values], dtype=np.uint64)
+            arrays[key + '_mask'] = mask
+        else:
+            arrays[key] = np.array(['' if masked else str(x) for x, masked in zip(col, mask)], dtype=str)
+            arrays[key + '_mask'] = mask
+    arrays[NPZ_META] = np.array(json.dumps(meta))
+    with open(out_file, 'wb') as f_out:
+        np.savez_compressed(f_out, **arrays)
+
+
+def _read_column(npz, column):
+    key = column['key']
+    kind = column['kind']
+    if kind == 'numpy':
+        return npz[key]
+    mask = npz[key + '_mask']
+    if kind == 'nullable':
+        if column['dtype'].startswith(('Int', 'UInt')):
+            return pd.arrays.IntegerArray(npz[key], mask)
+        return pd.array(np.where(mask, None, npz[key]), dtype=column['dtype'])
+    if kind == 'int':
+        hi = npz[key + '_hi']
+        lo = npz[key + '_lo']
+        if hi.any():
+            values = np.array([(int(h) << 64) | int(l) for h, l in zip(hi, lo)], dtype=object)
+        else:
+            values = lo.astype(object)
+    else:
+        values = npz[key].astype(object)
+    values[mask] = None
+    return values
+
+
+def read_npz(in_file, columns=None):
+    """
+    Read a DataFrame written by write_npz, only loading the given columns if any.
+    """
+    with np.load(in_file, allow_pickle=False) as npz:
+        meta = json.loads(str(npz[NPZ_META]))
+        df_columns = {}
+        for column in meta['columns']:
+            if columns is None or column['name'] in columns:
+                df_columns[column['name']] = _read_column(npz, column)
+    return pd.DataFrame(df_columns)
+
+
+def concat_dfs(dfs):
+    if not dfs:
+        return pd.DataFrame()
+    df = pd.concat(dfs, ignore_index=True)
+    # frames without a column make concat widen its type.
+    for col, typestr in _WS_FIELDS_NULLABLE_INT.items():
+        if col in df.columns:
+            df[col] = df[col].astype(typestr)
+    # and frames with IPv6 addresses make other frames' float IPs objects.
+    for col in _WS_IP_FIELDS.intersection(df.columns):
+        if df[col].dtype == object and df[col].notna().any():
+            df[col] = _ip_array(df[col])
+    return df
+
+
+def import_frame(df):
+    """
+    Import a parser output DataFrame, as import_npz would from a file.
+    """
+    df = df[[col for col in df.columns if col in WS_FIELDS]].copy()
+    for col in set(WS_FIELDS.keys()) - set(df.columns):
+        df[col] = None
+    for col in _REQUIRED_WS_FIELDS:
+        assert df[col].count(
+        ) > 0, 'required col %s is all null (not a PCAP npz?)' % col
+    return recast_df(df)
+
+
+def import_npz(in_file):
+    return import_frame(read_npz(in_file, columns=set(WS_FIELDS.keys())))
+
+
+def import_pcap_df(in_file):
+    """
+    Import parser output in either format as a DataFrame of WS_FIELDS.
+    """
+    if in_file.endswith('.npz'):
+        return import_npz(in_file)
+    return import_csv(in_file)
+
+
+def frame_chunks(df, chunk_rows):
+    """
+    An imported DataFrame chunk_rows rows at a time, each chunk a frame of its own.
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].copy()
+
+
+def import_pcap_chunks(in_file, chunk_rows):
+    """
+    import_pcap_df chunk_rows rows at a time. CSVs are read a chunk at a time, while npz
+    files, having no row groups, are read whole and then split.
+    """
+    if in_file.endswith('.npz'):
+        return frame_chunks(import_npz(in_file), chunk_rows)
+    return import_csv_chunks(in_file, chunk_rows)
+
+
+class NPZRowWriter():
+    """
+    Collect parser rows and write them as a typed .npz on close. WS_FIELDS columns are
+    converted to the types import_csv would give them; any other column is kept as strings.
+    Rows are converted to columns every buffer_rows rows to bound the memory held as dicts.
+    """
+
+    def __init__(self, out_file, buffer_rows=100000):
+        self.out_file = out_file
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.chunks = []
+        self.row_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        keys = {}
+        for row in self.rows:
+            for key in row:
+                if key not in keys and CSVRowWriter.good_key(key):
+                    keys[key] = True
+        columns = {}
+        for key in keys:
+            values = [row.get(key, None) for row in self.rows]
+            if key in WS_FIELDS:
+                columns[key] = convert_ws_values(key, values)
+            else:
+                columns[key] = [None if value is None else str(value) for value in values]
+        self.chunks.append(pd.DataFrame(columns))
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+        self.row_count += 1
+        if len(self.rows) >= self.buffer_rows:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def frame(self):
+        self._flush()
+        df = concat_dfs(self.chunks)
+        self.chunks = []
+        return df
+
+    def close(self):
+        write_npz(self.frame(), self.out_file)
+
+
+class FrameRowWriter(NPZRowWriter):
+    """
+    Collect parser rows as NPZRowWriter does, but keep the DataFrame in frames[key] on close
+    rather than writing it out, for the next stage in the same process.
+    """
+
+    def __init__(self, frames, key, buffer_rows=100000):
+        super().__init__(key, buffer_rows=buffer_rows)
+        self.frames = frames
+
+    def close(self):
+        self.frames[self.out_file] = self.frame()
@@ -6,6 +6,12 @@ import netaddr
 import numpy
 import pandas as pd
 from pandas.errors import DtypeWarning
+
+from networkml.helpers.gzipio import text_reader
+
+# ints up to this are exact as float64.
+_FLOAT_INT_MAX = 2**53
+
 # We are using converters to fix types, so mixed type warning from read_csv() is spurious.
 warnings.simplefilter(action='ignore', category=DtypeWarning)
 
@@ -37,6 +43,22 @@ def _safe_int(val):
     return None
 
 
+def _ip_array(ips, convert=int):
+    """
+    Packed IPs (None for nulls), as float64 if they all fit one exactly, as read_csv
+    would infer them, and otherwise as exact ints in an object array. convert packs
+    each distinct IP once, rather than every row.
+    """
+    codes, uniques = pd.factorize(numpy.asarray(ips, dtype=object))
+    packed = [convert(ip) for ip in uniques]
+    if all(ip is None or ip < _FLOAT_INT_MAX for ip in packed):
+        table = numpy.array([numpy.nan if ip is None else ip for ip in packed] + [numpy.nan], dtype=numpy.float64)
+    else:
+        table = numpy.array(packed + [None], dtype=object)
+    # nulls are code -1, the last entry.
+    return table[codes]
+
+
 def _eth_protos(val):
     return ':'.join([i for i in val.split(':') if i != 'ethertype'])
 
@@ -81,11 +103,30 @@ _WS_FIELDS_NULLABLE_INT = {
 _WS_NON_INT_CONVERTERS = {
     field: converter for field, converter in _WS_FIELDS_CONVERTERS.items()
     if field not in _WS_FIELDS_NULLABLE_INT}
+_WS_IP_FIELDS = {
+    field for field, converter in _WS_FIELDS_CONVERTERS.items() if converter == _ipaddress_packed}
 _REQUIRED_WS_FIELDS = {
     'eth.src', 'eth.dst', 'frame.len',
     'frame.time_epoch', 'frame.time_delta_displayed'}
 
 
+def convert_ws_value(field, val):
+    # Convert a raw parser value of a WS field to what import_csv would read back from a CSV.
+    if val is None or val == '':
+        return None
+    return _WS_FIELDS_CONVERTERS[field](str(val))
+
+
+def convert_ws_values(field, values):
+    int_bits = WS_FIELDS[field][1]
+    values = [convert_ws_value(field, val) for val in values]
+    if field in _WS_IP_FIELDS:
+        return _ip_array(values)
+    if isinstance(int_bits, int):
+        return pd.array(values, dtype='UInt%u' % int_bits)
+    return values
+
+
 def recast_df(df):
     # TODO: when pandas allows read_csv to infer nullable ints, we can use less memory on import.
     # https://github.com/pandas-dev/pandas/issues/2631
@@ -99,9 +140,11 @@ def recast_df(df):
     return df
 
 
-def import_csv(in_file):
+def _csv_columns(in_file):
     # We need converters, so we can't use dtypes parameter, and that results in an un-suppressable warning.
-    sample_df = pd.read_csv(in_file, index_col=0, nrows=100)
+    # read through gzipio, so whichever codec the parser wrote with is decompressed.
+    with text_reader(in_file) as f_in:
+        sample_df = pd.read_csv(f_in, nrows=100)
     csv_fields = set(sample_df.columns.tolist())
     usecols = csv_fields.intersection(WS_FIELDS.keys())
     missingcols = set(WS_FIELDS.keys()) - csv_fields
@@ -114,9 +157,24 @@ def import_csv(in_file):
     # If yes, this is an old style PCAP CSV which needs conversion.
     if obj_int_fields:
         converters = _WS_FIELDS_CONVERTERS
+    # IPs are read as strings and converted by _ip_array, as read_csv infers packed
+    # IPv6 addresses as floats, merging distinct ones, if a column starts with a null.
+    converters = {field: str if field in _WS_IP_FIELDS else converter for field, converter in converters.items()}
+    return (usecols, missingcols, converters)
+
+
+def _convert_ips(df, usecols):
+    for col in _WS_IP_FIELDS.intersection(usecols):
+        df[col] = _ip_array(df[col].to_numpy(), _ipaddress_packed)
+
 
-    df = pd.read_csv(in_file, usecols=usecols, converters=converters)
+def import_csv(in_file):
+    usecols, missingcols, converters = _csv_columns(in_file)
+
+    with text_reader(in_file) as f_in:
+        df = pd.read_csv(f_in, usecols=usecols, converters=converters)
 
+    _convert_ips(df, usecols)
     for col in missingcols:
         df[col] = None
     for col in _REQUIRED_WS_FIELDS:
@@ -124,3 +182,23 @@ def import_csv(in_file):
         ) > 0, 'required col %s is all null (not a PCAP CSV?)' % col
     df = recast_df(df)
     return df
+
+
+def import_csv_chunks(in_file, chunk_rows):
+    """
+    import_csv chunk_rows rows at a time, as a generator of DataFrames.
+    """
+    usecols, missingcols, converters = _csv_columns(in_file)
+    required_counts = {col: 0 for col in _REQUIRED_WS_FIELDS}
+
+    with text_reader(in_file) as f_in:
+        for df in pd.read_csv(f_in, usecols=usecols, converters=converters, chunksize=chunk_rows):
+            for col in missingcols:
+                df[col] = None
+            _convert_ips(df, usecols)
+            for col in _REQUIRED_WS_FIELDS:
+                required_counts[col] += df[col].count()
+            yield recast_df(df)
+
+    for col, count in required_counts.items():
+        assert count > 0, 'required col %s is all null (not a PCAP CSV?)' % col
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+HASH_CHUNK = 1 << 20
+
+
+class ParseCache():
+    """
+    Content addressed store of parser output files. Entries are keyed by a hash of the
+    input file's content and of whatever else determines the output (engine, level,
+    format, parser version), so a renamed or copied capture still hits. Entries are
+    touched when used, and the least recently used are removed once the cache is bigger
+    than max_bytes (0 for no limit). Several processes can share one cache directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # digests by path, size and mtime, so an archive of several captures is read once.
+        self.digests = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, in_file, *params):
+        stat = os.stat(in_file)
+        file_key = (in_file, stat.st_size, stat.st_mtime_ns)
+        if file_key not in self.digests:
+            self.digests[file_key] = self.file_digest(in_file)
+        digest = hashlib.sha256(self.digests[file_key].encode())
+        for param in params:
+            digest.update(b'\0' + str(param).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, out_file):
+        """
+        Copy the entry for key to out_file, returning True if there was one.
+        """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, out_file)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key, out_file):
+        # copy under a temporary name first, so readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(out_file, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
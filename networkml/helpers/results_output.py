@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 import re
@@ -15,13 +16,17 @@ class ResultsOutput:
         self.file_path = file_path
 
     @staticmethod
-    def assign_labels(labels):
+    @functools.lru_cache(maxsize=None)
+    def label_assignments():
         netml_path = list(networkml.__path__)
         la = os.path.join(netml_path[0],
                           'trained_models/label_assignments.json')
-        assignment_map = {}
         with open(la) as f:
-            assignment_map = json.load(f)
+            return json.load(f)
+
+    @staticmethod
+    def assign_labels(labels):
+        assignment_map = ResultsOutput.label_assignments()
         labels = [assignment_map[label] if label in assignment_map else label for label in labels]
         return labels
 
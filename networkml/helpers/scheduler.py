@@ -0,0 +1,199 @@
+import argparse
+import concurrent.futures
+import os
+import time
+from collections import defaultdict
+from collections import deque
+
+# rough peak memory of a worker, used to size --threads auto.
+MIN_WORKER_BYTES = 512 * 2**20
+
+
+def threads_arg(val):
+    """
+    argparse type for --threads, a number of workers or auto.
+    """
+    if val == 'auto':
+        return val
+    try:
+        return int(val)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{val} is not a number of threads or auto')
+
+
+def stage_threads_arg(val):
+    """
+    argparse type for comma separated stage:threads limits, e.g. parser:3,algorithm:1.
+    """
+    limits = {}
+    for limit in val.split(','):
+        try:
+            stage, threads = limit.split(':')
+            limits[stage] = int(threads)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'{limit} is not a stage:threads limit')
+        if limits[stage] < 1:
+            raise argparse.ArgumentTypeError(f'{limit} needs at least 1 thread')
+    return limits
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f_in:
+            for line in f_in:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:  # pragma: no cover
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):  # pragma: no cover
+        return None
+
+
+def auto_threads(worker_bytes=MIN_WORKER_BYTES, tasks=None):
+    """
+    As many workers as there are CPUs, and memory for worker_bytes each, but no more than tasks.
+    """
+    threads = cpu_count()
+    memory = available_memory()
+    if memory is not None:
+        threads = min(threads, memory // max(worker_bytes, MIN_WORKER_BYTES))
+    if tasks is not None:
+        threads = min(threads, tasks)
+    return max(int(threads), 1)
+
+
+def file_size(path):
+    # a missing file is the worker's error to report.
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def largest_first(paths):
+    """
+    Indexes of paths ordered by decreasing file size, so the biggest jobs don't start last.
+    """
+    return sorted(range(len(paths)), key=lambda i: file_size(paths[i]), reverse=True)
+
+
+def timed_call(func, *args):
+    """
+    Run func in a worker, returning its result along with the worker's pid and busy time.
+    """
+    start_time = time.time()
+    result = func(*args)
+    return (result, os.getpid(), start_time, time.time())
+
+
+class WorkerStats():
+    """
+    Busy time of each pool worker from timed_call results, to report utilization.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.busy = defaultdict(float)
+        self.tasks = defaultdict(int)
+
+    def add(self, pid, start_time, end_time):
+        self.busy[pid] += end_time - start_time
+        self.tasks[pid] += 1
+
+    def report(self, logger, threads):
+        wall_time = max(time.time() - self.start_time, 1e-6)
+        for i, pid in enumerate(sorted(self.busy), start=1):
+            logger.info(
+                f'Worker {i} (pid {pid}): {self.tasks[pid]} tasks, {self.busy[pid]:.1f}s busy, {self.busy[pid] / wall_time:.0%} utilization')
+        logger.info(
+            f'{threads} workers were {sum(self.busy.values()) / (wall_time * threads):.0%} utilized over {wall_time:.1f}s')
+
+
+class StageError(Exception):
+    """
+    An item's failure in a StagePipeline stage: the stage's name, and what it raised.
+    """
+
+    def __init__(self, stage, err):
+        super().__init__(stage, err)
+        self.stage = stage
+        self.err = err
+
+    def __str__(self):
+        return f'{self.stage} stage failed: {self.err}'
+
+
+class StagePipeline():
+    """
+    Run each item through a sequence of stages on one pool, starting an item's next stage
+    as soon as its previous one is done, rather than running every item through a stage
+    before starting the next. Later stages are scheduled first, so items finish as early
+    as they can, and limits caps the workers a stage can use at once. Without an executor,
+    items run through all their stages in turn in this process.
+    """
+
+    def __init__(self, stages, executor=None, workers=1, limits=None):
+        # stages are (name, func) pairs, and func(item, previous_result) is run for each item.
+        self.stages = stages
+        self.executor = executor
+        self.workers = workers
+        self.limits = limits or {}
+        self.stats = WorkerStats()
+
+    def _limit(self, stage):
+        return max(min(self.limits.get(self.stages[stage][0], self.workers), self.workers), 1)
+
+    def run(self, items):
+        """
+        Yield (item, result, error) as each item finishes its final stage, or fails in one,
+        when error is a StageError.
+        """
+        if self.executor is None:
+            for item in items:
+                result = item
+                try:
+                    for name, func in self.stages:
+                        result, pid, start_time, end_time = timed_call(func, item, result)
+                        self.stats.add(pid, start_time, end_time)
+                except Exception as err:
+                    yield (item, None, StageError(name, err))
+                else:
+                    yield (item, result, None)
+            return
+        ready = [deque() for _ in self.stages]
+        ready[0].extend((item, item) for item in items)
+        busy = [0 for _ in self.stages]
+        running = {}
+        while running or any(ready):
+            while len(running) < self.workers:
+                stage = next((stage for stage in reversed(range(len(self.stages)))
+                              if ready[stage] and busy[stage] < self._limit(stage)), None)
+                if stage is None:
+                    break
+                item, result = ready[stage].popleft()
+                future = self.executor.submit(timed_call, self.stages[stage][1], item, result)
+                running[future] = (stage, item)
+                busy[stage] += 1
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                stage, item = running.pop(future)
+                busy[stage] -= 1
+                try:
+                    result, pid, start_time, end_time = future.result()
+                except Exception as err:
+                    yield (item, None, StageError(self.stages[stage][0], err))
+                    continue
+                self.stats.add(pid, start_time, end_time)
+                if stage + 1 < len(self.stages):
+                    ready[stage + 1].append((item, result))
+                else:
+                    yield (item, result, None)
@@ -0,0 +1,122 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def _bit_lengths(vals):
+    # int.bit_length() of each of an array of uint64s, exactly.
+    lengths = np.zeros(len(vals), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = vals >= np.uint64(1 << shift)
+        lengths[big] += shift
+        vals = np.where(big, vals >> np.uint64(shift), vals)
+    return lengths + (vals > 0)
+
+
+class QuantileSketch():
+    """
+    Quantiles to within a relative error, as DDSketch makes them: values are counted in
+    buckets of logarithmically growing width, so a group needs a count for each bucket its
+    values fall in however many values it has, and sketches merge by adding counts. Each
+    bucket's value is within relative_error of any value in it, and ranks are exact, so
+    quantiles of bucket values are within relative_error of the values' own.
+    """
+
+    # values smaller than this are counted as 0.
+    MIN_VALUE = 1e-9
+    # added to bucket indexes, so 0 is the bucket of 0 and negative values' buckets are negative.
+    OFFSET = 1 << 32
+
+    def __init__(self, relative_error=0.01):
+        if not 0 < relative_error < 1:
+            raise ValueError(f'relative error {relative_error} is not between 0 and 1')
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = np.log(self.gamma)
+
+    def buckets(self, values):
+        """
+        The bucket of each of values, in the same order as the values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        magnitudes = np.abs(values)
+        nonzero = magnitudes >= self.MIN_VALUE
+        buckets = np.zeros(len(values), dtype=np.int64)
+        buckets[nonzero] = np.ceil(np.log(magnitudes[nonzero]) / self.log_gamma).astype(np.int64) + self.OFFSET
+        return np.where(values < 0, -buckets, buckets)
+
+    def bucket(self, value):
+        """
+        The bucket of a single value, as buckets gives it, without making an array of it.
+        """
+        magnitude = abs(value)
+        if magnitude < self.MIN_VALUE:
+            return 0
+        bucket = math.ceil(math.log(magnitude) / self.log_gamma) + self.OFFSET
+        return -bucket if value < 0 else bucket
+
+    def values(self, buckets):
+        """
+        The value of each of buckets, the one closest in relative terms to all of its values.
+        """
+        buckets = np.asarray(buckets, dtype=np.int64)
+        nonzero = buckets != 0
+        values = np.zeros(len(buckets), dtype=np.float64)
+        values[nonzero] = 2 * self.gamma ** (np.abs(buckets[nonzero]) - self.OFFSET) / (self.gamma + 1)
+        return np.where(buckets < 0, -values, values)
+
+
+class DistinctSketch():
+    """
+    Distinct counts to within a standard error, as HyperLogLog makes them: each value is
+    hashed, and a group's registers keep the most leading zeros of the hashes of its values
+    that index them, so a group needs 2**precision small registers however many values it
+    has, and sketches merge by taking the larger of each register.
+    """
+
+    MIN_PRECISION = 4
+    MAX_PRECISION = 16
+
+    def __init__(self, error=0.03):
+        if not 0 < error < 1:
+            raise ValueError(f'standard error {error} is not between 0 and 1')
+        # the fewest registers with the standard error asked for, 1.04 / sqrt(registers).
+        self.precision = int(np.clip(np.ceil(2 * np.log2(1.04 / error)), self.MIN_PRECISION, self.MAX_PRECISION))
+        self.registers = 1 << self.precision
+        self.error = 1.04 / np.sqrt(self.registers)
+
+    @staticmethod
+    def hashes(values):
+        # 64 bit hashes, which are the same in every process.
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        return pd.util.hash_array(np.asarray(uniques, dtype=object))[codes]
+
+    def group_registers(self, groups, values, n_groups):
+        """
+        The registers of each of n_groups groups, as a groups by registers matrix, from the
+        values of rows of the groups.
+        """
+        hashes = self.hashes(values)
+        value_bits = 64 - self.precision
+        indexes = (hashes >> np.uint64(value_bits)).astype(np.int64)
+        ranks = np.minimum(64 - _bit_lengths(hashes << np.uint64(self.precision)), value_bits) + 1
+        keys = np.asarray(groups, dtype=np.int64) * self.registers + indexes
+        order = np.lexsort((ranks, keys))
+        keys = keys[order]
+        last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+        registers = np.zeros(n_groups * self.registers, dtype=np.uint8)
+        registers[keys[last]] = ranks[order][last]
+        return registers.reshape(n_groups, self.registers)
+
+    def estimates(self, registers):
+        """
+        The distinct count estimate of each row of registers.
+        """
+        registers = np.asarray(registers).reshape(-1, self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(self.registers, 0.7213 / (1 + 1.079 / self.registers))
+        raw = alpha * self.registers ** 2 / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+        zeros = np.sum(registers == 0, axis=1)
+        # linear counting, which is better while many registers are still 0.
+        linear = self.registers * np.log(self.registers / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * self.registers) & (zeros > 0), linear, raw)
@@ -0,0 +1,62 @@
+import tarfile
+
+from networkml.helpers.gzipio import binary_reader
+from networkml.helpers.gzipio import CODEC_EXTS
+from networkml.helpers.gzipio import sniff_codec
+from networkml.helpers.gzipio import stream_reader
+
+CAPTURE_EXTS = ('pcap', 'pcapng', 'dump', 'capture')
+COMPRESSED_EXTS = tuple(ext for ext in CODEC_EXTS.values() if ext)
+TAR_EXTS = ('.tar', '.tgz', '.tbz2', '.txz') + tuple(
+    '.tar' + ext for ext in COMPRESSED_EXTS + ('.bz2', '.xz'))
+
+
+def capture_name(name):
+    """
+    name without any compression extension, so x.pcap.gz is parsed into x.pcap.csv.gz.
+    """
+    for ext in COMPRESSED_EXTS:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def is_capture(name):
+    name = capture_name(name)
+    return any(name.endswith('.' + ext) for ext in CAPTURE_EXTS)
+
+
+def is_tar(name):
+    return name.endswith(TAR_EXTS)
+
+
+def is_compressed(path):
+    # a missing file is for the parser engine to report.
+    try:
+        return sniff_codec(path) != 'none'
+    except OSError:
+        return False
+
+
+def tar_captures(path):
+    """
+    Yield (member name, stream) for each capture in a tar archive, reading the archive
+    (and decompressing it, and any compressed member) as a stream, so nothing is extracted.
+    Each stream is only valid until the next one is yielded.
+    """
+    if sniff_codec(path) == 'none':
+        # tarfile decompresses gzip, bzip2 and xz itself, or it's not compressed.
+        tar_file = tarfile.open(path, mode='r|*')
+        f_in = None
+    else:
+        f_in = binary_reader(path)
+        tar_file = tarfile.open(fileobj=f_in, mode='r|')
+    try:
+        for member in tar_file:
+            if member.isfile() and is_capture(member.name):
+                with stream_reader(tar_file.extractfile(member)) as f_member:
+                    yield (member.name, f_member)
+    finally:
+        tar_file.close()
+        if f_in is not None:
+            f_in.close()
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+
+from networkml.parsers.native import decode_ethernet
+from networkml.parsers.native import format_ns
+from networkml.parsers.native import LINKTYPE_ETHERNET
+from networkml.parsers.native import NS_PER_SEC
+
+FLOW_TIMEOUT = 300
+MAX_FLOWS = 100000
+FLOW_PROTOS = ('tcp', 'udp')
+
+
+class Flow():
+
+    __slots__ = ('proto', 'src', 'src_port', 'dst', 'dst_port', 'first_ts', 'last_ts',
+                 'frames_to_src', 'bytes_to_src', 'frames_to_dst', 'bytes_to_dst')
+
+    def __init__(self, proto, src, src_port, dst, dst_port, ts):
+        # like tshark, the source is whichever end sent the first packet.
+        self.proto = proto
+        self.src = src
+        self.src_port = src_port
+        self.dst = dst
+        self.dst_port = dst_port
+        self.first_ts = ts
+        self.last_ts = ts
+        self.frames_to_src = 0
+        self.bytes_to_src = 0
+        self.frames_to_dst = 0
+        self.bytes_to_dst = 0
+
+
+class FlowTable():
+    """
+    Bidirectional TCP/UDP flows keyed by 5-tuple, with running totals in the terms of
+    tshark's conv,tcp and conv,udp statistics. A flow is closed when it has been idle
+    for timeout seconds, or when it is the least recently seen of more than max_flows
+    live flows, so memory is bounded and closed flows can be written out straight away.
+    Either limit is disabled with 0.
+    """
+
+    def __init__(self, timeout=FLOW_TIMEOUT, max_flows=MAX_FLOWS):
+        self.timeout_ns = int(timeout * NS_PER_SEC)
+        self.max_flows = max_flows
+        # least recently seen first.
+        self.flows = OrderedDict()
+        self.start_ts = None
+        self.idle_closed = 0
+        self.cap_closed = 0
+
+    @staticmethod
+    def _endpoints(row):
+        for proto in FLOW_PROTOS:
+            src_port = row.get('%s.srcport' % proto, None)
+            if src_port is not None:
+                for ip in ('ip', 'ipv6'):
+                    src = row.get('%s.src' % ip, None)
+                    if src is not None:
+                        return (proto, src, src_port, row['%s.dst' % ip], row['%s.dstport' % proto])
+        return None
+
+    def flow_row(self, flow):
+        return {
+            'Source': flow.src,
+            'Source Port': flow.src_port,
+            'Destination': flow.dst,
+            'Destination Port': flow.dst_port,
+            'Transport Protocol': flow.proto.upper(),
+            'Frames to Source': flow.frames_to_src,
+            'Bytes to Source': flow.bytes_to_src,
+            'Frames to Destination': flow.frames_to_dst,
+            'Bytes to Destination': flow.bytes_to_dst,
+            'Total Frames': flow.frames_to_src + flow.frames_to_dst,
+            'Total Bytes': flow.bytes_to_src + flow.bytes_to_dst,
+            'Relative Start': format_ns(flow.first_ts - self.start_ts),
+            'Duration': '%.4f' % ((flow.last_ts - flow.first_ts) / NS_PER_SEC),
+        }
+
+    def add(self, ts, wirelen, row):
+        """
+        Account for one decoded packet, returning the rows of any flows it closed.
+        """
+        if self.start_ts is None:
+            self.start_ts = ts
+        closed = []
+        while self.timeout_ns and self.flows:
+            flow = next(iter(self.flows.values()))
+            if ts - flow.last_ts <= self.timeout_ns:
+                break
+            self.flows.popitem(last=False)
+            self.idle_closed += 1
+            closed.append(self.flow_row(flow))
+        endpoints = self._endpoints(row)
+        if endpoints is None:
+            return closed
+        proto, src, src_port, dst, dst_port = endpoints
+        key = (proto,) + tuple(sorted(((src, src_port), (dst, dst_port))))
+        flow = self.flows.get(key, None)
+        if flow is None:
+            flow = Flow(proto, src, src_port, dst, dst_port, ts)
+            self.flows[key] = flow
+            if self.max_flows and len(self.flows) > self.max_flows:
+                _, evicted = self.flows.popitem(last=False)
+                self.cap_closed += 1
+                closed.append(self.flow_row(evicted))
+        else:
+            self.flows.move_to_end(key)
+        flow.last_ts = ts
+        if src == flow.src and src_port == flow.src_port:
+            flow.frames_to_dst += 1
+            flow.bytes_to_dst += wirelen
+        else:
+            flow.frames_to_src += 1
+            flow.bytes_to_src += wirelen
+        return closed
+
+    def close_all(self):
+        closed = [self.flow_row(flow) for flow in self.flows.values()]
+        self.flows.clear()
+        return closed
+
+
+def flow_rows(records, table):
+    """
+    Turn (timestamp, original length, link type, bytes) records into flow level rows
+    with a FlowTable, yielding each flow as it closes.
+    """
+    for ts, wirelen, linktype, data in records:
+        row = {}
+        if linktype == LINKTYPE_ETHERNET:
+            row = decode_ethernet(data)
+        yield from table.add(ts, wirelen, row)
+    yield from table.close_all()
@@ -0,0 +1,235 @@
+import math
+from collections import Counter
+
+from networkml.featurizers.funcs.host import Host
+from networkml.featurizers.funcs.host import TCP_UDP_PROTOS
+from networkml.featurizers.funcs.host import WK_IP_PROTOS_INDEX
+from networkml.helpers.pandas_csv_importer import convert_ws_value
+from networkml.helpers.pandas_csv_importer import WS_FIELDS
+from networkml.helpers.sketches import QuantileSketch
+
+
+class ColumnStats():
+    """
+    Running count, sum, min, max, mean and variance (Welford) of a column, for the
+    HostBase.CALC_COL_FUNCS statistics. Quantiles are from counts per QuantileSketch
+    bucket, as the featurizer's --sketch makes them, so they cost memory per bucket the
+    values fall in. Without a sketch they are exact, from counts per value, which costs
+    memory per distinct value: as much as per packet for a column like time_delta.
+    """
+
+    def __init__(self, sketch=None):
+        self.sketch = sketch
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.values = Counter()
+
+    def add(self, val):
+        if val is None:
+            return
+        self.count += 1
+        self.total += val
+        delta = val - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (val - self.mean)
+        if self.min is None or val < self.min:
+            self.min = val
+        if self.max is None or val > self.max:
+            self.max = val
+        if self.sketch is not None:
+            self.values[self.sketch.bucket(val)] += 1
+        else:
+            self.values[val] += 1
+
+    def quantiles(self, qs):
+        # linear interpolation between the closest ranks, as pandas does.
+        positions = [q * (self.count - 1) for q in qs]
+        ranks = sorted({rank for pos in positions for rank in (math.floor(pos), math.ceil(pos))})
+        ranked = {}
+        seen = 0
+        for val, count in sorted(self.values.items()):
+            seen += count
+            if self.sketch is not None:
+                val = self.sketch.values([val])[0]
+            while ranks and ranks[0] < seen:
+                ranked[ranks.pop(0)] = val
+            if not ranks:
+                break
+        results = []
+        for pos in positions:
+            lower = ranked[math.floor(pos)]
+            upper = ranked[math.ceil(pos)]
+            results.append(lower + (upper - lower) * (pos - math.floor(pos)))
+        return results
+
+    def calcs(self):
+        if not self.count:
+            return {'max': 0, 'min': 0, 'count': 0, 'total': 0, 'average': 0,
+                    'median': 0, 'variance': 0, '25q': 0, '75q': 0}
+        median, q25, q75 = self.quantiles((0.5, 0.25, 0.75))
+        variance = 0
+        if self.count > 1:
+            variance = self.m2 / (self.count - 1)
+        return {
+            'max': self.max,
+            'min': self.min,
+            'count': self.count,
+            'total': self.total,
+            'average': self.total / self.count,
+            'median': median,
+            'variance': variance,
+            '25q': q25,
+            '75q': q75,
+        }
+
+
+class DirectionState():
+
+    def __init__(self, quantiles=None):
+        self.stats = {col_name: ColumnStats(quantiles) for col_name, _ in Host.CALC_COL_NAMES}
+        self.flags = {col_name: 0 for col_name, _ in Host.FLAG_DECODE_MAPS}
+        self.lowest_ports = {ip_proto: set() for ip_proto in TCP_UDP_PROTOS.values()}
+
+
+class MACState():
+
+    def __init__(self, quantiles=None):
+        self.directions = {'out': DirectionState(quantiles), 'in': DirectionState(quantiles)}
+        self.ip_versions = set()
+        self.eth_types = set()
+        self.both_private_ip = 0
+        self.ipv4_multicast = 0
+        self.protos_int = 0
+        self.tagged_vlan = 0
+        self.frame_epoch = None
+        self.src_ports = {ip_proto: Counter() for ip_proto in TCP_UDP_PROTOS.values()}
+        self.dst_ports = {ip_proto: Counter() for ip_proto in TCP_UDP_PROTOS.values()}
+        self.srcips = set()
+        self.dstips = set()
+
+
+class HostAggregator(Host):
+    """
+    Single pass equivalent of the host featurizer group. Packet rows from any parser engine
+    are folded into running aggregates per unicast MAC as they arrive, and host_rows()
+    returns the rows Host.host_tshark_all would for the same packets, with quantiles to
+    within quantile_error relative error, or exact if it is None. It has the
+    writerow()/writerows() interface of the parser's row writers, so it can stand in for one.
+    """
+
+    def __init__(self, quantile_error=0.01):
+        super().__init__()
+        self.quantiles = None
+        if quantile_error is not None:
+            self.quantiles = QuantileSketch(quantile_error)
+        self.macs = {}
+        self.non_unicast_macs = set()
+        self.packets = 0
+
+    def _mac_state(self, mac):
+        state = self.macs.get(mac, None)
+        if state is None and mac not in self.non_unicast_macs:
+            if self._is_unicast(mac):
+                state = MACState(self.quantiles)
+                self.macs[mac] = state
+            else:
+                self.non_unicast_macs.add(mac)
+        return state
+
+    def writerow(self, raw_row):
+        row = {field: convert_ws_value(field, raw_row.get(field, None)) for field in WS_FIELDS}
+        eth_src = row['eth.src']
+        eth_dst = row['eth.dst']
+        if eth_src is None or eth_dst is None:
+            return
+        self.packets += 1
+        _, ip_src, ip_dst, both_private_ip, ipv4_multicast, protos_int = self._host_key(row)
+        ip_proto = TCP_UDP_PROTOS.get(row['ip.proto'], None)
+        src_port = dst_port = None
+        if ip_proto:
+            src_port = row['%s.srcport' % ip_proto]
+            dst_port = row['%s.dstport' % ip_proto]
+        for mac in {eth_src, eth_dst}:
+            state = self._mac_state(mac)
+            if state is None:
+                continue
+            direction = state.directions['out' if mac == eth_src else 'in']
+            for col_name, stats in direction.stats.items():
+                stats.add(row[col_name])
+            for col_name in direction.flags:
+                if row[col_name] is not None:
+                    direction.flags[col_name] |= row[col_name]
+            if ip_proto:
+                if src_port is not None and dst_port is not None:
+                    direction.lowest_ports[ip_proto].add(min(src_port, dst_port))
+                if src_port is not None:
+                    state.src_ports[ip_proto][src_port] += 1
+                if dst_port is not None:
+                    state.dst_ports[ip_proto][dst_port] += 1
+            if row['ip.version'] is not None:
+                state.ip_versions.add(row['ip.version'])
+            if row['eth.type'] is not None:
+                state.eth_types.add(row['eth.type'])
+            state.both_private_ip |= both_private_ip
+            state.ipv4_multicast |= ipv4_multicast
+            state.protos_int |= protos_int
+            if row['vlan.id'] is not None:
+                state.tagged_vlan = 1
+            if row['frame.time_epoch'] is not None:
+                if state.frame_epoch is None or row['frame.time_epoch'] > state.frame_epoch:
+                    state.frame_epoch = row['frame.time_epoch']
+            if mac == eth_src:
+                state.srcips.add(ip_src)
+                state.dstips.add(ip_dst)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _mac_row(self, mac, state):
+        mac_row = {'host_key': str(self._mac(mac))}
+        for suffix, direction in state.directions.items():
+            for col_name, field_name in self.CALC_COL_NAMES:
+                calcs = direction.stats[col_name].calcs()
+                for calc_name, _ in self.CALC_COL_FUNCS:
+                    mac_row['tshark_%s_%s_%s' % (calc_name, field_name, suffix)] = calcs[calc_name]
+            for col_name, decode_map in self.FLAG_DECODE_MAPS:
+                mac_row.update(self._decode_flags(
+                    {direction.flags[col_name]}, col_name, decode_map, suffix=suffix))
+            for ip_proto in TCP_UDP_PROTOS.values():
+                mac_row.update(self._port_flags(ip_proto, direction.lowest_ports[ip_proto], suffix))
+        mac_row.update(self._ipversion_flags(state.ip_versions))
+        mac_row.update(self._non_ip_flags(state.eth_types))
+        mac_row.update({
+            'tshark_both_private_ip': state.both_private_ip,
+            'tshark_ipv4_multicast': state.ipv4_multicast,
+        })
+        mac_row.update(self._decode_flags(
+            {state.protos_int}, '_protos_int', WK_IP_PROTOS_INDEX, field_name='wk_ip_protocol'))
+        mac_row.update({
+            'tshark_tagged_vlan': state.tagged_vlan,
+            'tshark_frame_epoch': float(state.frame_epoch),
+        })
+        for ip_proto in TCP_UDP_PROTOS.values():
+            mac_row.update(self._port_ratios(
+                ip_proto, state.src_ports[ip_proto], state.dst_ports[ip_proto]))
+        mac_row.update({
+            'tshark_srcips': list(state.srcips - {'None'}),
+            'tshark_unique_srcips': len(state.srcips),
+            'tshark_unique_dstips': len(state.dstips),
+        })
+        return mac_row
+
+    def host_rows(self, srcmacid=False):
+        macs = sorted(self.macs)
+        if srcmacid:
+            # same choice as the featurizer: the source MAC with the fewest source IPs.
+            src_macs = [mac for mac in macs if self.macs[mac].srcips]
+            macs = []
+            if src_macs:
+                macs = [min(src_macs, key=lambda mac: len(self.macs[mac].srcips))]
+        return [self._mac_row(mac, self.macs[mac]) for mac in macs]
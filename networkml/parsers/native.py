@@ -0,0 +1,412 @@
+import mmap
+import os
+import socket
+import struct
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IDB = 1
+PCAPNG_OPB = 2
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_OPT_IF_TSRESOL = 9
+LINKTYPE_ETHERNET = 1
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_IPV6 = 0x86dd
+ETH_TYPE_VLANS = frozenset((0x8100, 0x88a8, 0x9100))
+
+IP_PROTO_ICMP = 1
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+IP_PROTO_GRE = 47
+IP_PROTO_ESP = 50
+IP_PROTO_AH = 51
+IP_PROTO_ICMPV6 = 58
+# IPv6 extension headers we walk over, with the name tshark gives them in frame.protocols.
+IPV6_EXT_HEADERS = {
+    0: 'ipv6.hopopts',
+    43: 'ipv6.routing',
+    44: 'ipv6.fraghdr',
+    60: 'ipv6.dstopts',
+}
+IP_PROTO_NAMES = {
+    IP_PROTO_ICMP: 'icmp',
+    IP_PROTO_TCP: 'tcp',
+    IP_PROTO_UDP: 'udp',
+    IP_PROTO_GRE: 'gre',
+    IP_PROTO_ESP: 'esp',
+    IP_PROTO_AH: 'ah',
+    IP_PROTO_ICMPV6: 'icmpv6',
+}
+
+NS_PER_SEC = 10**9
+READ_CHUNK = 1 << 20
+
+_U16 = struct.Struct('!H')
+_ETH = struct.Struct('!6s6sH')
+_VLAN = struct.Struct('!HH')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_IPV6 = struct.Struct('!IHBB16s16s')
+_PORTS = struct.Struct('!HH')
+_TCP_FLAGS = struct.Struct('!H')
+
+
+class PcapReader():
+    """
+    Iterate over the packet records of a pcap or pcapng capture without an external process.
+    Each record is a tuple of (timestamp in nanoseconds, original length, link type, captured bytes).
+    Regular files are memory-mapped, anything else is read as a stream.
+    """
+
+    def __init__(self, in_file):
+        self.in_file = in_file
+        self.pcapng = False
+        self.endian = '<'
+        self.linktype = LINKTYPE_ETHERNET
+        self.ts_scale = (1000, 1)
+        self.interfaces = []
+        self.offset = 0
+        self.packets = 0
+
+    def _parse_header(self, buf):
+        if len(buf) < 4:
+            return False
+        magic = struct.unpack_from('<I', buf, 0)[0]
+        if magic == PCAPNG_SHB:
+            self.pcapng = True
+            # section header block is parsed along with every other block.
+            self.offset = 0
+            return True
+        if len(buf) < 24:
+            return False
+        for endian in ('<', '>'):
+            magic = struct.unpack_from(endian + 'I', buf, 0)[0]
+            if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                self.endian = endian
+                if magic == PCAP_MAGIC_USEC:
+                    self.ts_scale = (1000, 1)
+                else:
+                    self.ts_scale = (1, 1)
+                self.linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0xffff
+                self.offset = 24
+                return True
+        raise ValueError(f'{self.in_file} is not a pcap or pcapng file')
+
+    @staticmethod
+    def _tsresol_scale(tsresol):
+        # (multiplier, divisor) that turns a timestamp in interface units into nanoseconds.
+        if tsresol & 0x80:
+            return (NS_PER_SEC, 2**(tsresol & 0x7f))
+        if tsresol <= 9:
+            return (10**(9 - tsresol), 1)
+        return (1, 10**(tsresol - 9))
+
+    def _pcapng_idb(self, buf, offset, block_len):
+        linktype = struct.unpack_from(self.endian + 'H', buf, offset + 8)[0]
+        ts_scale = (1000, 1)
+        opt_offset = offset + 16
+        opt_end = offset + block_len - 4
+        while opt_offset + 4 <= opt_end:
+            opt_code, opt_len = struct.unpack_from(self.endian + 'HH', buf, opt_offset)
+            if opt_code == 0:
+                break
+            if opt_code == PCAPNG_OPT_IF_TSRESOL and opt_len >= 1:
+                ts_scale = self._tsresol_scale(buf[opt_offset + 4])
+            opt_offset += 4 + ((opt_len + 3) & ~3)
+        self.interfaces.append((linktype, ts_scale))
+
+    def _pcapng_records(self, buf, end, data):
+        while self.offset + 12 <= end:
+            offset = self.offset
+            block_type = struct.unpack_from(self.endian + 'I', buf, offset)[0]
+            if block_type == PCAPNG_SHB:
+                bom = struct.unpack_from('<I', buf, offset + 8)[0]
+                self.endian = '<' if bom == PCAPNG_BYTE_ORDER_MAGIC else '>'
+                self.interfaces = []
+            block_len = struct.unpack_from(self.endian + 'I', buf, offset + 4)[0]
+            if block_len < 12:
+                raise ValueError(f'{self.in_file} has a corrupt pcapng block at {offset}')
+            if offset + block_len > end:
+                return
+            self.offset = offset + block_len
+            if block_type == PCAPNG_IDB:
+                self._pcapng_idb(buf, offset, block_len)
+            elif block_type == PCAPNG_EPB:
+                interface_id, ts_high, ts_low, caplen, wirelen = struct.unpack_from(
+                    self.endian + 'IIIII', buf, offset + 8)
+                linktype, ts_scale = self.interfaces[interface_id]
+                ts = ((ts_high << 32) | ts_low) * ts_scale[0] // ts_scale[1]
+                self.packets += 1
+                yield (ts, wirelen, linktype, bytes(buf[offset + 28:offset + 28 + caplen]) if data else None)
+            elif block_type == PCAPNG_OPB:
+                interface_id, _, ts_high, ts_low, caplen, wirelen = struct.unpack_from(
+                    self.endian + 'HHIIII', buf, offset + 8)
+                linktype, ts_scale = self.interfaces[interface_id]
+                ts = ((ts_high << 32) | ts_low) * ts_scale[0] // ts_scale[1]
+                self.packets += 1
+                yield (ts, wirelen, linktype, bytes(buf[offset + 28:offset + 28 + caplen]) if data else None)
+            elif block_type == PCAPNG_SPB:
+                wirelen = struct.unpack_from(self.endian + 'I', buf, offset + 8)[0]
+                caplen = min(wirelen, block_len - 16)
+                linktype, _ = self.interfaces[0]
+                self.packets += 1
+                yield (0, wirelen, linktype, bytes(buf[offset + 12:offset + 12 + caplen]) if data else None)
+
+    def _pcap_records(self, buf, end, data):
+        record_header = struct.Struct(self.endian + 'IIII')
+        mult, div = self.ts_scale
+        linktype = self.linktype
+        while self.offset + 16 <= end:
+            offset = self.offset
+            ts_sec, ts_frac, caplen, wirelen = record_header.unpack_from(buf, offset)
+            data_offset = offset + 16
+            if data_offset + caplen > end:
+                return
+            self.offset = data_offset + caplen
+            self.packets += 1
+            yield (ts_sec * NS_PER_SEC + ts_frac * mult // div, wirelen, linktype,
+                   bytes(buf[data_offset:self.offset]) if data else None)
+
+    def records(self, buf, end=None, data=True):
+        """
+        Yield records from buf starting at self.offset.
+        Stops at the first incomplete record, leaving self.offset pointing at it.
+        Without data, only the record headers are read.
+        """
+        if end is None:
+            end = len(buf)
+        if self.pcapng:
+            return self._pcapng_records(buf, end, data)
+        return self._pcap_records(buf, end, data)
+
+    def _mmap_records(self, f_in):
+        with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if self._parse_header(buf):
+                yield from self.records(buf)
+
+    def _stream_records(self, f_in):
+        buf = bytearray()
+        header = False
+        while True:
+            chunk = f_in.read(READ_CHUNK)
+            buf.extend(chunk)
+            if not header:
+                header = self._parse_header(buf)
+            if header:
+                yield from self.records(buf)
+                del buf[:self.offset]
+                self.offset = 0
+            if not chunk:
+                break
+
+    def _get_state(self):
+        return {
+            'pcapng': self.pcapng,
+            'endian': self.endian,
+            'linktype': self.linktype,
+            'ts_scale': self.ts_scale,
+            'interfaces': list(self.interfaces),
+        }
+
+    def _set_state(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+        self.interfaces = list(self.interfaces)
+
+    def shards(self, shard_bytes):
+        """
+        Split a capture file into packet aligned byte ranges of about shard_bytes each,
+        walking only the record headers. Each shard carries the reader state at its start
+        and the timestamp of the packet just before it, so it can be parsed independently.
+        """
+        shards = []
+        with open(self.in_file, 'rb') as f_in:
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if not self._parse_header(buf):
+                    return shards
+                shard = {'start': self.offset, 'last_ts': None, 'state': self._get_state()}
+                for ts, _, _, _ in self.records(buf, data=False):
+                    if self.offset - shard['start'] >= shard_bytes:
+                        shard['end'] = self.offset
+                        shards.append(shard)
+                        shard = {'start': self.offset, 'last_ts': ts, 'state': self._get_state()}
+                if self.offset > shard['start'] or not shards:
+                    shard['end'] = self.offset
+                    shards.append(shard)
+        return shards
+
+    def shard_records(self, shard):
+        with open(self.in_file, 'rb') as f_in:
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                self._set_state(shard['state'])
+                self.offset = shard['start']
+                yield from self.records(buf, shard['end'])
+
+    def __iter__(self):
+        if not isinstance(self.in_file, str):
+            yield from self._stream_records(self.in_file)
+            return
+        with open(self.in_file, 'rb') as f_in:
+            # empty files and special files can't be mapped.
+            if os.path.isfile(self.in_file) and os.fstat(f_in.fileno()).st_size:
+                yield from self._mmap_records(f_in)
+            else:
+                yield from self._stream_records(f_in)
+
+
+def _ipv4_fields(data, offset, row, protos):
+    if len(data) < offset + 20:
+        return
+    ver_ihl, dsfield, _, _, frag, _, proto, _, src, dst = _IPV4.unpack_from(data, offset)
+    src = socket.inet_ntoa(src)
+    dst = socket.inet_ntoa(dst)
+    row.update({
+        'ip.version': ver_ihl >> 4,
+        'ip.dsfield': '0x%02x' % dsfield,
+        'ip.flags': '0x%02x' % (frag >> 13),
+        'ip.proto': proto,
+        'ip.src': src,
+        'ip.src_host': src,
+        'ip.dst': dst,
+        'ip.dst_host': dst,
+    })
+    protos.append('ip')
+    # like tshark, only dissect the transport header of unfragmented datagrams.
+    if frag & 0x3fff:
+        protos.append('data')
+        return
+    _transport_fields(data, offset + (ver_ihl & 0xf) * 4, proto, row, protos)
+
+
+def _ipv6_fields(data, offset, row, protos):
+    if len(data) < offset + 40:
+        return
+    _, _, nxt, _, src, dst = _IPV6.unpack_from(data, offset)
+    src = socket.inet_ntop(socket.AF_INET6, src)
+    dst = socket.inet_ntop(socket.AF_INET6, dst)
+    # tshark adds a hidden ip.version to IPv6 packets too.
+    row.update({
+        'ip.version': 6,
+        'ipv6.src': src,
+        'ipv6.src_host': src,
+        'ipv6.dst': dst,
+        'ipv6.dst_host': dst,
+    })
+    protos.append('ipv6')
+    offset += 40
+    while nxt in IPV6_EXT_HEADERS and len(data) >= offset + 8:
+        protos.append(IPV6_EXT_HEADERS[nxt])
+        if nxt == 44:
+            if _U16.unpack_from(data, offset + 2)[0] & 0xfff9:
+                protos.append('data')
+                return
+            next_offset = offset + 8
+        else:
+            next_offset = offset + (data[offset + 1] + 1) * 8
+        nxt = data[offset]
+        offset = next_offset
+    _transport_fields(data, offset, nxt, row, protos)
+
+
+def _transport_fields(data, offset, proto, row, protos):
+    proto_name = IP_PROTO_NAMES.get(proto, None)
+    if proto_name is None:
+        protos.append('data')
+        return
+    if proto in (IP_PROTO_TCP, IP_PROTO_UDP):
+        if len(data) < offset + 4:
+            return
+        srcport, dstport = _PORTS.unpack_from(data, offset)
+        row['%s.srcport' % proto_name] = srcport
+        row['%s.dstport' % proto_name] = dstport
+        if proto == IP_PROTO_TCP and len(data) >= offset + 14:
+            row['tcp.flags'] = '0x%04x' % (_TCP_FLAGS.unpack_from(data, offset + 12)[0] & 0x0fff)
+    elif proto in (IP_PROTO_ICMP, IP_PROTO_ICMPV6):
+        if len(data) < offset + 2:
+            return
+        row['%s.code' % proto_name] = data[offset + 1]
+    elif proto == IP_PROTO_GRE:
+        if len(data) < offset + 4:
+            return
+        row['gre.proto'] = '0x%04x' % _U16.unpack_from(data, offset + 2)[0]
+    protos.append(proto_name)
+
+
+def decode_ethernet(data):
+    """
+    Decode the Ethernet, VLAN, ARP, IP and transport headers of a frame,
+    returning a dict of the tshark field names that the featurizer uses.
+    """
+    row = {}
+    if len(data) < 14:
+        return row
+    dst, src, eth_type = _ETH.unpack_from(data, 0)
+    row['eth.dst'] = dst.hex(':')
+    row['eth.src'] = src.hex(':')
+    protos = ['eth']
+    offset = 14
+    if eth_type < 0x600:
+        # 802.3 length field, not an ethertype.
+        protos.append('llc')
+        row['frame.protocols'] = ':'.join(protos)
+        return row
+    row['eth.type'] = '0x%04x' % eth_type
+    protos.append('ethertype')
+    while eth_type in ETH_TYPE_VLANS and len(data) >= offset + 4:
+        tci, eth_type = _VLAN.unpack_from(data, offset)
+        row['vlan.id'] = tci & 0xfff
+        row['vlan.etype'] = '0x%04x' % eth_type
+        protos.extend(('vlan', 'ethertype'))
+        offset += 4
+    if eth_type == ETH_TYPE_IP:
+        _ipv4_fields(data, offset, row, protos)
+    elif eth_type == ETH_TYPE_IPV6:
+        _ipv6_fields(data, offset, row, protos)
+    elif eth_type == ETH_TYPE_ARP:
+        if len(data) >= offset + 8:
+            row['arp.opcode'] = _U16.unpack_from(data, offset + 6)[0]
+        protos.append('arp')
+    else:
+        protos.append('data')
+    row['frame.protocols'] = ':'.join(protos)
+    return row
+
+
+def format_ns(ns):
+    """Format nanoseconds as seconds, the way tshark prints times."""
+    sign = ''
+    if ns < 0:
+        sign = '-'
+        ns = -ns
+    sec, frac = divmod(ns, NS_PER_SEC)
+    return '%s%u.%09u' % (sign, sec, frac)
+
+
+def packet_rows(records, last_ts=None):
+    """
+    Turn (timestamp, original length, link type, bytes) records into packet level rows.
+    last_ts is the timestamp of the packet before the first record, if there was one.
+    """
+    for ts, wirelen, linktype, data in records:
+        if linktype == LINKTYPE_ETHERNET:
+            row = decode_ethernet(data)
+        else:
+            row = {}
+        if last_ts is None:
+            last_ts = ts
+        row['frame.len'] = wirelen
+        row['frame.time_epoch'] = format_ns(ts)
+        row['frame.time_delta_displayed'] = format_ns(ts - last_ts)
+        last_ts = ts
+        yield row
+
+
+def shard_packet_rows(in_file, shard):
+    """
+    Packet level rows for one shard of a capture, as returned by PcapReader.shards().
+    """
+    return packet_rows(PcapReader(in_file).shard_records(shard), last_ts=shard['last_ts'])
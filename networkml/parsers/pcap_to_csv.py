@@ -1,26 +1,68 @@
 import argparse
+import codecs
 import concurrent.futures
+import contextlib
 import csv
 import functools
+import io
 import json
 import logging
 import ntpath
 import os
 import pathlib
+import re
 import shlex
+import shutil
 import subprocess
-import tempfile
+import threading
+import time
 from copy import deepcopy
 
+import pandas as pd
 import pyshark
 
-from networkml.helpers.gzipio import gzip_reader
-from networkml.helpers.gzipio import gzip_writer
+import networkml
+from networkml.helpers.csv_combiner import CSVCombiner
+from networkml.helpers.csv_row_writer import csv_header
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.gzipio import binary_reader
+from networkml.helpers.gzipio import binary_writer
+from networkml.helpers.gzipio import CODEC_EXTS
+from networkml.helpers.gzipio import CODECS
+from networkml.helpers.gzipio import text_writer
+from networkml.helpers.npzio import concat_dfs
+from networkml.helpers.npzio import FrameRowWriter
+from networkml.helpers.npzio import NPZRowWriter
+from networkml.helpers.npzio import read_npz
+from networkml.helpers.npzio import write_npz
+from networkml.helpers.pandas_csv_importer import WS_FIELDS
+from networkml.helpers.parse_cache import ParseCache
+from networkml.helpers.scheduler import auto_threads
+from networkml.helpers.scheduler import file_size
+from networkml.helpers.scheduler import threads_arg
+from networkml.helpers.scheduler import timed_call
+from networkml.helpers.scheduler import WorkerStats
+from networkml.parsers.captures import capture_name
+from networkml.parsers.captures import is_capture
+from networkml.parsers.captures import is_compressed
+from networkml.parsers.captures import is_tar
+from networkml.parsers.captures import tar_captures
+from networkml.parsers.flow_table import flow_rows
+from networkml.parsers.flow_table import FlowTable
+from networkml.parsers.flow_table import FLOW_TIMEOUT
+from networkml.parsers.flow_table import MAX_FLOWS
+from networkml.parsers.host_aggregator import HostAggregator
+from networkml.parsers.native import packet_rows
+from networkml.parsers.native import PcapReader
+from networkml.parsers.native import shard_packet_rows
+
+JSON_READ_CHUNK = 1 << 20
+JSON_SEPARATORS = re.compile(r'[\s\[\],]*')
 
 
 class PCAPToCSV():
 
-    def __init__(self, raw_args=None):
+    def __init__(self, raw_args=None, in_memory=False):
         self.logger = logging.getLogger(__name__)
         self.PROTOCOLS = ['<IP Layer>',
                           '<ETH Layer>',
@@ -35,67 +77,90 @@ class PCAPToCSV():
                           '<IPV6 Layer>',
                           '<TLS Layer>']
         self.raw_args = raw_args
+        # throughput counters for the tshark JSON decoder.
+        self.json_bytes = 0
+        self.json_records = 0
+        # options for the host and flow levels.
+        self.srcmacid = True
+        self.quantile_error = 0.01
+        self.flow_timeout = FLOW_TIMEOUT
+        self.max_flows = MAX_FLOWS
+        self.cache = None
+        # with --combined, per file CSVs carry their filename column for CSVCombiner.
+        self.combined = False
+        # compression of CSV outputs.
+        self.codec = 'gzip'
+        self.compress_level = None
+        self.compress_threads = 0
+        # the outputs of each tar archive input, by the archive's output path.
+        self.archive_outputs = {}
+        # in memory, outputs are kept here as DataFrames by output path, and not written.
+        self.frames = {} if in_memory else None
 
     @staticmethod
     def ispcap(pathfile):
-        for ext in ('pcap', 'pcapng', 'dump', 'capture'):
-            if pathfile.endswith(''.join(('.', ext))):
-                return True
-        return False
+        # captures may be compressed, or in a tar archive.
+        return is_capture(pathfile) or is_tar(pathfile)
 
     @staticmethod
     def parse_args(raw_args=None):
         parser = argparse.ArgumentParser()
         parser.add_argument(
             'path', help='path to a single pcap file, or a directory of pcaps to parse')
+        parser.add_argument('--cache_dir', default=None,
+                            help='directory to cache outputs in, keyed by PCAP content, so unchanged PCAPs are not parsed again (default=None, no cache)')
+        parser.add_argument('--cache_size', default=10240, type=int,
+                            help='MB the cache can use before the least recently used outputs are removed, 0 for no limit (default=10240)')
+        parser.add_argument('--codec', choices=CODECS, default='gzip',
+                            help='compression of csv files, zstd and lz4 need their python packages installed (default=gzip)')
         parser.add_argument('--combined', '-c', action='store_true',
                             help='write out all records from all pcaps into a single gzipped csv file')
-        parser.add_argument('--engine', '-e', choices=['pyshark', 'tshark', 'host'],
+        parser.add_argument('--compress_level', default=None, type=int,
+                            help='compression level, higher is smaller and slower (default=6 for gzip, 3 for zstd, 0 for lz4)')
+        parser.add_argument('--compress_threads', default=0, type=int,
+                            help='threads per worker to compress csv files in blocks with, overlapping compression with parsing (default=0, compress inline)')
+        parser.add_argument('--engine', '-e', choices=['pyshark', 'tshark', 'tshark_fields', 'native', 'host'],
                             default='tshark', help='engine to use to process the PCAP file (default=tshark)')
+        parser.add_argument('--exact_quantiles', action='store_true',
+                            help='make host level quantiles exact rather than sketched, which keeps a count per distinct value, as much memory per host as per packet for time deltas, host level only')
+        parser.add_argument('--flow_timeout', default=FLOW_TIMEOUT, type=float,
+                            help='seconds before an idle flow is closed, 0 for never, native flow engine only (default=300)')
+        parser.add_argument('--format', '-F', choices=['csv', 'npz'], default='csv',
+                            help='write gzipped csv or typed columnar npz files (default=csv)')
         parser.add_argument('--level', '-l', choices=['packet', 'flow', 'host'],
                             default='packet', help='level to make the output records (default=packet)')
+        parser.add_argument('--max_flows', default=MAX_FLOWS, type=int,
+                            help='most live flows before the least recently seen is closed, 0 for no limit, native flow engine only (default=100000)')
         parser.add_argument('--output', '-o', default=None,
                             help='path to write out gzipped csv file or directory for gzipped csv files')
-        parser.add_argument('--threads', '-t', default=1, type=int,
-                            help='number of async threads to use (default=1)')
+        parser.add_argument('--quantile_error', default=0.01, type=float,
+                            help='relative error of sketched host level quantiles, host level only (default=0.01)')
+        parser.add_argument('--shard_size', default=0, type=int,
+                            help='split PCAPs bigger than this many MB into shards parsed in parallel, native packet engine only (default=0, no splitting)')
+        parser.add_argument('--threads', '-t', default=1, type=threads_arg,
+                            help='number of async threads to use, or auto for as many as CPUs and memory allow (default=1)')
         parser.add_argument('--verbose', '-v', choices=[
                             'DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='logging level (default=INFO)')
+        srcmacid_parser = parser.add_mutually_exclusive_group(required=False)
+        srcmacid_parser.add_argument('--srcmacid', dest='srcmacid', action='store_true', help='attempt to detect canonical source MAC and only output that host, host level only')
+        srcmacid_parser.add_argument('--no-srcmacid', dest='srcmacid', action='store_false', help='output all hosts, host level only')
+        parser.set_defaults(srcmacid=True)
         parsed_args = parser.parse_args(raw_args)
         return parsed_args
 
     @staticmethod
-    def get_csv_header(dict_fp):
-        header_all = set()
-        with gzip_reader(dict_fp) as f_in:
-            for line in f_in:
-                header_all.update(json.loads(line.strip()).keys())
-        header = []
-        for key in header_all:
-            if key[0].isalpha() or key[0] == '_':
-                header.append(key)
-        return header
+    def combined_filename(out_file):
+        return re.sub(r'csv(\.\w+)?$', '', out_file.split('/')[-1])
 
     @staticmethod
-    def combine_csvs(out_paths, combined_path):
-        # First determine the field names from the top line of each input file
-        fieldnames = {'filename'}
+    def combine_npzs(out_paths, combined_path):
+        dfs = []
         for filename in out_paths:
-            with gzip_reader(filename) as f_in:
-                reader = csv.reader(f_in)
-                fieldnames.update({header for header in next(reader)})
-
-        # Then copy the data
-        with gzip_writer(combined_path) as f_out:
-            writer = csv.DictWriter(f_out, fieldnames=list(fieldnames))
-            writer.writeheader()
-            for filename in out_paths:
-                with gzip_reader(filename) as f_in:
-                    reader = csv.DictReader(f_in)
-                    for line in reader:
-                        line['filename'] = filename.split(
-                            '/')[-1].split('csv.gz')[0]
-                        writer.writerow(line)
-                    PCAPToCSV.cleanup_files([filename])
+            df = read_npz(filename)
+            df['filename'] = filename.split('/')[-1].split('.npz')[0]
+            dfs.append(df)
+        write_npz(concat_dfs(dfs), combined_path)
+        PCAPToCSV.cleanup_files(out_paths)
 
     @staticmethod
     def cleanup_files(paths):
@@ -103,50 +168,79 @@ class PCAPToCSV():
             if os.path.exists(fi):
                 os.remove(fi)
 
-    def get_pyshark_packet_data(self, pcap_file, dict_fp):
+    @staticmethod
+    def capture_label(pcap_file):
+        return getattr(pcap_file, 'name', pcap_file)
+
+    @staticmethod
+    def tshark_popen(pcap_file, options, **kwargs):
+        """
+        Start tshark reading pcap_file, a path or a binary stream. A stream, such as a
+        decompressed capture or a tar member, is fed to tshark's stdin from a thread.
+        """
+        if isinstance(pcap_file, str):
+            return subprocess.Popen(['tshark', '-r', pcap_file] + options, **kwargs)
+        process = subprocess.Popen(['tshark', '-r', '-'] + options, stdin=subprocess.PIPE, **kwargs)
+
+        def feed_stdin():
+            try:
+                shutil.copyfileobj(pcap_file, process.stdin)
+            except BrokenPipeError:  # pragma: no cover
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:  # pragma: no cover
+                    pass
+
+        threading.Thread(target=feed_stdin, daemon=True).start()
+        return process
+
+    def get_pyshark_packet_data(self, pcap_file, writer):
+        if not isinstance(pcap_file, str):
+            raise ValueError('the pyshark engine needs an uncompressed capture file')
         all_protocols = set()
 
         pcap_file_short = ntpath.basename(pcap_file)
-        with gzip_writer(dict_fp) as f_out:
-            with pyshark.FileCapture(pcap_file,
-                                     use_json=True,
-                                     include_raw=True,
-                                     keep_packets=False,
-                                     custom_parameters=['-o', 'tcp.desegment_tcp_streams:false', '-n']) as cap:
-                for packet in cap:
-                    packet_dict = {}
-                    packet_dict['filename'] = pcap_file_short
-                    frame_info = packet.frame_info._all_fields
-                    for key in frame_info:
-                        packet_dict[key] = frame_info[key]
-                    # can overflow the field size for csv
-                    #packet_dict['raw_packet'] = packet.get_raw_packet()
-                    layers = str(packet.layers)
-                    packet_dict['layers'] = layers
-                    str_layers = layers[1:-1].split(', ')
-                    for str_layer in str_layers:
-                        # ignore raw layers
-                        if 'RAW' not in str_layer:
-                            all_protocols.add(str_layer)
-                        # only include specified protocols due to unknown parsing for some layers
-                        if str_layer in self.PROTOCOLS:
-                            layer_info = getattr(packet, str_layer.split()[
-                                                 0][1:].lower())._all_fields
-                            # check for nested dicts, one level deep
-                            for key in layer_info:
-                                # DNS doesn't parse well
-                                if isinstance(layer_info[key], dict) and str_layer != '<DNS Layer>':
-                                    for inner_key in layer_info[key]:
-                                        packet_dict[inner_key] = layer_info[key][inner_key]
-                                else:
-                                    packet_dict[key] = layer_info[key]
-                    # clean up records
-                    packet_dict_copy = deepcopy(packet_dict)
-                    keys = packet_dict_copy.keys()
-                    for key in keys:
-                        if not key[0].isalpha() or key == 'tcp.payload_raw' or key == 'tcp.payload':
-                            del packet_dict[key]
-                    f_out.write(json.dumps(packet_dict) + '\n')
+        with pyshark.FileCapture(pcap_file,
+                                 use_json=True,
+                                 include_raw=True,
+                                 keep_packets=False,
+                                 custom_parameters=['-o', 'tcp.desegment_tcp_streams:false', '-n']) as cap:
+            for packet in cap:
+                packet_dict = {}
+                packet_dict['filename'] = pcap_file_short
+                frame_info = packet.frame_info._all_fields
+                for key in frame_info:
+                    packet_dict[key] = frame_info[key]
+                # can overflow the field size for csv
+                #packet_dict['raw_packet'] = packet.get_raw_packet()
+                layers = str(packet.layers)
+                packet_dict['layers'] = layers
+                str_layers = layers[1:-1].split(', ')
+                for str_layer in str_layers:
+                    # ignore raw layers
+                    if 'RAW' not in str_layer:
+                        all_protocols.add(str_layer)
+                    # only include specified protocols due to unknown parsing for some layers
+                    if str_layer in self.PROTOCOLS:
+                        layer_info = getattr(packet, str_layer.split()[
+                                             0][1:].lower())._all_fields
+                        # check for nested dicts, one level deep
+                        for key in layer_info:
+                            # DNS doesn't parse well
+                            if isinstance(layer_info[key], dict) and str_layer != '<DNS Layer>':
+                                for inner_key in layer_info[key]:
+                                    packet_dict[inner_key] = layer_info[key][inner_key]
+                            else:
+                                packet_dict[key] = layer_info[key]
+                # clean up records
+                packet_dict_copy = deepcopy(packet_dict)
+                keys = packet_dict_copy.keys()
+                for key in keys:
+                    if not key[0].isalpha() or key == 'tcp.payload_raw' or key == 'tcp.payload':
+                        del packet_dict[key]
+                writer.writerow(packet_dict)
 
         for protocol in self.PROTOCOLS:
             if protocol in all_protocols:
@@ -155,14 +249,16 @@ class PCAPToCSV():
             self.logger.warning(
                 f'Found the following other layers in {pcap_file_short} that were not added to the CSV: {all_protocols}')
 
-    def get_tshark_conv_data(self, pcap_file, dict_fp):
+    def get_tshark_conv_data(self, pcap_file, writer):
         # TODO (add a summary of other packets with protocols?)
         output = ''
         try:
             # TODO perhaps more than just tcp/udp in the future
             options = '-n -q -z conv,tcp -z conv,udp'
-            output = subprocess.check_output(shlex.split(
-                ' '.join(['tshark', '-r', pcap_file, options])))
+            with self.tshark_popen(pcap_file, shlex.split(options), stdout=subprocess.PIPE) as process:
+                output = process.stdout.read()
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, 'tshark')
             output = output.decode('utf-8')
         except Exception as e:  # pragma: no cover
             self.logger.error(f'{e}')
@@ -187,32 +283,31 @@ class PCAPToCSV():
                 elif not line.startswith('Filter:') and line != '':
                     results[name] += line + '\n'
 
-        with gzip_writer(dict_fp) as f_out:
-            for result in results.keys():
-                if 'Conversations' in result:
-                    transport_proto = result.split()[0]
-                    # handle conversation parsing
-                    for line in results[result].split('\n'):
-                        if line == '' or line.startswith(' '):
-                            # header or padding, dicard
-                            continue
-                        else:
-                            # TODO perhaps additional features can be extracted for flows from tshark
-                            src, _, dst, frames_l, bytes_l, frames_r, bytes_r, frames_total, bytes_total, rel_start, duration = line.split()
-                            conv = {'Source': src.rsplit(':', 1)[0],
-                                    'Source Port': src.rsplit(':', 1)[1],
-                                    'Destination': dst.rsplit(':', 1)[0],
-                                    'Destination Port': dst.rsplit(':', 1)[1],
-                                    'Transport Protocol': transport_proto,
-                                    'Frames to Source': frames_l,
-                                    'Bytes to Source': bytes_l,
-                                    'Frames to Destination': frames_r,
-                                    'Bytes to Destination': bytes_r,
-                                    'Total Frames': frames_total,
-                                    'Total Bytes': bytes_total,
-                                    'Relative Start': rel_start,
-                                    'Duration': duration}
-                            f_out.write(json.dumps(conv) + '\n')
+        for result in results.keys():
+            if 'Conversations' in result:
+                transport_proto = result.split()[0]
+                # handle conversation parsing
+                for line in results[result].split('\n'):
+                    if line == '' or line.startswith(' '):
+                        # header or padding, dicard
+                        continue
+                    else:
+                        # TODO perhaps additional features can be extracted for flows from tshark
+                        src, _, dst, frames_l, bytes_l, frames_r, bytes_r, frames_total, bytes_total, rel_start, duration = line.split()
+                        conv = {'Source': src.rsplit(':', 1)[0],
+                                'Source Port': src.rsplit(':', 1)[1],
+                                'Destination': dst.rsplit(':', 1)[0],
+                                'Destination Port': dst.rsplit(':', 1)[1],
+                                'Transport Protocol': transport_proto,
+                                'Frames to Source': frames_l,
+                                'Bytes to Source': bytes_l,
+                                'Frames to Destination': frames_r,
+                                'Bytes to Destination': bytes_r,
+                                'Total Frames': frames_total,
+                                'Total Bytes': bytes_total,
+                                'Relative Start': rel_start,
+                                'Duration': duration}
+                        writer.writerow(conv)
 
     @staticmethod
     @functools.lru_cache()
@@ -240,92 +335,292 @@ class PCAPToCSV():
         flatten('', item)
         return flattened_dict
 
-    def json_packet_records(self, process):
-        json_buffer = []
-
-        def _recordize():
-            return json.loads('\n'.join(json_buffer))
-
-        depth = 0
-        while True:
-            json_line = process.stdout.readline().decode(encoding='utf-8', errors='ignore')
-            if json_line == '' and process.poll() is not None:
-                break
-            if not json_line.startswith(' '):
-                continue
-            json_line = json_line.strip()
-            bracket_line = json_line.rstrip(',')
-            if bracket_line.endswith('}'):
-                depth -= 1
-            elif bracket_line.endswith('{'):
-                depth += 1
-            if depth == 0:
-                if bracket_line:
-                    json_buffer.append(bracket_line)
-                if json_buffer:
-                    yield _recordize()
-                json_buffer = []
-            else:
-                if json_line:
-                    json_buffer.append(json_line)
-
-    def get_tshark_packet_data(self, pcap_file, dict_fp):
+    def json_packet_records(self, process, chunk_size=JSON_READ_CHUNK):
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        start_time = time.time()
+        json_buffer = ''
+        eof = False
+        while not eof:
+            chunk = process.stdout.read(chunk_size)
+            eof = not chunk
+            self.json_bytes += len(chunk)
+            json_buffer += text_decoder.decode(chunk, final=eof)
+            pos = 0
+            while True:
+                # skip the enclosing list's brackets, commas and whitespace between packets.
+                pos = JSON_SEPARATORS.match(json_buffer, pos).end()
+                if pos == len(json_buffer):
+                    break
+                try:
+                    item, pos = decoder.raw_decode(json_buffer, pos)
+                except json.JSONDecodeError:
+                    # partial packet, wait for the rest of it.
+                    if eof:
+                        raise
+                    break
+                self.json_records += 1
+                yield item
+            json_buffer = json_buffer[pos:]
+        elapsed_time = max(time.time() - start_time, 1e-6)
+        self.logger.debug(
+            f'Decoded {self.json_records} JSON records from {self.json_bytes} bytes ({self.json_bytes / elapsed_time / 1e6:.1f} MB/s)')
+
+    def get_tshark_packet_data(self, pcap_file, writer):
         options = '-n -V -Tjson'
         try:
-            with subprocess.Popen(shlex.split(
-                ' '.join(['tshark', '-r', pcap_file, options])), stdout=subprocess.PIPE) as process:
-                with gzip_writer(dict_fp) as f_out:
-                    for item in self.json_packet_records(process):
-                        f_out.write(json.dumps(self.flatten_json(item)) + '\n')
+            with self.tshark_popen(pcap_file, shlex.split(options), stdout=subprocess.PIPE) as process:
+                for item in self.json_packet_records(process):
+                    writer.writerow(self.flatten_json(item))
         except Exception as e:  # pragma: no cover
             self.logger.error(f'{e}')
 
-    def get_tshark_host_data(self, pcap_file, dict_fp):
-        # TODO
-        raise NotImplementedError('To be implemented')
+    def get_native_packet_data(self, pcap_file, writer):
+        writer.writerows(packet_rows(PcapReader(pcap_file)))
 
-    def write_dict_to_csv(self, dict_fp, out_file):
-        header = PCAPToCSV.get_csv_header(dict_fp)
-        with gzip_writer(out_file) as f_out:
-            writer = csv.DictWriter(f_out, fieldnames=header)
-            writer.writeheader()
-            try:
-                with gzip_reader(dict_fp) as f_in:
-                    for line in f_in:
-                        writer.writerow(json.loads(line.strip()))
-            except Exception as e:  # pragma: no cover
-                self.logger.error(f'Failed to write to CSV because: {e}')
+    def get_native_flow_data(self, pcap_file, writer):
+        table = FlowTable(timeout=self.flow_timeout, max_flows=self.max_flows)
+        writer.writerows(flow_rows(PcapReader(pcap_file), table))
+        if table.cap_closed:
+            self.logger.warning(
+                f'{table.cap_closed} flows in {self.capture_label(pcap_file)} were closed early, at the limit of {self.max_flows} live flows')
 
-    def parse_file(self, level, in_file, out_file, engine):
+    @staticmethod
+    def tshark_fields_options():
+        # only ask tshark for what the featurizer reads, in CSV form with a header row.
+        # the last occurrence of a repeated field matches what flatten_json keeps.
+        options = ['-n', '-T', 'fields', '-E', 'header=y', '-E', 'separator=,',
+                   '-E', 'quote=d', '-E', 'occurrence=l']
+        for field in WS_FIELDS:
+            options.extend(['-e', field])
+        return options
+
+    def get_tshark_fields_packet_data(self, pcap_file, out_file):
+        try:
+            with self.tshark_popen(pcap_file, self.tshark_fields_options(), stdout=subprocess.PIPE) as process:
+                with binary_writer(out_file, self.codec, self.compress_level, self.compress_threads) as f_out:
+                    shutil.copyfileobj(process.stdout, f_out)
+        except Exception as e:  # pragma: no cover
+            self.logger.error(f'{e}')
+
+    def get_tshark_fields_packet_rows(self, pcap_file, writer):
+        try:
+            with self.tshark_popen(pcap_file, self.tshark_fields_options(), stdout=subprocess.PIPE) as process:
+                writer.writerows(csv.DictReader(io.TextIOWrapper(process.stdout, newline='')))
+        except Exception as e:  # pragma: no cover
+            self.logger.error(f'{e}')
+
+    def get_packet_data(self, pcap_file, writer, engine):
+        if engine == 'tshark':
+            # option for tshark as it's much faster
+            self.get_tshark_packet_data(pcap_file, writer)
+        elif engine == 'tshark_fields':
+            self.get_tshark_fields_packet_rows(pcap_file, writer)
+        elif engine == 'native':
+            self.get_native_packet_data(pcap_file, writer)
+        elif engine == 'pyshark':
+            # using pyshark to get everything possible
+            self.get_pyshark_packet_data(pcap_file, writer)
+
+    def get_host_rows(self, pcap_file, engine):
+        # packets are aggregated per host as they are parsed, so they are never written out.
+        aggregator = HostAggregator(self.quantile_error)
+        self.get_packet_data(pcap_file, aggregator, engine)
+        self.logger.info(
+            f'Aggregated {aggregator.packets} packets from {self.capture_label(pcap_file)} into {len(aggregator.macs)} hosts')
+        return aggregator.host_rows(srcmacid=self.srcmacid)
+
+    def row_writer(self, out_file, out_format, fieldnames=None, extra=None):
+        if self.frames is not None:
+            return FrameRowWriter(self.frames, out_file)
+        if out_format == 'npz':
+            return NPZRowWriter(out_file)
+        return CSVRowWriter(out_file, fieldnames=fieldnames, extra=extra, codec=self.codec,
+                            level=self.compress_level, threads=self.compress_threads)
+
+    @staticmethod
+    @functools.lru_cache()
+    def tshark_version():
+        try:
+            return subprocess.check_output(['tshark', '-v']).decode('utf-8').split('\n')[0]
+        except Exception:
+            return ''
+
+    def cache_key(self, level, in_file, out_file, engine, out_format, member=None):
+        params = [networkml.__version__, level, engine, out_format]
+        if out_format == 'csv':
+            params.append(self.codec)
+        if engine != 'native':
+            params.append(self.tshark_version())
+        if level == 'host':
+            params.extend((self.srcmacid, self.quantile_error))
+        elif level == 'flow' and engine == 'native':
+            params.extend((self.flow_timeout, self.max_flows))
+        if self.combined and out_format == 'csv':
+            # the filename column _parse_file writes into the output.
+            params.append(self.combined_filename(out_file))
+        if member is not None:
+            params.append(member)
+        return self.cache.key(in_file, *params)
+
+    def parse_file(self, level, in_file, out_file, engine, out_format='csv'):
+        cache_key = None
+        if self.cache is not None and self.frames is None:
+            cache_key = self.cache_key(level, in_file, out_file, engine, out_format)
+            if self.cache.get(cache_key, out_file):
+                self.logger.info(f'Using cached output for {in_file}')
+                return True
         self.logger.info(f'Processing {in_file}')
-        with tempfile.TemporaryDirectory() as tmpdir:
-            dict_fp = os.path.join(tmpdir, os.path.basename(in_file))
+        # a compressed capture is decompressed as it's parsed, rather than to a file first.
+        with binary_reader(in_file) if is_compressed(in_file) else contextlib.nullcontext(in_file) as pcap_file:
+            self._parse_file(level, pcap_file, out_file, engine, out_format)
+        if cache_key is not None:
+            self.cache.put(cache_key, out_file)
+        return False
+
+    def out_ext(self, out_format):
+        if out_format == 'npz':
+            return '.npz'
+        return '.csv' + CODEC_EXTS[self.codec]
+
+    def parse_archive(self, level, in_file, out_file, engine, out_format='csv'):
+        """
+        Parse each capture in a tar archive as the archive is read, without extracting it,
+        into a file named after the capture alongside out_file. Returns the output file and
+        whether it was cached, for each capture.
+        """
+        results = []
+        for member, pcap_file in tar_captures(in_file):
+            member_out_file = os.path.join(
+                os.path.dirname(out_file), capture_name(member).replace('/', '_') + self.out_ext(out_format))
+            cache_key = None
+            if self.cache is not None and self.frames is None:
+                cache_key = self.cache_key(level, in_file, member_out_file, engine, out_format, member=member)
+                if self.cache.get(cache_key, member_out_file):
+                    self.logger.info(f'Using cached output for {member} in {in_file}')
+                    results.append((member_out_file, True))
+                    continue
+            self.logger.info(f'Processing {member} in {in_file}')
+            self._parse_file(level, pcap_file, member_out_file, engine, out_format)
+            if cache_key is not None:
+                self.cache.put(cache_key, member_out_file)
+            results.append((member_out_file, False))
+        return results
+
+    def _parse_file(self, level, in_file, out_file, engine, out_format):
+        extra = None
+        if self.combined and out_format == 'csv':
+            extra = {'filename': self.combined_filename(out_file)}
+        if self.frames is not None:
+            self._write_output(level, in_file, out_file, engine, out_format, extra)
+            return
+        # written under a temporary name and renamed once complete, so a failed parse
+        # doesn't leave a partial or header-only out_file.
+        tmp_file = os.path.join(os.path.dirname(out_file), '.tmp.' + os.path.basename(out_file))
+        try:
+            self._write_output(level, in_file, tmp_file, engine, out_format, extra)
+        except Exception:
+            PCAPToCSV.cleanup_files([tmp_file])
+            raise
+        os.replace(tmp_file, out_file)
+
+    def _write_output(self, level, in_file, out_file, engine, out_format, extra):
+        if (level == 'packet' and engine == 'tshark_fields' and out_format == 'csv' and not extra
+                and self.frames is None):
+            # tshark writes the CSV itself, so there's no intermediate.
+            self.get_tshark_fields_packet_data(in_file, out_file)
+            return
+        if level == 'host':
+            rows = self.get_host_rows(in_file, engine)
+            if self.frames is not None:
+                self.frames[out_file] = pd.DataFrame(rows)
+            elif out_format == 'npz':
+                # host rows are features, so keep their types as the featurizer does.
+                write_npz(pd.DataFrame(rows), out_file)
+            else:
+                with self.row_writer(out_file, out_format, extra=extra) as writer:
+                    writer.writerows(rows)
+            return
+        fieldnames = None
+        if level == 'packet' and engine == 'native':
+            # native rows only ever have the WS_FIELDS columns.
+            fieldnames = list(WS_FIELDS)
+        with self.row_writer(out_file, out_format, fieldnames=fieldnames, extra=extra) as writer:
             if level == 'packet':
-                if engine == 'tshark':
-                    # option for tshark as it's much faster
-                    self.get_tshark_packet_data(in_file, dict_fp)
-                elif engine == 'pyshark':
-                    # using pyshark to get everything possible
-                    self.get_pyshark_packet_data(in_file, dict_fp)
+                self.get_packet_data(in_file, writer, engine)
             elif level == 'flow':
-                # using tshark conv,tcp and conv,udp filters
-                self.get_tshark_conv_data(in_file, dict_fp)
-            elif level == 'host':
-                # TODO unknown what should be in this, just the overarching stats?
-                raise NotImplementedError('To be implemented')
-            self.write_dict_to_csv(dict_fp, out_file)
-            PCAPToCSV.cleanup_files([dict_fp])
-
-    def process_files(self, threads, level, in_paths, out_paths, engine):
+                if engine == 'native':
+                    self.get_native_flow_data(in_file, writer)
+                else:
+                    # using tshark conv,tcp and conv,udp filters
+                    self.get_tshark_conv_data(in_file, writer)
+
+    @staticmethod
+    def parse_shard(in_file, part_file, shard, write_header, out_format='csv', filename=None,
+                    codec='gzip', level=None, threads=0):
+        rows = shard_packet_rows(in_file, shard)
+        if out_format == 'npz':
+            with NPZRowWriter(part_file) as writer:
+                writer.writerows(rows)
+            return
+        fieldnames = list(WS_FIELDS)
+        if filename is not None:
+            fieldnames.insert(0, 'filename')
+            rows = ({'filename': filename, **row} for row in rows)
+        header = None
+        if write_header:
+            header = csv_header(fieldnames)
+        with text_writer(part_file, codec, level, threads, header=header) as f_out:
+            writer = csv.DictWriter(f_out, fieldnames=fieldnames)
+            writer.writerows(rows)
+
+    @staticmethod
+    def stitch_shards(part_files, out_file, out_format='csv'):
+        if out_format == 'npz':
+            write_npz(concat_dfs([read_npz(part_file) for part_file in part_files]), out_file)
+        else:
+            # only the first part has a header, so the gzip members can just be concatenated.
+            with open(out_file, 'wb') as f_out:
+                for part_file in part_files:
+                    with open(part_file, 'rb') as f_in:
+                        shutil.copyfileobj(f_in, f_out)
+        PCAPToCSV.cleanup_files(part_files)
+
+    def worker_options(self):
+        return {
+            'srcmacid': self.srcmacid,
+            'quantile_error': self.quantile_error,
+            'flow_timeout': self.flow_timeout,
+            'max_flows': self.max_flows,
+            'cache': self.cache,
+            'combined': self.combined,
+            'codec': self.codec,
+            'compress_level': self.compress_level,
+            'compress_threads': self.compress_threads,
+        }
+
+    def archive_done(self, out_file, results, combiner=None):
+        self.archive_outputs[out_file] = [member_out_file for member_out_file, _ in results]
+        if combiner is not None:
+            for member_out_file in self.archive_outputs[out_file]:
+                combiner.add(member_out_file)
+
+    def process_files(self, threads, level, in_paths, out_paths, engine, out_format='csv', shard_size=0, combiner=None):
         num_files = len(in_paths)
         failed_paths = []
         finished_files = 0
-        # corner case so it works in jupyterlab
-        if threads < 2:
+        # corner case so it works in jupyterlab, and in memory outputs stay in this process.
+        if threads < 2 or self.frames is not None:
             for i in range(len(in_paths)):
                 try:
                     finished_files += 1
-                    self.parse_file(level, in_paths[i], out_paths[i], engine)
+                    if is_tar(in_paths[i]):
+                        self.archive_done(out_paths[i], self.parse_archive(
+                            level, in_paths[i], out_paths[i], engine, out_format), combiner)
+                        continue
+                    self.parse_file(level, in_paths[i], out_paths[i], engine, out_format)
+                    if combiner is not None:
+                        combiner.add(out_paths[i])
                     self.logger.info(
                         f'Finished {in_paths[i]}. {finished_files}/{num_files} PCAPs done.')
                 except Exception as e:  # pragma: no cover
@@ -333,23 +628,127 @@ class PCAPToCSV():
                         f'{in_paths[i]} generated an exception: {e}')
                     failed_paths.append(out_paths[i])
         else:
+            options = self.worker_options()
+            worker_stats = WorkerStats()
             with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
-                future_to_parse = {executor.submit(
-                    self.parse_file, level, in_paths[i], out_paths[i], engine): i for i in range(len(in_paths))}
+                jobs = []
+                shard_parts = {}
+                for i in range(len(in_paths)):
+                    size = file_size(in_paths[i])
+                    shards = []
+                    if is_tar(in_paths[i]):
+                        # an archive is read as one stream, so its captures are parsed in turn by one worker.
+                        jobs.append((size, parse_archive_worker,
+                                     (options, level, in_paths[i], out_paths[i], engine, out_format), i))
+                        continue
+                    if (shard_size and level == 'packet' and engine == 'native' and size > shard_size * 2**20
+                            and not is_compressed(in_paths[i])):
+                        cache_key = None
+                        if self.cache is not None:
+                            cache_key = self.cache_key(level, in_paths[i], out_paths[i], engine, out_format)
+                            if self.cache.get(cache_key, out_paths[i]):
+                                if combiner is not None:
+                                    combiner.add(out_paths[i])
+                                finished_files += 1
+                                self.logger.info(
+                                    f'Using cached output for {in_paths[i]}. {finished_files}/{num_files} PCAPs done.')
+                                continue
+                        shards = PcapReader(in_paths[i]).shards(shard_size * 2**20)
+                    if len(shards) > 1:
+                        self.logger.info(f'Splitting {in_paths[i]} into {len(shards)} shards')
+                        part_files = ['%s.shard%u' % (out_paths[i], j) for j in range(len(shards))]
+                        shard_parts[i] = {'part_files': part_files, 'pending': len(shards), 'cache_key': cache_key}
+                        filename = None
+                        if self.combined and out_format == 'csv':
+                            filename = self.combined_filename(out_paths[i])
+                        for j, shard in enumerate(shards):
+                            jobs.append((shard['end'] - shard['start'], PCAPToCSV.parse_shard,
+                                         (in_paths[i], part_files[j], shard, j == 0, out_format, filename,
+                                          self.codec, self.compress_level, self.compress_threads), i))
+                    else:
+                        jobs.append((size, parse_file_worker,
+                                     (options, level, in_paths[i], out_paths[i], engine, out_format), i))
+                # biggest first, so a big file submitted last doesn't leave one worker busy at the end.
+                jobs.sort(key=lambda job: job[0], reverse=True)
+                future_to_parse = {
+                    executor.submit(timed_call, func, *args): i for _, func, args, i in jobs}
                 for future in concurrent.futures.as_completed(future_to_parse):
                     path = future_to_parse[future]
+                    shards_pending = 0
+                    if path in shard_parts:
+                        shard_parts[path]['pending'] -= 1
+                        shards_pending = shard_parts[path]['pending']
+                    if out_paths[path] in failed_paths:
+                        if path in shard_parts and not shards_pending:
+                            # the failed file's last shard is done, so no worker is still writing its parts.
+                            PCAPToCSV.cleanup_files(shard_parts[path]['part_files'])
+                        continue
                     try:
+                        result, pid, start_time, end_time = future.result()
+                        worker_stats.add(pid, start_time, end_time)
+                        if is_tar(in_paths[path]):
+                            if self.cache is not None:
+                                self.cache.hits += sum(cached for _, cached in result)
+                                self.cache.misses += sum(not cached for _, cached in result)
+                            self.archive_done(out_paths[path], result, combiner)
+                            finished_files += 1
+                            self.logger.info(
+                                f'Finished {in_paths[path]}. {finished_files}/{num_files} PCAPs done.')
+                            continue
+                        if path in shard_parts:
+                            if shards_pending:
+                                continue
+                            PCAPToCSV.stitch_shards(
+                                shard_parts[path]['part_files'], out_paths[path], out_format)
+                            if shard_parts[path]['cache_key'] is not None:
+                                self.cache.put(shard_parts[path]['cache_key'], out_paths[path])
+                        elif self.cache is not None:
+                            # the workers counted in their own copy of the cache.
+                            if result:
+                                self.cache.hits += 1
+                            else:
+                                self.cache.misses += 1
+                        if combiner is not None:
+                            # combine each file as it's done, rather than all of them at the end.
+                            combiner.add(out_paths[path])
                         finished_files += 1
-                        future.result()
                     except Exception as e:  # pragma: no cover
                         self.logger.error(
                             f'{in_paths[path]} generated an exception: {e}')
                         failed_paths.append(out_paths[path])
+                        if path in shard_parts and not shards_pending:
+                            PCAPToCSV.cleanup_files(shard_parts[path]['part_files'])
                     else:
                         self.logger.info(
                             f'Finished {in_paths[path]}. {finished_files}/{num_files} PCAPs done.')
+            worker_stats.report(self.logger, threads)
+        if self.cache is not None:
+            self.logger.info(
+                f'Parse cache {self.cache.cache_dir}: {self.cache.hits} hits, {self.cache.misses} misses')
         return failed_paths
 
+    def frames_output(self, in_paths, out_paths, threads, level, engine, out_format, combined):
+        """
+        Parse in_paths in memory, returning the DataFrames by output path, or one DataFrame
+        with a filename column as the combined CSV would have if combined.
+        """
+        self.process_files(threads, level, in_paths, out_paths, engine, out_format)
+        out_paths = [member_out_file for out_file in out_paths
+                     for member_out_file in self.archive_outputs.get(out_file, [out_file])]
+        frames = {out_file: self.frames[out_file] for out_file in out_paths if out_file in self.frames}
+        self.logger.info(f'Parsed {len(frames)} PCAP(s) in memory')
+        if not combined:
+            return frames
+        dfs = []
+        for out_file, df in frames.items():
+            if out_format == 'npz':
+                filename = out_file.split('/')[-1].split('.npz')[0]
+            else:
+                filename = self.combined_filename(out_file)
+            df.insert(0, 'filename', filename)
+            dfs.append(df)
+        return concat_dfs(dfs)
+
     def main(self):
         parsed_args = PCAPToCSV.parse_args(raw_args=self.raw_args)
         in_path = parsed_args.path
@@ -359,6 +758,17 @@ class PCAPToCSV():
         threads = parsed_args.threads
         log_level = parsed_args.verbose
         level = parsed_args.level
+        out_format = parsed_args.format
+        self.srcmacid = parsed_args.srcmacid
+        self.quantile_error = None if parsed_args.exact_quantiles else parsed_args.quantile_error
+        self.flow_timeout = parsed_args.flow_timeout
+        self.max_flows = parsed_args.max_flows
+        self.codec = parsed_args.codec
+        self.compress_level = parsed_args.compress_level
+        self.compress_threads = parsed_args.compress_threads
+        out_ext = self.out_ext(out_format)
+        if parsed_args.cache_dir:
+            self.cache = ParseCache(parsed_args.cache_dir, parsed_args.cache_size * 2**20)
 
         log_levels = {'INFO': logging.INFO, 'DEBUG': logging.DEBUG,
                       'WARNING': logging.WARNING, 'ERROR': logging.ERROR}
@@ -377,13 +787,13 @@ class PCAPToCSV():
                         in_paths.append(os.path.join(root, pathfile))
                         if out_path:
                             out_paths.append(os.path.join(
-                                out_path, pathfile) + '.csv.gz')
+                                out_path, capture_name(pathfile)) + out_ext)
                         else:
                             out_paths.append(os.path.join(
-                                root, pathfile) + '.csv.gz')
+                                root, capture_name(pathfile)) + out_ext)
         else:
             in_paths.append(in_path)
-            default_out_path = in_path + '.csv.gz'
+            default_out_path = capture_name(in_path) + out_ext
 
             if out_path:
                 if os.path.isdir(out_path):
@@ -397,22 +807,45 @@ class PCAPToCSV():
             self.logger.info(
                 f'Including the following layers in CSV (if they exist): {self.PROTOCOLS}')
 
+        if threads == 'auto':
+            threads = auto_threads(tasks=None if parsed_args.shard_size else len(in_paths))
+            self.logger.info(f'Using {threads} threads')
+
+        combiner = None
+        if self.frames is not None:
+            return self.frames_output(in_paths, out_paths, threads, level, engine, out_format, combined)
+
+        if combined:
+            combined_path = 'combined' + out_ext
+            if out_paths:
+                combined_path = os.path.join(
+                    os.path.dirname(out_paths[0]), combined_path)
+            self.logger.info(
+                f'Combining CSVs into a single file: {combined_path}')
+            if out_format == 'csv':
+                self.combined = True
+                combiner = CSVCombiner(combined_path, codec=self.codec, level=self.compress_level)
+
         failed_paths = self.process_files(
-            threads, level, in_paths, out_paths, engine)
+            threads, level, in_paths, out_paths, engine, out_format, parsed_args.shard_size, combiner)
 
         for failed_path in failed_paths:  # pragma: no cover
             if failed_path in out_paths:
                 out_paths.remove(failed_path)
+        # an archive's output path stands for the outputs of the captures in it.
+        out_paths = [member_out_file for out_file in out_paths
+                     for member_out_file in self.archive_outputs.get(out_file, [out_file])]
+        if not out_paths:
+            self.logger.error(f'No output, as none of {in_paths} could be parsed')
+            return None
 
         if combined:
-            if out_paths:
-                combined_path = os.path.join(
-                    os.path.dirname(out_paths[0]), 'combined.csv.gz')
+            if combiner is not None:
+                combiner.close()
+                self.logger.info(
+                    f'Combined {combiner.copied} CSVs as they were, and {combiner.remapped} with different headers')
             else:
-                combined_path = 'combined.csv.gz'
-            self.logger.info(
-                f'Combining CSVs into a single file: {combined_path}')
-            PCAPToCSV.combine_csvs(out_paths, combined_path)
+                PCAPToCSV.combine_npzs(out_paths, combined_path)
             return combined_path
         else:
             self.logger.info(
@@ -422,6 +855,22 @@ class PCAPToCSV():
             return out_paths[0]
 
 
+def worker_instance(options):
+    # a new instance in the worker, so the pool doesn't have to pickle the calling one.
+    instance = PCAPToCSV()
+    for option, val in options.items():
+        setattr(instance, option, val)
+    return instance
+
+
+def parse_file_worker(options, level, in_file, out_file, engine, out_format):
+    return worker_instance(options).parse_file(level, in_file, out_file, engine, out_format)
+
+
+def parse_archive_worker(options, level, in_file, out_file, engine, out_format):
+    return worker_instance(options).parse_archive(level, in_file, out_file, engine, out_format)
+
+
 if __name__ == '__main__':  # pragma: no cover
     instance = PCAPToCSV()
     instance.main()
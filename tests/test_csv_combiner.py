@@ -0,0 +1,63 @@
+import csv
+import gzip
+import os
+import tempfile
+
+from networkml.helpers.csv_combiner import CSVCombiner
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.gzipio import gzip_reader
+
+
+def read_rows(path, use_gzip=True):
+    f_in = gzip_reader(path) if use_gzip else open(path, newline='')
+    with f_in:
+        return list(csv.DictReader(f_in))
+
+
+def test_csv_combiner():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        in_files = []
+        for i, rows in enumerate((
+                [{'a': '1', 'b': '2'}],
+                [{'a': '3', 'b': '4'}, {'a': '5', 'b': '6'}],
+                [{'b': '7', 'a': '8'}],
+                [{'a': '9', 'c': '10'}])):
+            in_file = os.path.join(tmpdir, '%u.csv.gz' % i)
+            with CSVRowWriter(in_file, extra={'filename': str(i)}) as writer:
+                writer.writerows(rows)
+            in_files.append(in_file)
+        # not written by CSVRowWriter, so the header shares a member with the rows.
+        in_file = os.path.join(tmpdir, '4.csv.gz')
+        with gzip.open(in_file, 'wt', newline='') as f_out:
+            f_out.write('filename,a,b\r\n4,11,12\r\n')
+        in_files.append(in_file)
+
+        out_file = os.path.join(tmpdir, 'combined.csv.gz')
+        with CSVCombiner(out_file) as combiner:
+            for in_file in in_files:
+                combiner.add(in_file)
+        assert (combiner.copied, combiner.remapped) == (2, 3)
+        assert not any(os.path.exists(in_file) for in_file in in_files)
+        assert sorted(os.listdir(tmpdir)) == ['combined.csv.gz']
+        rows = read_rows(out_file)
+        assert list(rows[0]) == ['filename', 'a', 'b', 'c']
+        assert [(row['filename'], row['a'], row['b'], row['c']) for row in rows] == [
+            ('0', '1', '2', ''), ('1', '3', '4', ''), ('1', '5', '6', ''), ('2', '8', '7', ''),
+            ('3', '9', '', '10'), ('4', '11', '12', '')]
+
+
+def test_csv_combiner_no_gzip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        in_files = []
+        for i, text in enumerate(('a,b\r\n1,2\r\n', 'a,b\r\n3,4\r\n', 'b,a\r\n5,6\r\n')):
+            in_file = os.path.join(tmpdir, '%u.csv' % i)
+            with open(in_file, 'w', newline='') as f_out:
+                f_out.write(text)
+            in_files.append(in_file)
+        out_file = os.path.join(tmpdir, 'combined.csv')
+        with CSVCombiner(out_file, codec='none') as combiner:
+            for in_file in in_files:
+                combiner.add(in_file)
+        assert (combiner.copied, combiner.remapped) == (2, 1)
+        with open(out_file, newline='') as f_in:
+            assert f_in.read() == 'a,b\r\n1,2\r\n3,4\r\n6,5\r\n'
@@ -0,0 +1,46 @@
+import csv
+import os
+import tempfile
+
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.gzipio import gzip_reader
+
+
+def read_rows(in_file):
+    with gzip_reader(in_file) as f_in:
+        reader = csv.DictReader(f_in)
+        return reader.fieldnames, list(reader)
+
+
+def test_csv_row_writer_buffered():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'out.csv.gz')
+        with CSVRowWriter(out_file) as writer:
+            writer.writerow({'a': 1, '1bad': 2})
+            writer.writerow({'b': 3})
+        header, rows = read_rows(out_file)
+        assert header == ['a', 'b']
+        assert rows == [{'a': '1', 'b': ''}, {'a': '', 'b': '3'}]
+        assert os.listdir(tmpdir) == ['out.csv.gz']
+
+
+def test_csv_row_writer_header_grows():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'out.csv.gz')
+        with CSVRowWriter(out_file, buffer_rows=2) as writer:
+            writer.writerows([{'a': i} for i in range(3)])
+            writer.writerow({'a': 3, 'c': 4})
+            writer.writerow({'a': 5})
+        header, rows = read_rows(out_file)
+        assert header == ['a', 'c']
+        assert [row['a'] for row in rows] == ['0', '1', '2', '3', '5']
+        assert rows[3]['c'] == '4'
+        assert os.listdir(tmpdir) == ['out.csv.gz']
+
+
+def test_csv_row_writer_no_rows():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'out.csv.gz')
+        with CSVRowWriter(out_file, fieldnames=['a']):
+            pass
+        assert read_rows(out_file) == (['a'], [])
@@ -1,9 +1,16 @@
+import ipaddress
 import os
 import shutil
 import sys
 import tempfile
 
+import pandas as pd
+import pytest
+
 from networkml.featurizers.csv_to_features import CSVToFeatures
+from networkml.helpers.npzio import read_npz
+from networkml.helpers.pandas_csv_importer import import_csv
+from networkml.helpers.pandas_csv_importer import WS_FIELDS
 from networkml.parsers.pcap_to_csv import PCAPToCSV
 
 COMMON_ARGS = ['-t', '2', '-v', 'DEBUG']
@@ -79,3 +86,69 @@ def test_CSVToFeatures_host():
         for srcidflag in ('--srcmacid', '--no-srcmacid'):
             for featurizer in ('sessionhost_tshark', 'host_tshark'):
                 run_csv_to_features(trace, featurizer=featurizer, otherflag=srcidflag)
+
+
+def test_CSVToFeatures_npz():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pcap = './tests/test_data/trace_ab12_2001-01-01_02_03-client-ip6-1-2-3-4.pcap'
+        pcap_npz = os.path.join(tmpdir, 'trace.pcap.npz')
+        PCAPToCSV(raw_args=['-e', 'native', '-F', 'npz', '-o', pcap_npz, pcap]).main()
+        features = CSVToFeatures(raw_args=['-c', '-F', 'npz', '-g', 'host_tshark', pcap_npz]).main()
+        assert features == os.path.join(tmpdir, 'combined.npz')
+        df = read_npz(features)
+        assert df['filename'].tolist() == ['trace.pcap.npz']
+        assert df['host_key'].tolist() == ['00:00:00:00:00:00']
+
+
+def test_import_csv_ipv6_exact():
+    # IPv6 addresses that agree in their top 53 bits used to be merged by rounding through
+    # float64 when the column started with a null.
+    ips = ['', 'fc01::1', 'fc01::', 'fc01::2', '', 'fc01::1']
+    rows = []
+    for i, ip in enumerate(ips):
+        row = {field: '' for field in WS_FIELDS}
+        row.update({
+            'eth.src': '0e:00:00:00:00:01', 'eth.dst': '0e:00:00:00:00:02', 'frame.len': '60',
+            'frame.time_epoch': str(1000.0 + i), 'frame.time_delta_displayed': '0.5', 'ipv6.src': ip})
+        rows.append(row)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_file = os.path.join(tmpdir, 'trace.pcap.csv.gz')
+        pd.DataFrame(rows).to_csv(csv_file, index=False)
+        df = import_csv(csv_file)
+    assert df['ipv6.src'].tolist() == [None if not ip else int(ipaddress.ip_address(ip)) for ip in ips]
+    assert df['ipv6.src'].nunique() == 3
+
+
+def test_CSVToFeatures_chunks_ipv6():
+    macs = ['0e:00:00:00:00:01', '0e:00:00:00:00:02']
+    ips = [('fe80::1', 'fe80::2', '0x86dd', '6'), ('fe80::3', 'fe80::2', '0x86dd', '6'),
+           ('fe80::1', '2001:db8::1', '0x86dd', '6'), ('192.168.0.1', '192.168.0.2', '0x0800', '4')]
+    rows = []
+    for i in range(24):
+        src_ip, dst_ip, eth_type, ip_version = ips[(i // 4) % len(ips)]
+        ipb = 'ipv6' if ip_version == '6' else 'ip'
+        row = {field: '' for field in WS_FIELDS}
+        row.update({
+            'eth.src': macs[i % 2], 'eth.dst': macs[(i + 1) % 2], 'eth.type': eth_type,
+            'frame.len': str(60 + i), 'frame.time_epoch': str(1000.0 + i), 'frame.time_delta_displayed': '0.5',
+            'frame.protocols': 'eth:ethertype:%s:udp' % ipb, 'ip.version': ip_version, 'ip.proto': '17',
+            '%s.src' % ipb: src_ip, '%s.dst' % ipb: dst_ip, 'udp.srcport': '5353', 'udp.dstport': '5353'})
+        rows.append(row)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_file = os.path.join(tmpdir, 'trace.pcap.csv.gz')
+        pd.DataFrame(rows).to_csv(csv_file, index=False)
+        for featurizer in ('host_tshark', 'sessionhost_tshark'):
+            features = []
+            for chunk_args in ([], ['--chunk_rows', '4']):
+                out_file = os.path.join(tmpdir, 'features.csv.gz')
+                CSVToFeatures(raw_args=['-g', featurizer, '--no-srcmacid', '-o', out_file] + chunk_args + [csv_file]).main()
+                features.append(pd.read_csv(out_file))
+            whole, chunked = features
+            assert whole['tshark_unique_srcips'].sum() == (6 if featurizer == 'host_tshark' else 8)
+            for col in whole.columns:
+                if col == 'tshark_srcips':
+                    assert [sorted(eval(ips)) for ips in chunked[col]] == [sorted(eval(ips)) for ips in whole[col]]
+                elif whole[col].dtype == float:
+                    assert chunked[col].tolist() == pytest.approx(whole[col].tolist(), nan_ok=True)
+                else:
+                    assert chunked[col].tolist() == whole[col].tolist(), col
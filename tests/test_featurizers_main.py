@@ -1,11 +1,12 @@
+from networkml.featurizers.features import ChunkState
 from networkml.featurizers.features import Features
 from networkml.featurizers.main import Featurizer
+from networkml.featurizers.registry import feature_registry
 
 
 def test_no_path():
-    instance = Featurizer()
-    result = instance.import_class('foo', None)
-    assert result == None
+    result = feature_registry('foo').classes([], ('host',))
+    assert result == []
 
 
 def test_run_all_funcs():
@@ -36,3 +37,43 @@ def test_run_all_funcs():
     results = instance.run_all_funcs(
         [], [], [], [{'test1': 99, 'test2': 123}], True)
     assert results == []
+
+
+def test_run_chunked_funcs():
+    instance = Featurizer()
+
+    class SumState(ChunkState):
+
+        def __init__(self):
+            self.total = 0
+
+        def add(self, df):
+            self.total += sum(df)
+
+        def finalize(self):
+            return [{'total': self.total}]
+
+    class TestClass(Features):
+
+        @staticmethod
+        def test_sum(rows, _parsed_args):
+            return [{'total': sum(rows)}]
+
+        @staticmethod
+        def test_first(rows, _parsed_args):
+            return [{'first': rows[0]}]
+
+        def chunk_state(self, func_name, parsed_args):
+            if func_name == 'test_sum':
+                return SumState()
+            return None
+
+    tc = TestClass()
+    chunks = iter([[1, 2], [3]])
+    assert instance.run_chunked_funcs(
+        [('TestClass', 'test_sum')], [], [(tc, 'TestClass')], chunks, None) == [[{'total': 6}]]
+    # any function without a state means none of the chunks are read.
+    chunks = iter([[1, 2], [3]])
+    assert instance.run_chunked_funcs(
+        [], 'test_', [(tc, 'TestClass')], chunks, None) is None
+    assert next(chunks) == [1, 2]
@@ -0,0 +1,110 @@
+import os
+import sys
+import tempfile
+
+from networkml.featurizers import registry
+from networkml.featurizers.features import Features
+from networkml.featurizers.registry import feature_registry
+from networkml.featurizers.registry import FeatureRegistry
+
+
+MODULES = {
+    'registry_alpha.py': '''
+from networkml.featurizers.features import ChunkState
+from networkml.featurizers.features import Features
+
+
+class AlphaBase:
+
+    def alpha_base(self, rows, parsed_args):
+        return [{'alpha_base': 1}]
+
+
+class Alpha(AlphaBase, Features):
+
+    def alpha_one(self, rows, parsed_args):
+        return [{'alpha_one': 1}]
+
+
+class AlphaState(ChunkState):
+    pass
+''',
+    'registry_beta.py': '''
+from networkml.featurizers.features import Features
+
+
+class Beta(Features):
+
+    def beta_one(self, rows, parsed_args):
+        return [{'beta_one': 1}]
+''',
+    'registry_gamma.py': '''
+from registry_beta import Beta
+
+
+class Gamma(Beta):
+
+    def gamma_one(self, rows, parsed_args):
+        return [{'gamma_one': 1}]
+''',
+}
+
+
+class Plugin(Features):
+
+    def plugin_one(self, rows, parsed_args):
+        return [{'plugin_one': 1}]
+
+
+class FakeEntryPoint():
+
+    name = 'Plugin'
+    value = 'tests:Plugin'
+
+    def __init__(self):
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return Plugin
+
+
+def test_feature_registry(monkeypatch):
+    entry_point = FakeEntryPoint()
+    monkeypatch.setattr(registry, '_entry_points', lambda: [entry_point])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, source in MODULES.items():
+            with open(os.path.join(tmpdir, name), 'w') as f_out:
+                f_out.write(source)
+        instance = feature_registry(tmpdir)
+        assert feature_registry(tmpdir) is instance
+        # Gamma's base is from a module not imported yet, so its methods aren't known.
+        assert [(mod_name, class_name) for mod_name, class_name, _ in instance.index] == [
+            ('registry_alpha', 'Alpha'), ('registry_beta', 'Beta'), ('registry_gamma', 'Gamma')]
+        assert 'alpha_base' in instance.index[0][2]
+        assert instance.index[2][2] is None
+        # a function only imports its class's module, and loads no other entry points.
+        classes = instance.classes([('Alpha', 'alpha_one')], ())
+        assert [name for _, name in classes] == ['Alpha']
+        assert 'registry_alpha' in sys.modules
+        assert 'registry_beta' not in sys.modules
+        assert entry_point.loads == 0
+        assert [name for _, name in instance.classes([('Plugin', 'plugin_one')], ())] == ['Plugin']
+        # groups import the modules that might have their methods, and entry points.
+        classes = instance.classes([], ('gamma', 'plugin'))
+        assert [name for _, name in classes] == ['Gamma', 'Plugin']
+        assert 'registry_beta' in sys.modules
+        assert [name for _, name in instance.classes([], ('alpha_base',))] == ['Alpha']
+        # instances are made once.
+        assert instance.classes([], ('alpha',))[0][0] is instance.classes([], ('alpha',))[0][0]
+        sys.path.remove(tmpdir)
+        for name in MODULES:
+            del sys.modules[name[:-3]]
+
+
+def test_feature_registry_funcs():
+    instance = FeatureRegistry(os.path.join(os.path.dirname(registry.__file__), 'funcs'))
+    assert [name for _, name in instance.classes([], ('host',))] == ['Host']
+    assert [name for _, name in instance.classes([], ('sessionhost',))] == ['SessionHost']
+    assert [name for _, name in instance.classes([], 'default')] == ['Flow']
+    assert FeatureRegistry('foo').classes([], ('host',)) == []
@@ -0,0 +1,29 @@
+import gc
+
+import pandas as pd
+
+from networkml.helpers.frame_cache import FrameCache
+
+
+def test_frame_cache():
+    cache = FrameCache()
+    calls = []
+
+    def total(df):
+        calls.append(id(df))
+        return df['x'].sum()
+
+    df = pd.DataFrame({'x': [1, 2, 3]})
+    other_df = pd.DataFrame({'x': [4]})
+    assert cache.get(df, 'total', total, df) == 6
+    assert cache.get(df, 'total', total, df) == 6
+    assert cache.get(other_df, 'total', total, other_df) == 4
+    assert len(calls) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+    # values are dropped with their DataFrame.
+    del df
+    gc.collect()
+    assert len(cache.frames) == 1
+    cache.clear(other_df)
+    assert cache.get(other_df, 'total', total, other_df) == 4
+    assert len(calls) == 3
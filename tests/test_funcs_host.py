@@ -1,11 +1,17 @@
+import argparse
 import ipaddress
 
 import netaddr
+import numpy as np
 import pandas as pd
+import pytest
 
+from networkml.featurizers.features import FRAME_CACHE
 from networkml.featurizers.funcs.host import Host
 from networkml.featurizers.funcs.host import HostBase
+from networkml.featurizers.funcs.host import HostChunkState
 from networkml.featurizers.funcs.host import SessionHost
+from networkml.featurizers.funcs.host import TCP_UDP_PROTOS
 from networkml.helpers.pandas_csv_importer import recast_df
 from networkml.helpers.pandas_csv_importer import WS_FIELDS
 
@@ -35,10 +41,38 @@ def test_get_ips():
         assert instance._df_ip_flags(srcip, dstip) == ip_flags
 
 
+def test_ip_flags():
+    flags = (
+        ('9.255.255.255', False, False), ('10.0.0.0', True, False), ('10.255.255.255', True, False),
+        ('11.0.0.0', False, False), ('172.15.255.255', False, False), ('172.31.255.255', True, False),
+        ('192.0.0.7', True, False), ('192.0.0.8', False, False), ('192.0.0.171', True, False),
+        ('223.255.255.255', False, False), ('224.0.0.0', False, True), ('239.255.255.255', False, True),
+        ('240.0.0.0', True, False), ('255.255.255.255', True, False), ('0.0.0.0', True, False),
+        ('fc01::1', True, False), ('ff02::1', False, False), ('2001:4860:4860::8888', False, False))
+    ips = [ipaddress.ip_address(ip) for ip, _, _ in flags] + [None]
+    is_private, is_multicast = HostBase._ip_flags(ips)
+    assert is_private.tolist() == [private for _, private, _ in flags] + [False]
+    assert is_multicast.tolist() == [multicast for _, _, multicast in flags] + [False]
+
+
 def test_macs():
     instance = HostBase()
     assert instance._is_unicast(int(netaddr.EUI('0e:00:00:00:00:01'))) == True
     assert instance._is_unicast(int(netaddr.EUI('ff:ff:ff:ff:ff:ff'))) == False
+    macs = [int(netaddr.EUI(mac)) for mac in (
+        '0e:00:00:00:00:01', 'ff:ff:ff:ff:ff:ff', '01:00:5e:00:00:01', '00:00:00:00:00:00')]
+    assert instance._unicast_macs(macs).tolist() == [instance._is_unicast(mac) for mac in macs]
+
+
+def test_mac_partitions():
+    df = pd.DataFrame({
+        'eth.src': [1, 2, 1, 3, 2, 4],
+        'eth.dst': [2, 1, 1, 2, 4, 2],
+    }, index=[10, 11, 12, 13, 14, 15])
+    mac_positions = HostBase._mac_partitions(df)
+    for mac in (1, 2, 3, 4):
+        expected = df[(df['eth.src'] == mac) | (df['eth.dst'] == mac)]
+        pd.testing.assert_frame_equal(df.iloc[mac_positions(mac)], expected)
 
 
 def test_flags():
@@ -158,3 +192,254 @@ def test_host_keys():
     assert instance._host_key(row)[1:] == (str(src_ip), str(dst_ip), 1, 0, 1)
     instance = SessionHost()
     assert instance._host_key(row)[1:] == (str(src_ip), str(dst_ip), 1, 0, 1)
+
+
+def test_df_intermediates():
+    rows = []
+    for ipv, ipb, srcip, dstip, protocols in (
+            (4, 'ip', '192.168.0.1', '192.168.0.2', 'eth:ip:tcp'),
+            (4, 'ip', '192.168.0.1', '224.0.0.1', 'eth:ip:udp'),
+            (6, 'ipv6', 'fc01::1', '2001:4860:4860::8888', 'eth:ipv6:icmpv6'),
+            (6, 'ipv6', 'fc01::1', 'ff02::1', ''),
+            (None, 'ip', '10.0.0.1', '8.8.8.8', 'eth:arp')):
+        row = {field: None for field in WS_FIELDS}
+        row.update({
+            'eth.src': int(netaddr.EUI('0e:00:00:00:00:01')),
+            'eth.dst': int(netaddr.EUI('0e:00:00:00:00:02')),
+            'ip.version': ipv,
+            '%s.src' % ipb: int(ipaddress.ip_address(srcip)),
+            '%s.dst_host' % ipb: int(ipaddress.ip_address(dstip)),
+            'frame.protocols': protocols,
+        })
+        rows.append(row)
+    rows[0]['tcp.srcport'] = 22
+    rows[1]['arp.opcode'] = 1
+    df = recast_df(pd.DataFrame(rows))
+    for instance in (Host(), SessionHost()):
+        expected = list(zip(*df.apply(instance._host_key, axis=1)))
+        src_ips = instance._get_ips(df, ('src', 'src_host'))
+        dst_ips = instance._get_ips(df, ('dst', 'dst_host'))
+        ip_cols = instance._df_ip_cols(src_ips, dst_ips)
+        assert [list(col) for col in ip_cols] == [list(col) for col in expected[1:5]]
+        assert list(instance._df_protos_ints(df)) == list(expected[5])
+        assert list(instance._df_host_keys(df, src_ips, dst_ips)) == list(expected[0])
+
+
+def test_session_keys():
+    rows = []
+    eth_a = int(netaddr.EUI('0e:00:00:00:00:01'))
+    eth_b = int(netaddr.EUI('0e:00:00:00:00:02'))
+    for ethsrc, ethdst, ipv, ipb, srcip, dstip, srcport, dstport in (
+            (eth_a, eth_b, 6, 'ipv6', 'fc01::1', 'fc01::2', 999, 1001),
+            (eth_b, eth_a, 6, 'ipv6', 'fc01::2', 'fc01::1', 1001, 999),
+            (eth_a, eth_b, 6, 'ipv6', 'fc01::1', 'fc01::2', 999, 1002),
+            (eth_a, eth_b, 4, 'ip', '192.168.0.1', '192.168.0.2', None, None),
+            (eth_b, eth_a, 4, 'ip', '192.168.0.2', '192.168.0.1', None, None)):
+        rows.append({
+            'eth.src': ethsrc,
+            'eth.dst': ethdst,
+            'ip.version': ipv,
+            '%s.src' % ipb: int(ipaddress.ip_address(srcip)),
+            '%s.dst' % ipb: int(ipaddress.ip_address(dstip)),
+            'tcp.srcport': srcport,
+            'tcp.dstport': dstport,
+        })
+    for ethsrc, ethdst, eth_type in ((eth_a, eth_b, 0x806), (eth_b, eth_a, 0x806), (eth_a, eth_b, 0x8137)):
+        rows.append({'eth.src': ethsrc, 'eth.dst': ethdst, 'eth.type': eth_type})
+    df = recast_df(pd.DataFrame([{**{field: None for field in WS_FIELDS}, **row} for row in rows]))
+    instance = SessionHost()
+    keys = instance._df_host_keys(
+        df, instance._get_ips(df, ('src', 'src_host')), instance._get_ips(df, ('dst', 'dst_host')))
+    assert keys.dtype == 'int64'
+    # both directions of a session share a key, which doesn't change between runs.
+    assert keys[0] == keys[1] and keys[3] == keys[4] and keys[5] == keys[6]
+    assert len({keys[0], keys[2], keys[3], keys[5], keys[7]}) == 5
+    assert keys[0] == -2098516001649525852
+    # the per-row key is the same.
+    assert [instance._host_key(row)[0] for _, row in df.iterrows()] == keys.tolist()
+    df = random_tshark_df()
+    keys = instance._df_host_keys(
+        df, instance._get_ips(df, ('src', 'src_host')), instance._get_ips(df, ('dst', 'dst_host')))
+    assert [instance._host_key(row)[0] for _, row in df.iterrows()] == keys.tolist()
+
+
+def test_grouped_calc_vals():
+    instance = SessionHost()
+    macs = [int(netaddr.EUI('0e:00:00:00:00:0%u' % i)) for i in range(1, 4)]
+    rng = np.random.default_rng(1)
+    rows = []
+    for _ in range(120):
+        eth_src, eth_dst = rng.choice(macs, 2, replace=False)
+        ip_proto = int(rng.choice([6, 17, 1]))
+        row = {field: None for field in WS_FIELDS}
+        row.update({
+            'eth.src': int(eth_src),
+            'eth.dst': int(eth_dst),
+            'frame.len': int(rng.integers(60, 1500)) if rng.random() > 0.1 else None,
+            'frame.time_delta_displayed': float(rng.exponential(0.1)),
+            'ip.proto': ip_proto,
+            'ip.dsfield': int(rng.integers(0, 256)) if rng.random() > 0.5 else None,
+            'tcp.flags': int(rng.integers(0, 512)) if ip_proto == 6 else None,
+        })
+        if ip_proto != 1:
+            ip_proto = TCP_UDP_PROTOS[ip_proto]
+            row['%s.srcport' % ip_proto] = int(rng.choice([22, 53, 80, 443, 999, 5353, 6653, 40000]))
+            row['%s.dstport' % ip_proto] = int(rng.choice([22, 53, 80, 443, 999, 5353, 6653, 40000]))
+        rows.append(row)
+    df = recast_df(pd.DataFrame(rows))
+    df['frame.time_epoch'] = 1000.0 + np.arange(len(df))
+    df['_protos_int'] = rng.integers(0, 256, len(df))
+    df['_srcip'] = df['_dstip'] = 'None'
+    df['_host_key'] = rng.integers(0, 20, len(df))
+    tshark_df = random_tshark_df()
+    instance._df_intermediates(tshark_df)
+    for df in (df, tshark_df):
+        mac_positions = instance._mac_partitions(df)
+        positions = [mac_positions(mac) for mac in macs]
+        key_codes, _ = pd.factorize(df['_host_key'].to_numpy(), sort=True)
+        mac_indexes, grouped = instance._grouped_calc_vals(df, macs, positions, key_codes)
+        grouped_rows = instance._grouped_rows([macs[mac_index] for mac_index in mac_indexes], grouped)
+        group = 0
+        for mac, mac_pos in zip(macs, positions):
+            for _, key_df in df.iloc[mac_pos].groupby('_host_key'):
+                # every column of the group, in order, from the grouped values alone.
+                expected = instance._calc_mac_row(mac, key_df)
+                assert list(grouped_rows[group].items()) == list(expected.items())
+                assert [type(val) for val in grouped_rows[group].values()] == [type(val) for val in expected.values()]
+                group += 1
+        assert group == len(grouped_rows)
+
+
+def random_tshark_df():
+    macs = [int(netaddr.EUI('0e:00:00:00:00:0%u' % i)) for i in range(1, 4)]
+    ips = ['192.168.0.1', '192.168.0.2', '224.0.0.251', 'fc01::1', 'ff02::fb']
+    rng = np.random.default_rng(4)
+    rows = []
+    for i in range(150):
+        eth_src, eth_dst = rng.choice(macs + [int(netaddr.EUI('ff:ff:ff:ff:ff:ff'))], 2, replace=False)
+        ip_proto = int(rng.choice([6, 17, 1]))
+        src_ip, dst_ip = [ipaddress.ip_address(ip) for ip in rng.choice(ips, 2)]
+        row = {field: None for field in WS_FIELDS}
+        row.update({
+            'eth.src': int(eth_src),
+            'eth.dst': int(eth_dst),
+            'eth.type': int(rng.choice([0x800, 0x86DD, 0x8137])),
+            'frame.len': int(rng.integers(60, 1500)) if rng.random() > 0.1 else None,
+            'frame.time_epoch': 1000.0 + i,
+            'frame.time_delta_displayed': float(rng.exponential(0.1)),
+            'frame.protocols': 'eth:ip',
+            'vlan.id': 10 if rng.random() > 0.9 else None,
+            'ip.version': src_ip.version,
+            'ip.proto': ip_proto,
+            'ip.dsfield': int(rng.integers(0, 256)) if rng.random() > 0.5 else None,
+            'tcp.flags': int(rng.integers(0, 512)) if ip_proto == 6 else None,
+        })
+        if src_ip.version == dst_ip.version:
+            ipb = 'ip' if src_ip.version == 4 else 'ipv6'
+            row.update({'%s.src' % ipb: int(src_ip), '%s.dst' % ipb: int(dst_ip)})
+        if ip_proto != 1:
+            ip_proto = TCP_UDP_PROTOS[ip_proto]
+            row['%s.srcport' % ip_proto] = int(rng.choice([22, 53, 80, 443, 999, 5353, 40000]))
+            row['%s.dstport' % ip_proto] = int(rng.choice([22, 53, 80, 443, 999, 5353, 40000]))
+        rows.append(row)
+    return recast_df(pd.DataFrame(rows))
+
+
+def test_chunk_state():
+    df = random_tshark_df()
+    for instance, func_name in ((Host(), 'host_tshark_all'), (SessionHost(), 'sessionhost_tshark_all')):
+        for srcmacid in (True, False):
+            expected = instance._tshark_all(df.copy(), srcmacid)
+            state = instance.chunk_state(func_name, argparse.Namespace(srcmacid=srcmacid))
+            for start in range(0, len(df), 40):
+                state.add(df.iloc[start:start + 40].copy())
+            chunked = state.finalize()
+            assert len(chunked) == len(expected)
+            for chunked_row, row in zip(chunked, expected):
+                assert list(chunked_row) == list(row)
+                row['tshark_srcips'].sort()
+                chunked_row['tshark_srcips'].sort()
+                for col, val in row.items():
+                    if isinstance(val, (float, np.floating)):
+                        assert chunked_row[col] == pytest.approx(val, rel=1e-12), col
+                    else:
+                        assert chunked_row[col] == val, col
+    assert Host().chunk_state('host_other', argparse.Namespace(srcmacid=True)) is None
+
+
+def test_chunk_state_sketch():
+    df = random_tshark_df()
+    for instance, func_name in ((Host(), 'host_tshark_all'), (SessionHost(), 'sessionhost_tshark_all')):
+        for srcmacid in (True, False):
+            expected = instance._tshark_all(df.copy(), srcmacid)
+            state = instance.chunk_state(func_name, argparse.Namespace(
+                srcmacid=srcmacid, sketch=True, quantile_error=0.01, distinct_error=0.03))
+            for start in range(0, len(df), 40):
+                state.add(df.iloc[start:start + 40].copy())
+            sketched = state.finalize()
+            # sketches don't change which MACs are featurized, only their stats.
+            assert [row['host_key'] for row in sketched] == [row['host_key'] for row in expected]
+            for sketched_row, row in zip(sketched, expected):
+                assert list(sketched_row) == list(row)
+                assert set(sketched_row['tshark_srcips']) <= set(row['tshark_srcips'])
+                for col, val in row.items():
+                    if col == 'tshark_srcips':
+                        continue
+                    if col.startswith('tshark_unique'):
+                        assert sketched_row[col] == pytest.approx(val, rel=0.1, abs=1), col
+                    elif '_median_' in col or '_25q_' in col or '_75q_' in col:
+                        assert sketched_row[col] == pytest.approx(val, rel=0.01), col
+                    elif isinstance(val, (float, np.floating)):
+                        assert sketched_row[col] == pytest.approx(val, rel=1e-9, abs=1e-12), col
+                    else:
+                        assert sketched_row[col] == val, col
+
+
+def test_shared_intermediates():
+    df = random_tshark_df()
+    expected = [instance._tshark_all(df.copy(), False) for instance in (Host(), SessionHost())]
+    misses = FRAME_CACHE.misses
+    assert Host()._tshark_all(df, False) == expected[0]
+    host_misses = FRAME_CACHE.misses - misses
+    hits = FRAME_CACHE.hits
+    # SessionHost reuses the IP, protocol and MAC partition intermediates Host cached.
+    assert SessionHost()._tshark_all(df, False) == expected[1]
+    assert FRAME_CACHE.misses - misses == host_misses
+    assert FRAME_CACHE.hits - hits == host_misses
+
+
+def test_chunk_state_sketch_registers():
+    macs = [int(netaddr.EUI('0e:00:00:00:00:0%u' % i)) for i in range(1, 3)]
+    rows = []
+    for i in range(400):
+        row = {field: None for field in WS_FIELDS}
+        row.update({
+            'eth.src': macs[0], 'eth.dst': macs[1], 'eth.type': 0x800, 'frame.len': 100,
+            'frame.time_epoch': 1000.0 + i, 'frame.time_delta_displayed': 0.1,
+            'frame.protocols': 'eth:ip:udp', 'ip.version': 4, 'ip.proto': 17,
+            'ip.src': int(ipaddress.ip_address('10.0.0.0')) + i % 200,
+            'ip.dst': int(ipaddress.ip_address('192.168.0.1')),
+            'udp.srcport': 5353, 'udp.dstport': 5353})
+        rows.append(row)
+    df = recast_df(pd.DataFrame(rows))
+    args = argparse.Namespace(srcmacid=False, sketch=True, quantile_error=0.01, distinct_error=0.03)
+    for instance, func_name, sketched_keys in (
+            (Host(), 'host_tshark_all', 1), (SessionHost(), 'sessionhost_tshark_all', 0)):
+        expected = instance._tshark_all(df.copy(), False)
+        state = instance.chunk_state(func_name, args)
+        for start in range(0, len(df), 100):
+            state.add(df.iloc[start:start + 100].copy())
+        # only groups with many IPs have registers, and then no exact IPs.
+        registers = state.registers['srcips']
+        assert len(registers) == sketched_keys
+        assert sum(key_registers.nbytes for key_registers in registers.values()) == sketched_keys * state.distincts.registers
+        groups, _, _ = state.groups.table('srcips')
+        assert not np.isin(groups, [state.groups.key_index[key] for key in registers]).any()
+        assert np.bincount(groups, minlength=1).max() <= HostChunkState.SKETCH_EXACT_IPS
+        for sketched_row, row in zip(state.finalize(), expected):
+            if row['tshark_unique_srcips'] > HostChunkState.SKETCH_EXACT_IPS:
+                assert sketched_row['tshark_unique_srcips'] == pytest.approx(200, rel=3 * state.distincts.error)
+            else:
+                assert sketched_row['tshark_unique_srcips'] == row['tshark_unique_srcips']
+            assert sketched_row['tshark_unique_dstips'] == row['tshark_unique_dstips']
+            assert len(sketched_row['tshark_srcips']) <= HostChunkState.SKETCH_SRCIPS
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from networkml.featurizers.funcs.host import HostBase
+from networkml.helpers.grouped_stats import GroupedAggregates
+from networkml.helpers.grouped_stats import grouped_stats
+from networkml.helpers.grouped_stats import grouped_value_stats
+
+
+def test_grouped_stats():
+    rng = np.random.default_rng(1)
+    groups = rng.permutation(np.repeat(np.arange(6), [0, 1, 2, 5, 9, 200]))
+    frame_len = pd.Series(rng.integers(60, 1500, len(groups)), dtype='UInt32')
+    frame_len[rng.random(len(groups)) < 0.2] = pd.NA
+    frame_len[groups == 2] = pd.NA
+    time_delta = pd.Series(rng.exponential(0.1, len(groups)))
+    time_delta[rng.random(len(groups)) < 0.2] = np.nan
+    for values in (frame_len, time_delta):
+        stats = grouped_stats(values, groups, 6)
+        for group in range(6):
+            group_values = values[groups == group]
+            for calc_name, calc_func in HostBase.CALC_COL_FUNCS:
+                val = calc_func(group_values)
+                if pd.isnull(val):
+                    val = 0
+                assert type(stats[calc_name][group]) == type(val)
+                assert stats[calc_name][group] == val
+    assert grouped_stats(pd.Series(['a']), np.zeros(1, dtype=np.int64), 1) is None
+
+
+def test_grouped_value_stats():
+    rng = np.random.default_rng(2)
+    groups = rng.permutation(np.repeat(np.arange(5), [0, 1, 3, 9, 300]))
+    frame_len = pd.Series(rng.integers(60, 70, len(groups)), dtype='UInt32')
+    frame_len[rng.random(len(groups)) < 0.2] = pd.NA
+    time_delta = pd.Series(rng.choice([0.0, 0.1, 0.25, 1.5], len(groups)))
+    for values, masked in ((frame_len, True), (time_delta, False)):
+        expected = grouped_stats(values, groups, 5)
+        nulls = values.isna().to_numpy()
+        aggregates = GroupedAggregates()
+        aggregates.index(list(range(5)))
+        data = values[~nulls].to_numpy(dtype=np.uint32 if masked else np.float64)
+        aggregates.add_values('values', groups[~nulls], data)
+        stats = grouped_value_stats(*aggregates.table('values', data.dtype), 5,
+                                    np.bincount(groups[nulls], minlength=5), masked)
+        for calc_name in expected:
+            if calc_name in ('average', 'variance') or (calc_name == 'total' and not masked):
+                assert np.allclose(stats[calc_name], expected[calc_name], rtol=1e-12)
+            else:
+                assert stats[calc_name] == expected[calc_name]
+                assert [type(val) for val in stats[calc_name]] == [type(val) for val in expected[calc_name]]
+
+
+def test_grouped_aggregates():
+    rng = np.random.default_rng(3)
+    keys = rng.choice(['a', 'b', 'c', 'd'], 1000)
+    values = rng.integers(0, 20, 1000)
+    merged = GroupedAggregates()
+    for start in range(0, len(keys), 300):
+        chunk = GroupedAggregates()
+        chunk_keys, codes = np.unique(keys[start:start + 300], return_inverse=True)
+        indexes = chunk.index(list(chunk_keys))
+        chunk.add('count', np.add, indexes, np.bincount(codes))
+        chunk.add('max', np.fmax, indexes, [values[start:start + 300][codes == i].max() for i in indexes], empty=-1)
+        chunk.add_values('values', codes, values[start:start + 300])
+        merged.merge(chunk)
+    assert sorted(merged.keys) == ['a', 'b', 'c', 'd']
+    for key in merged.keys:
+        key_values = values[keys == key]
+        index = merged.key_index[key]
+        assert merged.array('count')[index] == len(key_values)
+        assert merged.array('max')[index] == key_values.max()
+        groups, distinct, counts = merged.table('values')
+        assert dict(zip(distinct[groups == index], counts[groups == index])) == dict(zip(*np.unique(key_values, return_counts=True)))
+    # merged under other keys, groups can be left out, or combined.
+    combined = GroupedAggregates().merge(merged, [None if key == 'd' else 'abc' for key in merged.keys])
+    assert combined.keys == ['abc']
+    assert combined.array('count').tolist() == [(keys != 'd').sum()]
+    assert combined.table('values')[2].sum() == (keys != 'd').sum()
+
+
+def test_grouped_aggregates_limit():
+    merged = GroupedAggregates()
+    for values in ([5, 3, 5, 1], [9, 3, 7]):
+        chunk = GroupedAggregates()
+        chunk.index(['a', 'b'])
+        chunk.add_values('values', np.arange(len(values)) % 2, values, limit=2)
+        merged.merge(chunk)
+    groups, distinct, counts = merged.table('values')
+    assert dict(zip(distinct[groups == 0], counts[groups == 0])) == {5: 2, 9: 1}
+    assert dict(zip(distinct[groups == 1], counts[groups == 1])) == {3: 2, 1: 1}
@@ -0,0 +1,45 @@
+import gzip
+import os
+import tempfile
+
+import pytest
+
+from networkml.helpers.gzipio import BlockCompressor
+from networkml.helpers.gzipio import first_frame
+from networkml.helpers.gzipio import sniff_codec
+from networkml.helpers.gzipio import text_reader
+from networkml.helpers.gzipio import text_writer
+
+TEXT = ''.join('%u,%u\r\n' % (i, i * i) for i in range(20000))
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd', 'lz4', 'none'])
+@pytest.mark.parametrize('threads', [0, 2])
+def test_text_writer(codec, threads):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    elif codec == 'lz4':
+        pytest.importorskip('lz4.frame')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'out')
+        with text_writer(out_file, codec, threads=threads, header='a,b\r\n') as f_out:
+            f_out.write(TEXT)
+        assert sniff_codec(out_file) == codec
+        with text_reader(out_file) as f_in:
+            assert f_in.read() == 'a,b\r\n' + TEXT
+        if codec != 'none':
+            header, offset = first_frame(out_file)
+            assert header == b'a,b\r\n'
+            assert 0 < offset < os.path.getsize(out_file)
+
+
+def test_block_compressor():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'out.gz')
+        with BlockCompressor(open(out_file, 'wb'), threads=2, block_size=1000) as f_out:
+            for i in range(0, len(TEXT), 333):
+                f_out.write(TEXT[i:i + 333].encode())
+        with gzip.open(out_file, 'rt', newline='') as f_in:
+            assert f_in.read() == TEXT
+        # one gzip member per block.
+        assert first_frame(out_file)[0] == TEXT[:1000].encode()
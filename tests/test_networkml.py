@@ -1,5 +1,79 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import pytest
+
+import networkml.NetworkML
 from networkml.NetworkML import NetworkML
 
+TEST_PCAP = './tests/test_data/trace_ab12_2001-01-01_02_03-client-ip6-1-2-3-4.pcap'
+
 
 def test_smoke():
     instance = NetworkML()
+
+
+def test_watch(monkeypatch):
+    sleeps = []
+
+    def fake_sleep(secs):
+        sleeps.append(secs)
+        if len(sleeps) > 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(networkml.NetworkML.time, 'sleep', fake_sleep)
+    with tempfile.TemporaryDirectory() as watch_dir:
+        with tempfile.TemporaryDirectory() as out_dir:
+            shutil.copy(TEST_PCAP, watch_dir)
+            with pytest.raises(KeyboardInterrupt):
+                NetworkML(raw_args=['-e', 'native', '-l', 'host', '--watch', watch_dir,
+                                    '--watch_interval', '1', '-o', out_dir])
+            assert sleeps == [1, 1, 1]
+            result_dir = os.path.join(out_dir, os.path.splitext(os.path.basename(TEST_PCAP))[0])
+            with open(os.path.join(result_dir, 'predict.json')) as f_in:
+                assert json.load(f_in)
+
+
+def test_in_memory():
+    with tempfile.TemporaryDirectory() as file_dir:
+        with tempfile.TemporaryDirectory() as memory_dir:
+            NetworkML(raw_args=['-e', 'native', '-o', file_dir, TEST_PCAP])
+            NetworkML(raw_args=['-e', 'native', '-o', memory_dir, '--in_memory', TEST_PCAP])
+            # nothing is written between stages.
+            assert os.listdir(memory_dir) == ['predict.json']
+            with open(os.path.join(file_dir, 'predict.json')) as f_in:
+                file_results = json.load(f_in)
+            with open(os.path.join(memory_dir, 'predict.json')) as f_in:
+                memory_results = json.load(f_in)
+            assert file_results == memory_results
+
+
+def test_pipeline():
+    with tempfile.TemporaryDirectory() as in_dir:
+        with tempfile.TemporaryDirectory() as out_dir:
+            shutil.copy(TEST_PCAP, in_dir)
+            NetworkML(raw_args=['-e', 'native', '-l', 'host', '--pipeline', '--stage_threads', 'parser:1',
+                                '-o', out_dir, in_dir])
+            result_dir = os.path.join(out_dir, os.path.splitext(os.path.basename(TEST_PCAP))[0])
+            with open(os.path.join(result_dir, 'predict.json')) as f_in:
+                results = json.load(f_in)
+            assert results[0]['file_path'] == os.path.join(in_dir, os.path.basename(TEST_PCAP))
+
+
+def test_pipeline_stage_failure(caplog):
+    caplog.set_level(logging.INFO)
+    with tempfile.TemporaryDirectory() as in_dir:
+        with tempfile.TemporaryDirectory() as out_dir:
+            shutil.copy(TEST_PCAP, in_dir)
+            with open(os.path.join(in_dir, 'bad.pcap'), 'wb') as f_out:
+                f_out.write(b'not a pcap' * 10)
+            NetworkML(raw_args=['-e', 'native', '--pipeline', '-t', '2', '-o', out_dir, in_dir])
+            result_dir = os.path.join(out_dir, os.path.splitext(os.path.basename(TEST_PCAP))[0])
+            assert os.path.exists(os.path.join(result_dir, 'predict.json'))
+            assert not os.path.exists(os.path.join(out_dir, 'bad', 'predict.json'))
+    bad_path = os.path.join(in_dir, 'bad.pcap')
+    assert f'Could not run the parser stage for {bad_path}: no output from {bad_path}' in caplog.text
+    assert '1/2 done' in caplog.text and '2/2 done' not in caplog.text
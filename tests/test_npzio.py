@@ -0,0 +1,86 @@
+import ipaddress
+import os
+import tempfile
+
+import pandas as pd
+
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.npzio import concat_dfs
+from networkml.helpers.npzio import FrameRowWriter
+from networkml.helpers.npzio import import_frame
+from networkml.helpers.npzio import import_npz
+from networkml.helpers.npzio import import_pcap_chunks
+from networkml.helpers.npzio import import_pcap_df
+from networkml.helpers.npzio import NPZRowWriter
+from networkml.helpers.npzio import read_npz
+from networkml.helpers.npzio import write_npz
+
+
+def test_npz_round_trip():
+    df = pd.DataFrame({
+        'float': [1.5, None, 3.0],
+        'uint': pd.array([1, None, 3], dtype='UInt16'),
+        'bigint': [1, None, 2**127],
+        'str': ['a', None, "['1.2.3.4']"],
+        'int': [1, 2, 3],
+    })
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'test.npz')
+        write_npz(df, out_file)
+        pd.testing.assert_frame_equal(read_npz(out_file), df)
+        assert list(read_npz(out_file, columns={'int', 'str'}).columns) == ['str', 'int']
+
+
+def test_npz_row_writer():
+    rows = [
+        {'eth.src': '0e:00:00:00:00:01', 'eth.dst': '0e:00:00:00:00:02', 'frame.len': '60',
+         'frame.time_epoch': '1.5', 'frame.time_delta_displayed': '0.0', 'tcp.flags': '0x0012',
+         'ipv6.src': 'fc01::1', 'other': 99},
+        {'eth.src': '0e:00:00:00:00:02', 'eth.dst': '0e:00:00:00:00:01', 'frame.len': 70,
+         'frame.time_epoch': '2.5', 'frame.time_delta_displayed': '1.0', 'udp.srcport': ''},
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'test.npz')
+        with NPZRowWriter(out_file, buffer_rows=1) as writer:
+            writer.writerows(rows)
+        assert read_npz(out_file, columns={'other'})['other'].tolist() == ['99', None]
+        df = import_npz(out_file)
+        assert df['tcp.flags'].dtype == 'UInt16'
+        assert df['tcp.flags'].tolist() == [0x12, pd.NA]
+        assert df['frame.len'].tolist() == [60, 70]
+        assert df['eth.src'].tolist() == [0x0e0000000001, 0x0e0000000002]
+        assert df['ipv6.src'][0] == 0xfc010000000000000000000000000001
+        assert df['udp.srcport'].isna().all()
+        frames = {}
+        with FrameRowWriter(frames, 'test', buffer_rows=1) as writer:
+            writer.writerows(rows)
+        pd.testing.assert_frame_equal(import_frame(frames['test']), df)
+
+
+def test_import_pcap_chunks():
+    rows = [
+        {'eth.src': '0e:00:00:00:00:01', 'eth.dst': '0e:00:00:00:00:02', 'frame.len': '60',
+         'frame.time_epoch': '1.5', 'frame.time_delta_displayed': '0.0', 'ip.src': '192.168.0.1',
+         'ipv6.src': '', 'tcp.flags': '0x0012'},
+        {'eth.src': '0e:00:00:00:00:02', 'eth.dst': '0e:00:00:00:00:01', 'frame.len': '70',
+         'frame.time_epoch': '2.5', 'frame.time_delta_displayed': '1.0', 'ip.src': '',
+         'ipv6.src': 'fc01::1', 'tcp.flags': ''},
+        {'eth.src': '0e:00:00:00:00:01', 'eth.dst': '0e:00:00:00:00:02', 'frame.len': '80',
+         'frame.time_epoch': '3.5', 'frame.time_delta_displayed': '1.0', 'ip.src': '',
+         'ipv6.src': 'fc01::2', 'tcp.flags': '0x0010'},
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for in_file in (os.path.join(tmpdir, 'test.csv.gz'), os.path.join(tmpdir, 'test.npz')):
+            if in_file.endswith('.npz'):
+                with NPZRowWriter(in_file) as writer:
+                    writer.writerows(rows)
+            else:
+                with CSVRowWriter(in_file) as writer:
+                    writer.writerows(rows)
+            df = import_pcap_df(in_file)
+            chunks = list(import_pcap_chunks(in_file, 2))
+            assert [len(chunk) for chunk in chunks] == [2, 1]
+            # a chunk has the types the whole file does, though it has no null IPs.
+            pd.testing.assert_frame_equal(concat_dfs(chunks)[df.columns], df)
+            # IPv6 addresses are exact, though the first is null.
+            assert df['ipv6.src'].dropna().tolist() == [int(ipaddress.ip_address('fc01::1')), int(ipaddress.ip_address('fc01::2'))]
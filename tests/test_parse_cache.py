@@ -0,0 +1,45 @@
+import os
+import tempfile
+import time
+
+from networkml.helpers.parse_cache import ParseCache
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f_out:
+        f_out.write(data)
+
+
+def test_parse_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = ParseCache(os.path.join(tmpdir, 'cache'), max_bytes=250)
+        in_file = os.path.join(tmpdir, 'in.pcap')
+        out_file = os.path.join(tmpdir, 'out.csv.gz')
+        write_file(in_file, b'pcap')
+        key = cache.key(in_file, 'native', 'packet')
+        assert key != cache.key(in_file, 'tshark', 'packet')
+        assert not cache.get(key, out_file)
+        write_file(out_file, b'x' * 100)
+        cache.put(key, out_file)
+        os.remove(out_file)
+        assert cache.get(key, out_file)
+        with open(out_file, 'rb') as f_in:
+            assert f_in.read() == b'x' * 100
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # same content under another name is the same entry.
+        copy_file = os.path.join(tmpdir, 'copy.pcap')
+        write_file(copy_file, b'pcap')
+        assert cache.key(copy_file, 'native', 'packet') == key
+
+        # least recently used entries go first once over max_bytes.
+        keys = [key]
+        for i in range(2):
+            time.sleep(0.01)
+            keys.append(cache.key(in_file, 'native', 'packet', i))
+            cache.put(keys[-1], out_file)
+        assert sorted(os.listdir(cache.cache_dir)) == sorted(keys[1:])
+        time.sleep(0.01)
+        assert cache.get(keys[1], out_file)
+        cache.put(key, out_file)
+        assert sorted(os.listdir(cache.cache_dir)) == sorted([key, keys[1]])
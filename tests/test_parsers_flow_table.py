@@ -0,0 +1,43 @@
+from networkml.parsers.flow_table import FlowTable
+from networkml.parsers.native import NS_PER_SEC
+
+
+def udp_row(src, src_port, dst, dst_port):
+    return {'ip.src': src, 'ip.dst': dst, 'udp.srcport': src_port, 'udp.dstport': dst_port}
+
+
+def test_flow_table_directions():
+    table = FlowTable()
+    assert table.add(0, 100, udp_row('10.0.0.1', 1025, '10.0.0.2', 53)) == []
+    assert table.add(NS_PER_SEC, 200, udp_row('10.0.0.2', 53, '10.0.0.1', 1025)) == []
+    assert table.add(2 * NS_PER_SEC, 60, {'arp.opcode': 1}) == []
+    flows = table.close_all()
+    assert flows == [{
+        'Source': '10.0.0.1',
+        'Source Port': 1025,
+        'Destination': '10.0.0.2',
+        'Destination Port': 53,
+        'Transport Protocol': 'UDP',
+        'Frames to Source': 1,
+        'Bytes to Source': 200,
+        'Frames to Destination': 1,
+        'Bytes to Destination': 100,
+        'Total Frames': 2,
+        'Total Bytes': 300,
+        'Relative Start': '0.000000000',
+        'Duration': '1.0000',
+    }]
+    assert not table.flows
+
+
+def test_flow_table_eviction():
+    table = FlowTable(timeout=10, max_flows=2)
+    for port in (1, 2, 3):
+        closed = table.add(port * NS_PER_SEC, 100, udp_row('10.0.0.1', port, '10.0.0.2', 53))
+    assert [flow['Source Port'] for flow in closed] == [1]
+    assert table.cap_closed == 1
+    table.add(3 * NS_PER_SEC, 100, udp_row('10.0.0.2', 53, '10.0.0.1', 2))
+    closed = table.add(14 * NS_PER_SEC, 100, {})
+    assert [flow['Source Port'] for flow in closed] == [3, 2]
+    assert table.idle_closed == 2
+    assert not table.flows
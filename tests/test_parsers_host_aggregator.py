@@ -0,0 +1,124 @@
+import argparse
+import ipaddress
+import os
+import tempfile
+
+import netaddr
+import pandas as pd
+
+from networkml.featurizers.funcs.host import Host
+from networkml.helpers.csv_row_writer import CSVRowWriter
+from networkml.helpers.pandas_csv_importer import import_csv
+from networkml.helpers.sketches import QuantileSketch
+from networkml.parsers.host_aggregator import ColumnStats
+from networkml.parsers.host_aggregator import HostAggregator
+
+
+def tshark_row(eth_src, eth_dst, ip_src, ip_dst, proto, srcport, dstport, frame_len, ts, vlan=None):
+    row = {
+        'eth.src': eth_src,
+        'eth.dst': eth_dst,
+        'eth.type': '0x0800',
+        'frame.len': frame_len,
+        'frame.time_epoch': '%f' % ts,
+        'frame.time_delta_displayed': '0.%06u' % (frame_len * 7 % 1000),
+        'frame.protocols': 'eth:ethertype:ip:%s' % proto,
+        'ip.version': 4,
+        'ip.src': ip_src,
+        'ip.dst': ip_dst,
+        'ip.dsfield': '0x%02x' % (frame_len % 256),
+        'ip.flags': '0x02',
+        'ip.proto': {'tcp': 6, 'udp': 17}[proto],
+        '%s.srcport' % proto: srcport,
+        '%s.dstport' % proto: dstport,
+    }
+    if proto == 'tcp':
+        row['tcp.flags'] = '0x%04x' % (frame_len % 0x200)
+    if vlan:
+        row['vlan.id'] = vlan
+    return row
+
+
+def test_column_stats():
+    for values in ([5], [3, 1, 2, 2], [0.5, 0.25, 10.0, 0.125, 3.0]):
+        stats = ColumnStats()
+        for val in values:
+            stats.add(val)
+        col = pd.Series(values)
+        calcs = stats.calcs()
+        for calc_name, calc_func in Host.CALC_COL_FUNCS:
+            expected = calc_func(col)
+            if pd.isnull(expected):
+                expected = 0
+            assert abs(calcs[calc_name] - expected) < 1e-9, (calc_name, values)
+    assert ColumnStats().calcs()['median'] == 0
+
+
+def test_column_stats_sketch():
+    values = [1 + i / 10000 for i in range(10000)]
+    stats = ColumnStats(QuantileSketch(0.01))
+    for val in values:
+        stats.add(val)
+    # counts are per bucket, not per value.
+    assert len(stats.values) < 100
+    col = pd.Series(values)
+    calcs = stats.calcs()
+    for calc_name, calc_func in Host.CALC_COL_FUNCS:
+        expected = calc_func(col)
+        if calc_name in ('median', '25q', '75q'):
+            assert abs(calcs[calc_name] - expected) <= 0.01 * expected, calc_name
+        else:
+            assert abs(calcs[calc_name] - expected) < 1e-9, calc_name
+
+
+def test_host_aggregator():
+    macs = ['0e:00:00:00:00:0%u' % i for i in range(1, 4)]
+    rows = []
+    for i in range(60):
+        src = macs[i % 3]
+        dst = macs[(i + 1) % 3] if i % 5 else 'ff:ff:ff:ff:ff:ff'
+        proto = 'tcp' if i % 2 else 'udp'
+        rows.append(tshark_row(
+            src, dst, '192.168.0.%u' % (i % 3 + 1), '10.0.0.%u' % (i % 4),
+            proto, (22, 53, 1900, 40000)[i % 4], (1025, 443, 5353, 80)[i % 4],
+            60 + i * 13 % 200, 1500000000 + i, vlan=7 if i == 11 else None))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_file = os.path.join(tmpdir, 'test.csv.gz')
+        with CSVRowWriter(csv_file) as writer:
+            writer.writerows(rows)
+        df = import_csv(csv_file)
+    parsed_args = argparse.Namespace(srcmacid=False)
+    expected = {row['host_key']: row for row in Host().host_tshark_all(df, parsed_args)}
+
+    aggregator = HostAggregator(quantile_error=None)
+    aggregator.writerows(rows)
+    assert aggregator.packets == 60
+    host_rows = aggregator.host_rows()
+    assert [row['host_key'] for row in host_rows] == macs
+    for row in host_rows:
+        expected_row = expected[row['host_key']]
+        assert list(row) == list(expected_row)
+        for col, val in row.items():
+            if col == 'tshark_srcips':
+                assert sorted(val) == sorted(expected_row[col])
+            elif isinstance(val, str):
+                assert val == expected_row[col]
+            else:
+                assert abs(val - expected_row[col]) < 1e-6, col
+    assert host_rows[1]['tshark_tagged_vlan'] == 0
+    assert host_rows[2]['tshark_tagged_vlan'] == 1
+
+    sketch_aggregator = HostAggregator()
+    sketch_aggregator.writerows(rows)
+    for row, sketch_row in zip(host_rows, sketch_aggregator.host_rows()):
+        assert list(sketch_row) == list(row)
+        for col, val in row.items():
+            if col.split('_')[1] in ('median', '25q', '75q'):
+                assert abs(sketch_row[col] - val) <= 0.01 * abs(val), col
+            else:
+                assert sketch_row[col] == val, col
+
+    src_rows = aggregator.host_rows(srcmacid=True)
+    assert len(src_rows) == 1
+    assert src_rows[0]['host_key'] in macs
@@ -0,0 +1,113 @@
+import io
+import os
+import struct
+import tempfile
+
+from networkml.parsers.native import decode_ethernet
+from networkml.parsers.native import format_ns
+from networkml.parsers.native import packet_rows
+from networkml.parsers.native import PcapReader
+from networkml.parsers.native import shard_packet_rows
+
+TEST_PCAP = './tests/test_data/trace_ab12_2001-01-01_02_03-client-ip6-1-2-3-4.pcap'
+ETH_HDR = bytes.fromhex('0e0000000002' '0e0000000001')
+
+
+def ipv4_tcp_frame(vlan=False):
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0x10, 40, 1, 0x4000, 64, 6, 0,
+                     bytes([192, 168, 0, 1]), bytes([192, 168, 0, 2]))
+    tcp = struct.pack('!HHIIHHHH', 1025, 22, 0, 0, 0x5012, 0, 0, 0)
+    if vlan:
+        return ETH_HDR + struct.pack('!HHH', 0x8100, 99, 0x0800) + ip + tcp
+    return ETH_HDR + struct.pack('!H', 0x0800) + ip + tcp
+
+
+def test_decode_ipv4_tcp():
+    row = decode_ethernet(ipv4_tcp_frame())
+    assert row == {
+        'eth.dst': '0e:00:00:00:00:02',
+        'eth.src': '0e:00:00:00:00:01',
+        'eth.type': '0x0800',
+        'ip.version': 4,
+        'ip.dsfield': '0x10',
+        'ip.flags': '0x02',
+        'ip.proto': 6,
+        'ip.src': '192.168.0.1',
+        'ip.src_host': '192.168.0.1',
+        'ip.dst': '192.168.0.2',
+        'ip.dst_host': '192.168.0.2',
+        'tcp.srcport': 1025,
+        'tcp.dstport': 22,
+        'tcp.flags': '0x0012',
+        'frame.protocols': 'eth:ethertype:ip:tcp',
+    }
+
+
+def test_decode_vlan_arp():
+    row = decode_ethernet(ipv4_tcp_frame(vlan=True))
+    assert row['eth.type'] == '0x8100'
+    assert row['vlan.id'] == 99
+    assert row['vlan.etype'] == '0x0800'
+    assert row['frame.protocols'] == 'eth:ethertype:vlan:ethertype:ip:tcp'
+    arp = ETH_HDR + struct.pack('!HHHBBH', 0x0806, 1, 0x0800, 6, 4, 2) + bytes(20)
+    row = decode_ethernet(arp)
+    assert row['arp.opcode'] == 2
+    assert row['frame.protocols'] == 'eth:ethertype:arp'
+
+
+def test_format_ns():
+    assert format_ns(0) == '0.000000000'
+    assert format_ns(1579736376152412000) == '1579736376.152412000'
+    assert format_ns(-1000) == '-0.000001000'
+
+
+def test_pcap_reader():
+    rows = list(packet_rows(PcapReader(TEST_PCAP)))
+    assert len(rows) == 290
+    assert rows[0]['frame.time_delta_displayed'] == '0.000000000'
+    assert rows[0]['ipv6.src'] == '::1'
+    assert {row['frame.protocols'] for row in rows} == {
+        'eth:ethertype:ipv6:tcp', 'eth:ethertype:ipv6:udp', 'eth:ethertype:ipv6:icmpv6'}
+    with open(TEST_PCAP, 'rb') as f_in:
+        assert list(packet_rows(PcapReader(io.BytesIO(f_in.read())))) == rows
+
+
+def test_pcapng_reader():
+    frame = ipv4_tcp_frame()
+    frame_pad = frame + bytes(-len(frame) % 4)
+    shb = struct.pack('<IIIHHq', 0x0a0d0d0a, 28, 0x1a2b3c4d, 1, 0, -1) + struct.pack('<I', 28)
+    tsresol = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)
+    idb_len = 20 + len(tsresol)
+    idb = struct.pack('<IIHHI', 1, idb_len, 1, 0, 65535) + tsresol + struct.pack('<I', idb_len)
+    epbs = b''
+    epb_len = 32 + len(frame_pad)
+    for ts in (1500000000123456789, 1500000000123456999):
+        epbs += struct.pack('<IIIIIII', 6, epb_len, 0, ts >> 32, ts & 0xffffffff, len(frame), len(frame)) + \
+            frame_pad + struct.pack('<I', epb_len)
+    rows = list(packet_rows(PcapReader(io.BytesIO(shb + idb + epbs))))
+    assert len(rows) == 2
+    assert rows[0]['frame.time_epoch'] == '1500000000.123456789'
+    assert rows[1]['frame.time_delta_displayed'] == '0.000000210'
+    assert rows[1]['frame.len'] == len(frame)
+    assert rows[1]['tcp.dstport'] == 22
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pcapng = os.path.join(tmpdir, 'test.pcapng')
+        with open(pcapng, 'wb') as f_out:
+            f_out.write(shb + idb + epbs)
+        shards = PcapReader(pcapng).shards(1)
+        assert len(shards) == 2
+        shard_rows = []
+        for shard in shards:
+            shard_rows.extend(shard_packet_rows(pcapng, shard))
+        assert shard_rows == rows
+
+
+def test_pcap_shards():
+    rows = list(packet_rows(PcapReader(TEST_PCAP)))
+    shards = PcapReader(TEST_PCAP).shards(100000)
+    assert len(shards) > 10
+    assert shards[0]['last_ts'] is None
+    shard_rows = []
+    for shard in shards:
+        shard_rows.extend(shard_packet_rows(TEST_PCAP, shard))
+    assert shard_rows == rows
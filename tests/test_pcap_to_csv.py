@@ -1,10 +1,25 @@
+import gzip
+import io
+import json
 import os
 import shutil
 import sys
+import tarfile
 import tempfile
 
+import pandas as pd
+import pytest
+
+from networkml.featurizers.csv_to_features import CSVToFeatures
+from networkml.helpers.gzipio import gzip_reader
+from networkml.helpers.npzio import import_npz
+from networkml.helpers.parse_cache import ParseCache
+from networkml.helpers.pandas_csv_importer import import_csv
+from networkml.helpers.pandas_csv_importer import WS_FIELDS
 from networkml.parsers.pcap_to_csv import PCAPToCSV
 
+TEST_PCAP = './tests/test_data/trace_ab12_2001-01-01_02_03-client-ip6-1-2-3-4.pcap'
+
 
 def test_PCAPToCSV_pyshark_packet():
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -32,3 +47,195 @@ def test_ispcap():
     a = 'fooo.capture'
     answer = PCAPToCSV.ispcap(a)
     assert answer == True
+    for a in ('fooo.pcap.gz', 'fooo.pcapng.zst', 'fooo.tar', 'fooo.tar.gz', 'fooo.tgz'):
+        assert PCAPToCSV.ispcap(a)
+    assert not PCAPToCSV.ispcap('fooo.csv.gz')
+
+
+def test_PCAPToCSV_native_packet():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = os.path.join(tmpdir, 'networkml_test.pcap.csv.gz')
+        instance = PCAPToCSV(raw_args=['-e', 'native', '-o', out_file, TEST_PCAP])
+        assert instance.main() == out_file
+        df = import_csv(out_file)
+        assert len(df) == 290
+        assert 5201 in set(df['tcp.dstport'].dropna())
+
+
+def test_tshark_fields_options():
+    options = PCAPToCSV.tshark_fields_options()
+    fields = {options[i + 1] for i, option in enumerate(options) if option == '-e'}
+    assert fields == set(WS_FIELDS)
+    assert 'separator=,' in options
+
+
+@pytest.mark.skipif(shutil.which('tshark') is None, reason='tshark is not installed')
+def test_PCAPToCSV_tshark_fields_packet():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_file = os.path.join(tmpdir, 'json.csv.gz')
+        fields_file = os.path.join(tmpdir, 'fields.csv.gz')
+        PCAPToCSV(raw_args=['-e', 'tshark', '-o', json_file, TEST_PCAP]).main()
+        PCAPToCSV(raw_args=['-e', 'tshark_fields', '-o', fields_file, TEST_PCAP]).main()
+        # tshark writes just the fields the featurizers use, and import_csv reads just those
+        # from the JSON engine's CSV, with any no packet had as nulls.
+        fields_cols = list(pd.read_csv(fields_file, nrows=0).columns)
+        assert sorted(fields_cols) == sorted(WS_FIELDS)
+        json_df = import_csv(json_file)
+        fields_df = import_csv(fields_file)
+        assert len(fields_df) == 290
+        pd.testing.assert_frame_equal(fields_df[fields_cols], json_df[fields_cols], check_dtype=False)
+
+
+def test_json_packet_records():
+
+    class FakeProcess():
+
+        def __init__(self, output):
+            self.stdout = io.BytesIO(output)
+
+    packets = [
+        {'_source': {'layers': {'frame': {'frame.len': str(i), 'frame.comment': 'caf\u00e9 [{,}]'}}}}
+        for i in range(3)]
+    output = '[\n' + '\n,\n'.join(json.dumps(packet, indent=2) for packet in packets) + '\n]\n'
+    instance = PCAPToCSV()
+    for chunk_size in (7, 1 << 20):
+        records = instance.json_packet_records(
+            FakeProcess(output.encode('utf-8')), chunk_size=chunk_size)
+        assert list(records) == packets
+    assert instance.json_records == 6
+    assert instance.json_bytes == len(output.encode('utf-8')) * 2
+
+
+def test_PCAPToCSV_native_shards():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for out_format in ('csv', 'npz'):
+            out_file = os.path.join(tmpdir, 'whole.' + out_format)
+            shards_file = os.path.join(tmpdir, 'shards.' + out_format)
+            PCAPToCSV(raw_args=['-e', 'native', '-F', out_format, '-o', out_file, TEST_PCAP]).main()
+            PCAPToCSV(raw_args=['-e', 'native', '-F', out_format, '-t', '2', '--shard_size', '1',
+                                '-o', shards_file, TEST_PCAP]).main()
+            if out_format == 'csv':
+                with gzip_reader(out_file) as whole, gzip_reader(shards_file) as shards:
+                    assert whole.read() == shards.read()
+            else:
+                assert import_npz(out_file).equals(import_npz(shards_file))
+        assert sorted(os.listdir(tmpdir)) == ['shards.csv', 'shards.npz', 'whole.csv', 'whole.npz']
+
+
+def test_PCAPToCSV_native_shard_failure():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shards_file = os.path.join(tmpdir, 'shards.csv')
+        # the first shard can't be written, so the whole file fails whenever its sibling finishes.
+        os.symlink(os.path.join(tmpdir, 'missing', 'part'), shards_file + '.shard0')
+        assert PCAPToCSV(raw_args=['-e', 'native', '-t', '2', '--shard_size', '1',
+                                   '-o', shards_file, TEST_PCAP]).main() is None
+        assert os.listdir(tmpdir) == ['shards.csv.shard0']
+
+
+def test_PCAPToCSV_failed_parse():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bad_pcap = os.path.join(tmpdir, 'bad.pcap')
+        with open(bad_pcap, 'wb') as f_out:
+            f_out.write(b'not a pcap' * 10)
+        out_dir = os.path.join(tmpdir, 'out')
+        os.mkdir(out_dir)
+        for level in ('packet', 'host'):
+            assert PCAPToCSV(raw_args=['-e', 'native', '-l', level, '-o', out_dir, bad_pcap]).main() is None
+            assert os.listdir(out_dir) == []
+
+
+def test_PCAPToCSV_native_host():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        packet_file = os.path.join(tmpdir, 'packet.csv.gz')
+        host_file = os.path.join(tmpdir, 'host.csv.gz')
+        features_file = os.path.join(tmpdir, 'packet.features.gz')
+        PCAPToCSV(raw_args=['-e', 'native', '-o', packet_file, TEST_PCAP]).main()
+        CSVToFeatures(raw_args=['-o', features_file, packet_file]).main()
+        PCAPToCSV(raw_args=['-e', 'native', '-l', 'host', '--exact_quantiles', '-o', host_file, TEST_PCAP]).main()
+        host_df = pd.read_csv(host_file)
+        features_df = pd.read_csv(features_file)
+        assert list(host_df.columns) == list(features_df.columns)
+        assert host_df['host_key'].tolist() == ['00:00:00:00:00:00']
+        pd.testing.assert_frame_equal(host_df, features_df, check_dtype=False)
+
+
+def test_PCAPToCSV_native_flow():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        packet_file = os.path.join(tmpdir, 'packet.csv.gz')
+        flow_file = os.path.join(tmpdir, 'flow.csv.gz')
+        PCAPToCSV(raw_args=['-e', 'native', '-o', packet_file, TEST_PCAP]).main()
+        PCAPToCSV(raw_args=['-e', 'native', '-l', 'flow', '-o', flow_file, TEST_PCAP]).main()
+        packet_df = pd.read_csv(packet_file)
+        flow_df = pd.read_csv(flow_file)
+        for proto in ('tcp', 'udp'):
+            proto_packets = packet_df[packet_df['%s.srcport' % proto].notna()]
+            proto_flows = flow_df[flow_df['Transport Protocol'] == proto.upper()]
+            assert proto_flows['Total Frames'].sum() == len(proto_packets)
+            assert proto_flows['Total Bytes'].sum() == proto_packets['frame.len'].sum()
+        assert len(flow_df) == 4
+        assert flow_df['Destination Port'].tolist().count(5201) == 4
+        assert (flow_df['Frames to Source'] > 0).all()
+
+
+def test_PCAPToCSV_codec():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gzip_file = os.path.join(tmpdir, 'packet.csv.gz')
+        plain_file = os.path.join(tmpdir, 'packet.csv')
+        PCAPToCSV(raw_args=['-e', 'native', '-o', gzip_file, TEST_PCAP]).main()
+        PCAPToCSV(raw_args=['-e', 'native', '--codec', 'none', '--compress_threads', '2', '-o', plain_file, TEST_PCAP]).main()
+        pd.testing.assert_frame_equal(import_csv(gzip_file), import_csv(plain_file))
+
+
+def test_PCAPToCSV_compressed_and_tar():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        in_dir = os.path.join(tmpdir, 'in')
+        os.mkdir(in_dir)
+        with open(TEST_PCAP, 'rb') as f_in:
+            pcap = f_in.read()
+        with gzip.open(os.path.join(in_dir, 'one.pcap.gz'), 'wb') as f_out:
+            f_out.write(pcap)
+        with tarfile.open(os.path.join(in_dir, 'traces.tar.gz'), 'w:gz') as tar_file:
+            tar_file.add(TEST_PCAP, arcname='two.pcap')
+            tar_file.add(os.path.join(in_dir, 'one.pcap.gz'), arcname='sub/three.pcap.gz')
+            tar_file.add(__file__, arcname='notes.txt')
+        expected = os.path.join(tmpdir, 'expected.csv.gz')
+        PCAPToCSV(raw_args=['-e', 'native', '-o', expected, TEST_PCAP]).main()
+        expected_df = import_csv(expected)
+
+        out_dir = os.path.join(tmpdir, 'out')
+        for threads in ('1', '2'):
+            assert PCAPToCSV(raw_args=['-e', 'native', '-t', threads, '-o', out_dir, in_dir]).main() == out_dir
+            assert sorted(os.listdir(out_dir)) == ['one.pcap.csv.gz', 'sub_three.pcap.csv.gz', 'two.pcap.csv.gz']
+            for out_file in os.listdir(out_dir):
+                pd.testing.assert_frame_equal(import_csv(os.path.join(out_dir, out_file)), expected_df)
+            shutil.rmtree(out_dir)
+
+
+def test_PCAPToCSV_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_dir = os.path.join(tmpdir, 'cache')
+        for out_file, hits in (('first.csv.gz', 0), ('second.csv.gz', 1)):
+            out_file = os.path.join(tmpdir, out_file)
+            instance = PCAPToCSV(raw_args=['-e', 'native', '--cache_dir', cache_dir, '-o', out_file, TEST_PCAP])
+            instance.main()
+            assert (instance.cache.hits, instance.cache.misses) == (hits, 1 - hits)
+        with gzip_reader(os.path.join(tmpdir, 'first.csv.gz')) as first, gzip_reader(out_file) as second:
+            assert first.read() == second.read()
+        instance = PCAPToCSV(raw_args=['-e', 'native', '-l', 'flow', '--cache_dir', cache_dir, '-o', out_file, TEST_PCAP])
+        instance.main()
+        assert instance.cache.misses == 1
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_PCAPToCSV_cache_key_combined():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        instance = PCAPToCSV()
+        instance.codec = 'gzip'
+        instance.srcmacid = True
+        instance.cache = ParseCache(tmpdir, 0)
+        instance.combined = True
+        keys = [instance.cache_key('packet', TEST_PCAP, out_file, 'native', 'csv')
+                for out_file in ('a/first.csv.gz', 'b/first.csv.gz', 'a/second.csv.gz')]
+        # keyed by the filename column written from the output, not by the input's name.
+        assert keys[0] == keys[1]
+        assert keys[0] != keys[2]
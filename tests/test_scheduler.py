@@ -0,0 +1,92 @@
+import argparse
+import concurrent.futures
+import logging
+import os
+import tempfile
+import threading
+
+import pytest
+
+from networkml.helpers.scheduler import auto_threads
+from networkml.helpers.scheduler import cpu_count
+from networkml.helpers.scheduler import largest_first
+from networkml.helpers.scheduler import stage_threads_arg
+from networkml.helpers.scheduler import StagePipeline
+from networkml.helpers.scheduler import threads_arg
+from networkml.helpers.scheduler import timed_call
+from networkml.helpers.scheduler import WorkerStats
+
+
+def test_threads_arg():
+    assert threads_arg('auto') == 'auto'
+    assert threads_arg('4') == 4
+    with pytest.raises(argparse.ArgumentTypeError):
+        threads_arg('many')
+
+
+def test_stage_threads_arg():
+    assert stage_threads_arg('parser:3,algorithm:1') == {'parser': 3, 'algorithm': 1}
+    for val in ('parser', 'parser:x', 'parser:0'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            stage_threads_arg(val)
+
+
+def test_auto_threads():
+    assert 1 <= auto_threads() <= cpu_count()
+    assert auto_threads(tasks=1) == 1
+    assert auto_threads(worker_bytes=2**60) == 1
+
+
+def test_largest_first():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for i, size in enumerate((10, 30, 20)):
+            paths.append(os.path.join(tmpdir, str(i)))
+            with open(paths[-1], 'wb') as f_out:
+                f_out.write(bytes(size))
+        paths.append(os.path.join(tmpdir, 'missing'))
+        assert largest_first(paths) == [1, 2, 0, 3]
+
+
+def test_worker_stats(caplog):
+    stats = WorkerStats()
+    result, pid, start_time, end_time = timed_call(sum, (1, 2))
+    assert result == 3
+    assert pid == os.getpid()
+    stats.add(pid, start_time, end_time)
+    with caplog.at_level(logging.INFO):
+        stats.report(logging.getLogger(__name__), 1)
+    assert '1 tasks' in caplog.text
+
+
+def test_stage_pipeline():
+    lock = threading.Lock()
+    running = {'add': 0, 'double': 0}
+    most = {'add': 0, 'double': 0}
+
+    def stage(name, func):
+        def run(item, result):
+            with lock:
+                running[name] += 1
+                most[name] = max(most[name], running[name])
+            try:
+                if item == 3 and name == 'double':
+                    raise ValueError('bad item')
+                return func(result)
+            finally:
+                with lock:
+                    running[name] -= 1
+        return (name, run)
+
+    stages = [stage('add', lambda x: x + 1), stage('double', lambda x: x * 2)]
+    results = sorted(StagePipeline(stages).run(range(5)), key=lambda x: x[0])
+    assert [(item, result) for item, result, err in results if err is None] == [(0, 2), (1, 4), (2, 6), (4, 10)]
+    assert results[3][2].stage == 'double' and isinstance(results[3][2].err, ValueError)
+    assert str(results[3][2]) == 'double stage failed: bad item'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        pipeline = StagePipeline(stages, executor, 3, {'double': 1})
+        results = sorted(pipeline.run(range(5)), key=lambda x: x[0])
+    assert [(item, result) for item, result, err in results if err is None] == [(0, 2), (1, 4), (2, 6), (4, 10)]
+    assert results[3][2].stage == 'double' and isinstance(results[3][2].err, ValueError)
+    assert most['double'] == 1
+    assert sum(pipeline.stats.tasks.values()) == 9
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from networkml.helpers.sketches import DistinctSketch
+from networkml.helpers.sketches import QuantileSketch
+
+
+def test_quantile_sketch():
+    sketch = QuantileSketch(0.02)
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.exponential(0.1, 1000), rng.integers(60, 1500, 1000), [0.0, -3.5]])
+    buckets = sketch.buckets(values)
+    assert buckets[-2] == 0
+    assert buckets[-1] < 0
+    approx = sketch.values(buckets)
+    assert np.all(np.abs(approx - values) <= 0.02 * np.abs(values))
+    for q in (0.25, 0.5, 0.75):
+        assert np.quantile(approx, q, method='lower') == pytest.approx(np.quantile(values, q, method='lower'), rel=0.02)
+    for relative_error in (0, 1, -0.1):
+        with pytest.raises(ValueError):
+            QuantileSketch(relative_error)
+
+
+def test_distinct_sketch():
+    sketch = DistinctSketch(0.03)
+    assert sketch.registers == 2048
+    assert sketch.error <= 0.03
+    values = ['10.0.%u.%u' % (i // 256, i % 256) for i in range(5000)]
+    groups = np.array([0] * 10 + [1] * 4990)
+    registers = sketch.group_registers(groups, values, 3)
+    estimates = sketch.estimates(registers)
+    assert estimates[0] == pytest.approx(10, abs=0.5)
+    assert estimates[1] == pytest.approx(4990, rel=3 * sketch.error)
+    assert estimates[2] == 0
+    # registers of parts of the values merge to the registers of all of them.
+    halves = np.maximum(
+        sketch.group_registers(groups[:2500], values[:2500], 3),
+        sketch.group_registers(groups[2500:], values[2500:], 3))
+    assert np.array_equal(halves, registers)
+    with pytest.raises(ValueError):
+        DistinctSketch(0)